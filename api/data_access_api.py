@@ -1,19 +1,37 @@
-from multiprocessing.pool import ThreadPool
 from zipfile import ZipFile, ZIP_STORED
 
+from base64 import urlsafe_b64decode, urlsafe_b64encode
 from boto.utils import JSONDecodeError
-from datetime import datetime
+from datetime import datetime, timedelta
+from mimetypes import guess_type
+from django.utils import timezone
 from flask import Blueprint, request, abort, json, Response
 
 from config import load_django
 
 from config.constants import (API_TIME_FORMAT, VOICE_RECORDING, ALL_DATA_STREAMS,
-    SURVEY_ANSWERS, SURVEY_TIMINGS, IMAGE_FILE)
+    SURVEY_ANSWERS, SURVEY_TIMINGS, IMAGE_FILE, DATA_ACCESS_TOKEN_SECONDS, SYNC_CURSOR_LAG_SECONDS,
+    CHUNKABLE_FILES, CHUNK_TIMESLICE_QUANTUM)
 from database.models import is_object_id
-from database.data_access_models import ChunkRegistry
+from database.data_access_models import ChunkRegistry, DataCoverage, DataExport, DataFreshness, SurveyAnswer
+from database.profiling_models import DataVolumeRollup
 from database.study_models import Study
 from database.user_models import Participant, Researcher
+from libs.adaptive_fetch import fetch_ordered, fetch_unordered
+from libs.binary_chunks import chunk_to_csv
+from libs.chunk_aggregation import (REDUCTIONS, aggregate_chunk, aggregates_to_csv, finish_aggregates,
+    merge_aggregates)
+from libs.data_access_tokens import create_access_token, get_token_study_access, StudyAccess
+from libs.data_coverage import hour_of, hour_to_datetime
+from libs.data_exports import (data_export_status, find_or_create_data_export,
+    stream_data_export)
+from libs.download_snapshots import (create_download_snapshot, decode_download_snapshot,
+    encode_download_snapshot, snapshot_chunks)
+from libs.parquet_export import ParquetStreamBuilder, parquet_available
+from libs.row_slicing import parse_millisecond_time, project_columns, project_line, slice_chunk
 from libs.s3 import s3_retrieve, s3_upload
+from libs.streaming_archives import (ARCHIVE_FORMATS, ZIP_ARCHIVE, archive_file_extension,
+    archive_mimetype, create_streaming_archive)
 from libs.streaming_bytes_io import StreamingBytesIO
 
 from database.data_access_models import PipelineUpload, InvalidUploadParameterError, PipelineUploadTags
@@ -25,6 +43,8 @@ from database.data_access_models import PipelineUpload, InvalidUploadParameterEr
 
 data_access_api = Blueprint('data_access_api', __name__)
 
+EPOCH = datetime(1970, 1, 1)
+
 #########################################################################################
 
 def get_and_validate_study_id(chunked_download=False):
@@ -71,11 +91,38 @@ def _get_study_or_abort_404(study_object_id, study_pk):
 
 def get_and_validate_researcher(study):
     """
-    Finds researcher based on the secret key provided.
+    Finds researcher based on the secret key or access token provided.
     Returns 403 if researcher doesn't exist, is not credentialed on the study, or if
     the secret key does not match.
     """
+    study_access = get_and_validate_study_access()
+    if study.pk not in study_access.study_ids:
+        return abort(403)  # researcher is not credentialed for this study
     
+    return Researcher.objects.get(pk=study_access.researcher_id)
+
+
+def get_and_validate_study_access():
+    """
+    Returns the StudyAccess (the researcher id and the ids of the researcher's studies) of the
+    credentials provided, either an access token (see get_access_token) or the access key and
+    secret key.  Returns 403 if the token is invalid or expired, if the researcher doesn't exist,
+    or if the secret key does not match.
+    """
+    access_token = get_request_access_token()
+    if access_token:
+        study_access = get_token_study_access(access_token)
+        if study_access is None:
+            return abort(403)  # invalid or expired token
+        return study_access
+    
+    researcher = validate_researcher_credentials()
+    return StudyAccess(researcher.pk, frozenset(researcher.studies.values_list('pk', flat=True)))
+
+
+def validate_researcher_credentials():
+    """ Returns the Researcher of the access key and secret key provided, returns 403 if the
+    researcher doesn't exist or if the secret key does not match. """
     access_key_id = request.values["access_key"]
     access_secret = request.values["secret_key"]
     
@@ -84,15 +131,20 @@ def get_and_validate_researcher(study):
     except Researcher.DoesNotExist:
         return abort(403)  # access key DNE
     
-    if not researcher.studies.filter(pk=study.pk).exists():
-        return abort(403)  # researcher is not credentialed for this study
-    
     if not researcher.validate_access_credentials(access_secret):
         return abort(403)  # incorrect secret key
     
     return researcher
 
 
+def get_request_access_token():
+    """ The access token is provided as an "access_token" parameter or as a bearer token. """
+    authorization = request.headers.get("Authorization", "")
+    if authorization.startswith("Bearer "):
+        return authorization[len("Bearer "):].strip()
+    return request.values.get("access_token")
+
+
 #########################################################################################
 
 @data_access_api.route("/get-studies/v1", methods=['POST', "GET"])
@@ -101,23 +153,29 @@ def get_studies():
     Retrieve a dict containing the object ID and name of all Study objects that the user can access
     If a GET request, access_key and secret_key must be provided in the URL as GET params. If
     a POST request (strongly preferred!), access_key and secret_key must be in the POST
-    request body.
+    request body.  (Or an access token, see get_access_token.)
     :return: string: JSON-dumped dict {object_id: name}
     """
     
-    # Get the access keys
-    access_key = request.values["access_key"]
-    access_secret = request.values["secret_key"]
-    
-    try:
-        researcher = Researcher.objects.get(access_key_id=access_key)
-    except Researcher.DoesNotExist:
-        return abort(403)
-    
-    if not researcher.validate_access_credentials(access_secret):
-        return abort(403)  # incorrect secret key
-    
-    return json.dumps(dict(researcher.studies.values_list('object_id', 'name')))
+    study_access = get_and_validate_study_access()
+    return json.dumps(dict(
+        Study.objects.filter(pk__in=study_access.study_ids).values_list('object_id', 'name')
+    ))
+
+
+@data_access_api.route("/get-token/v1", methods=['POST'])
+def get_access_token():
+    """
+    Exchanges an access_key and secret_key for an access token.  Provide the token in the
+    "access_token" parameter, or in an "Authorization: Bearer <token>" header, of following
+    requests instead of the access_key and secret_key, this avoids validating the secret key on
+    every request.  Tokens expire after expires_in seconds.
+    :return: string: JSON-dumped dict {"access_token": token, "expires_in": seconds}
+    """
+    return json.dumps({
+        "access_token": create_access_token(validate_researcher_credentials()),
+        "expires_in": DATA_ACCESS_TOKEN_SECONDS,
+    })
 
 
 @data_access_api.route("/get-users/v1", methods=['POST', "GET"])
@@ -143,6 +201,22 @@ def get_data():
     JSON blobs: data streams, users - default to all
     Strings: date-start, date-end - format as "YYYY-MM-DDThh:mm:ss"
     optional: top-up = a file (registry.dat)
+    optional: archive_format = "zip" (the default, uncompressed), "zip_deflate" or "tar.gz"
+    optional: output_format = "csv" (the default, the chunks as they are stored) or "parquet", a
+        Parquet file per participant and data stream (see libs.parquet_export, large or changing
+        data streams are split into several files), files that are not csv data are included as
+        they are.  Can't be combined with the registry, sync_cursor or
+        resumable parameters.
+    optional: raw_chunks = "true", chunks stored in the binary encoding (see libs.binary_chunks)
+        are sent as they are stored, with the extension "bin", instead of as csv.
+    optional: sync_cursor = the sync cursor of the previous download ("" for the first one),
+        returns only the chunks that changed since the previous download, and a new sync cursor
+        (in the X-Sync-Cursor header and as the file "sync_cursor" in the zip).  The other
+        parameters should be the same on every download.  Takes precedence over the registry.
+    optional: resumable = "true", sends the files in a fixed order, and returns a snapshot token
+        in the X-Snapshot header.  An interrupted download is resumed by sending the same
+        parameters with snapshot = the token, and resume_from = the number of files received.
+        The files of the download are fixed when it starts (see libs.download_snapshots).
     cases handled:
         missing creds or study, invalid researcher or study, researcher does not have access
         researcher creds are invalid
@@ -161,104 +235,766 @@ def get_data():
     determine_users_for_db_query(query)  # select users
     determine_time_range_for_db_query(query)  # construct time ranges
     
+    raw_chunks = request.values.get("raw_chunks", "").lower() == "true"
+    
+    # resumed downloads have the snapshot of the download they resume.
+    snapshot = None
+    resume_from = 0
+    snapshot_query = dict(query, sync_cursor=request.values.get("sync_cursor"), raw_chunks=raw_chunks)
+    if "snapshot" in request.values:
+        snapshot = decode_download_snapshot(request.values["snapshot"], snapshot_query, study.pk)
+        if snapshot is None:
+            return abort(400)
+        resume_from = get_resume_from()
+    resumable = snapshot is not None or request.values.get("resumable", "").lower() == "true"
+    
+    sync_cursor = None
+    if "sync_cursor" in request.values:
+        changed_after, sync_cursor_time = determine_sync_window(request.values["sync_cursor"])
+        if snapshot is not None:
+            sync_cursor_time = decode_sync_cursor(snapshot.sync_cursor)
+        sync_cursor = encode_sync_cursor(sync_cursor_time)
+    
     # Do query (this is actually a generator)
-    if "registry" in request.values:
-        get_these_files = handle_database_query(study.pk, query, registry=parse_registry(request.values["registry"]))
+    if sync_cursor is not None:
+        get_these_files = handle_database_query(
+            study.pk, query, changed_after=changed_after, changed_until=sync_cursor_time
+        )
+    elif "registry" in request.values:
+        get_these_files = handle_database_query(
+            study.pk, query, registry=parse_registry(request.values["registry"])
+        )
     else:
         get_these_files = handle_database_query(study.pk, query, registry=None)
     
+    archive_format = request.values.get("archive_format", ZIP_ARCHIVE)
+    if archive_format not in ARCHIVE_FORMATS:
+        return abort(400)
+    
+    output_format = request.values.get("output_format", "csv")
+    if output_format == "parquet":
+        # Parquet files are per data stream, not per chunk, they can't be synced or resumed.
+        if "registry" in request.values or sync_cursor is not None or resumable or raw_chunks:
+            return abort(400)
+        if not parquet_available():
+            return abort(501)
+        zip_file_name = "data_study_{0}.{1}".format(study.object_id, archive_file_extension(archive_format))
+        return Response(
+            parquet_zip_generator(get_these_files, archive_format=archive_format),
+            mimetype=archive_mimetype(archive_format),
+            headers={'Content-Disposition': 'attachment; filename="{0}"'.format(zip_file_name)}
+        )
+    elif output_format != "csv":
+        return abort(400)
+    
+    download_args = {"archive_format": archive_format, "raw_chunks": raw_chunks}
+    headers = {}
+    if resumable:
+        if snapshot is None:
+            snapshot = create_download_snapshot(
+                study.pk, get_these_files, lambda chunk: determine_file_name(chunk, raw_chunks), sync_cursor
+            )
+        # the files come from the snapshot's chunk list, the client has the first resume_from.
+        chunk_ids = snapshot.get_chunk_ids()
+        all_chunks = ChunkRegistry.objects.filter(study_id=study.pk).values(*CHUNK_FIELDS)
+        get_these_files = snapshot_chunks(all_chunks, chunk_ids[resume_from:])
+        download_args.update(ordered=True, received_files=snapshot_chunks(all_chunks, chunk_ids[:resume_from]))
+        headers['X-Snapshot'] = encode_download_snapshot(snapshot, snapshot_query)
+    
     # If the request is from the web form we need to indicate that it is an attachment,
     # and don't want to create a registry file.
     # Oddly, it is the presence of  mimetype=zip that causes the streaming response to actually stream.
     if 'web_form' in request.values:
-        zip_file_name = "data_study_{0}.zip".format(study.object_id)
+        zip_file_name = "data_study_{0}.{1}".format(study.object_id, archive_file_extension(archive_format))
         if 'user_ids' in request.values:
             user_ids = request.form.getlist('user_ids')
             if len(user_ids) == 1:
-                zip_file_name = "data_participant_{0}.zip".format(user_ids[0])
+                zip_file_name = "data_participant_{0}.{1}".format(user_ids[0], archive_file_extension(archive_format))
 
+        headers['Content-Disposition'] = 'attachment; filename="{0}"'.format(zip_file_name)
         return Response(
-            zip_generator(get_these_files, construct_registry=False),
-            mimetype="zip",
-            headers={'Content-Disposition': 'attachment; filename="{0}"'.format(zip_file_name)}
+            zip_generator(get_these_files, construct_registry=False, **download_args),
+            mimetype=archive_mimetype(archive_format),
+            headers=headers
+        )
+    elif sync_cursor is not None:
+        headers['X-Sync-Cursor'] = sync_cursor
+        return Response(
+                zip_generator(get_these_files, sync_cursor=sync_cursor, **download_args),
+                mimetype=archive_mimetype(archive_format),
+                headers=headers
         )
     else:
         return Response(
-                zip_generator(get_these_files, construct_registry=True),
-                mimetype="zip"
+                zip_generator(get_these_files, construct_registry=True, **download_args),
+                mimetype=archive_mimetype(archive_format),
+                headers=headers
         )
 
 
 # from libs.security import generate_random_string
 
 # Note: you cannot access the request context inside a generator function
-def zip_generator(files_list, construct_registry=False):
-    """ Pulls in data from S3 in a multithreaded network operation, constructs a zip file of that
-    data. This is a generator, advantage is it starts returning data (file by file, but wrapped
-    in zip compression) almost immediately. """
+def zip_generator(files_list, construct_registry=False, sync_cursor=None, archive_format=ZIP_ARCHIVE,
+                  ordered=False, received_files=(), raw_chunks=False):
+    """ Pulls in data from S3 in a multithreaded network operation, constructs a zip file (or
+    other archive_format) of that data. This is a generator, advantage is it starts returning data
+    (file by file, but wrapped in zip compression) almost immediately.
+    If ordered the files are in the order of files_list.  received_files are the chunks of the
+    files the client already has (a resumed download), they are only added to the registry.
+    If raw_chunks binary chunks are not converted to csv. """
     
     processed_files = set()
     duplicate_files = set()
-    pool = ThreadPool(3)
-    # 3 Threads has been heuristically determined to be a good value, it does not cause the server
-    # to be overloaded, and provides more-or-less the maximum data download speed.  This was tested
-    # on an m4.large instance (dual core, 8GB of ram).
     file_registry = {}
+    archive = create_streaming_archive(archive_format)
+    
+    if construct_registry:
+        for chunk in received_files:
+            file_registry[chunk['chunk_path']] = chunk["chunk_hash"]
+    
+    def retrieve_and_encode(chunk):
+        # files are compressed on the fetching threads, not on the response generator.
+        chunk, file_contents = batch_retrieve_s3(chunk, raw_chunks)
+        return chunk, archive.encode_file(determine_file_name(chunk, raw_chunks), file_contents)
     
-    zip_output = StreamingBytesIO()
-    zip_input = ZipFile(zip_output, mode="w", compression=ZIP_STORED, allowZip64=True)
     # random_id = generate_random_string()[:32]
     # print "returning data for query %s" % random_id
     try:
-        # chunks_and_content is a list of tuples, of the chunk and the content of the file.
-        # chunksize (which is a keyword argument of imap, not to be confused with Beiwe Chunks)
-        # is the size of the batches that are handed to the pool. We always want to add the next
-        # file to retrieve to the pool asap, so we want a chunk size of 1.
-        # (In the documentation there are comments about the timeout, it is irrelevant under this construction.)
-        chunks_and_content = pool.imap_unordered(batch_retrieve_s3, files_list, chunksize=1)
+        # chunks_and_files is a list of tuples, of the chunk and the encoded file.  The
+        # files are fetched ahead of the client reading them, as many at a time as are needed to
+        # keep up with the client, see libs.adaptive_fetch.
+        fetch = fetch_ordered if ordered else fetch_unordered
+        chunks_and_files = fetch(retrieve_and_encode, files_list, encoded_file_size)
         total_size = 0
-        for chunk, file_contents in chunks_and_content:
+        for chunk, encoded_file in chunks_and_files:
             if construct_registry:
                 file_registry[chunk['chunk_path']] = chunk["chunk_hash"]
-            file_name = determine_file_name(chunk)
+            file_name = encoded_file.file_name
             if file_name in processed_files:
                 duplicate_files.add((file_name, chunk['chunk_path']))
                 continue
             processed_files.add(file_name)
             # print file_name
-            zip_input.writestr(file_name, file_contents)
+            archive.add_encoded_file(encoded_file)
             # These can be large, and we don't want them sticking around in memory as we wait for the yield
-            del file_contents, chunk
-            # print len(zip_output)
-            x = zip_output.getvalue()
+            del encoded_file, chunk
+            x = archive.read()
             total_size += len(x)
             # print "%s: %sK, %sM" % (random_id, total_size / 1024, total_size / 1024 / 1024)
             yield x  # yield the (compressed) file information
             del x
-            zip_output.empty()
         
         if construct_registry:
-            zip_input.writestr("registry", json.dumps(file_registry))
+            archive.add_file("registry", json.dumps(file_registry))
+        if sync_cursor is not None:
+            archive.add_file("sync_cursor", sync_cursor)
         
         # close, then yield all remaining data in the zip.
-        zip_input.close()
-        yield zip_output.getvalue()
-    
-    except None:
-        # The try-except-finally block is here to guarantee the Threadpool is closed and terminated.
-        # we don't handle any errors, we just re-raise any error that shows up.
-        # (with statement does not work.)
-        raise
+        yield archive.close()
+    
     finally:
-        # We rely on the finally block to ensure that the threadpool will be closed and terminated,
-        # and also to print an error to the log if we need to.
-        pool.close()
-        pool.terminate()
+        # We rely on the finally block to print an error to the log if we need to.
         if duplicate_files:
             duplcate_file_message = "encountered duplicate files: %s" % ",".join(
                     str(name_path) for name_path in duplicate_files)
 
 
+# Note: you cannot access the request context inside a generator function
+def parquet_zip_generator(files_list, archive_format=ZIP_ARCHIVE):
+    """ Like zip_generator, but the chunks of each participant's data stream are converted to
+    Parquet files.  The files are retrieved in order, a Parquet file is added to the zip when it is
+    complete (see libs.parquet_export, a data stream can be split into several files). """
+    archive = create_streaming_archive(archive_format)
+    files_list = files_list.order_by("participant__patient_id", "data_type", "survey__object_id", "time_bin")
+    chunks_and_content = fetch_ordered(batch_retrieve_s3, files_list, retrieved_file_size)
+    builder = None
+    
+    for chunk, file_contents in chunks_and_content:
+        if chunk["data_type"] not in CHUNKABLE_FILES:
+            # (audio recordings, images, etc.)
+            archive.add_file(determine_file_name(chunk), file_contents)
+            yield archive.read()
+            continue
+        
+        file_name = determine_parquet_file_name(chunk)
+        if builder is None or file_name != builder.file_name:
+            if builder is not None and add_parquet_file(archive, builder.finish()):
+                yield archive.read()
+            builder = ParquetStreamBuilder(file_name)
+        if add_parquet_file(archive, builder.add_chunk(file_contents)):
+            yield archive.read()
+        del file_contents, chunk
+    
+    if builder is not None:
+        add_parquet_file(archive, builder.finish())
+    yield archive.close()
+
+
+def add_parquet_file(archive, completed_file):
+    """ Adds a (file name, Parquet file) to the archive, returns whether there was a file. """
+    if completed_file is None:
+        return False
+    archive.add_file(*completed_file)
+    return True
+
+
+def determine_parquet_file_name(chunk):
+    if chunk["survey__object_id"]:
+        return "%s/%s/%s.parquet" % (chunk["participant__patient_id"], chunk["data_type"], chunk["survey__object_id"])
+    return "%s/%s.parquet" % (chunk["participant__patient_id"], chunk["data_type"])
+
+
+#########################################################################################
+################################# Manifest and Chunks ###################################
+#########################################################################################
+
+@data_access_api.route("/get-manifest/v1", methods=['POST', "GET"])
+def get_manifest():
+    """ Required: access key, access secret (or access token), study_id
+    Takes the query parameters of get-data (data_streams, user_ids, time_start, time_end).
+    Returns the chunks of the query as JSON lines, one object per chunk with its chunk_id,
+    chunk_path, data_type, time_bin, patient_id, chunk_hash, file_size (null if unknown) and
+    file_format (how the chunk is stored, "csv" or "binary"), in chunk_id order.  A chunk is downloaded with get-chunk, clients can download chunks in parallel
+    and cache them by hash (use an access token, validating the secret key is slow). """
+    study = get_and_validate_study_id(chunked_download=True)
+    get_and_validate_researcher(study)
+    
+    query = {}
+    determine_data_streams_for_db_query(query)  # select data streams
+    determine_users_for_db_query(query)  # select users
+    determine_time_range_for_db_query(query)  # construct time ranges
+    
+    chunks = ChunkRegistry.get_chunks_time_range(study.pk, **query).order_by("pk").values_list(
+        "pk", "chunk_path", "data_type", "time_bin", "participant__patient_id", "chunk_hash", "file_size",
+        "file_format"
+    )
+    return Response(manifest_generator(chunks), mimetype="application/x-ndjson")
+
+
+def manifest_generator(chunks):
+    # (iterator() does not keep the whole query result in memory)
+    for chunk_id, chunk_path, data_type, time_bin, patient_id, chunk_hash, file_size, file_format in chunks.iterator():
+        yield json.dumps({
+            "chunk_id": chunk_id,
+            "chunk_path": chunk_path,
+            "data_type": data_type,
+            "time_bin": time_bin.strftime(API_TIME_FORMAT),
+            "patient_id": patient_id,
+            "chunk_hash": chunk_hash,
+            "file_size": file_size,
+            "file_format": file_format,
+        }) + "\n"
+
+
+@data_access_api.route("/get-chunk/v1", methods=['POST', "GET"])
+def get_chunk():
+    """ Required: access key, access secret (or access token), study_id, chunk_id
+    optional: raw_chunks = "true", a binary chunk is returned as it is stored instead of as csv.
+    Returns the decrypted contents of a chunk of the study, with its hash as the ETag. """
+    study = get_and_validate_study_id(chunked_download=True)
+    get_and_validate_researcher(study)
+    
+    try:
+        chunk = ChunkRegistry.objects.filter(pk=int(request.values["chunk_id"]), study=study).values(
+            "pk", "participant_id", "data_type", "chunk_path", "time_bin", "chunk_hash",
+            "participant__patient_id", "study_id", "survey_id", "survey__object_id", "file_format"
+        ).get()
+    except (ValueError, ChunkRegistry.DoesNotExist):
+        return abort(404)
+    raw_chunks = request.values.get("raw_chunks", "").lower() == "true"
+    
+    # unchunkable data has no hash, chunk hashes are base64 with a trailing newline.  (The hash is
+    # of the csv, a binary chunk as it is stored has a different ETag.)
+    etag = chunk["chunk_hash"].strip()
+    if etag and raw_chunks and chunk["file_format"] == ChunkRegistry.BINARY_FORMAT:
+        etag += "-" + ChunkRegistry.BINARY_FORMAT
+    if etag and etag in request.if_none_match:
+        return Response(status=304, headers={'ETag': '"%s"' % etag})
+    
+    file_name = determine_file_name(chunk, raw_chunks)
+    headers = {'Content-Disposition': 'attachment; filename="{0}"'.format(file_name.rsplit("/", 1)[-1])}
+    if etag:
+        headers['ETag'] = '"%s"' % etag
+    return Response(
+        retrieve_chunk_contents(chunk["chunk_path"], study.object_id, raw_chunks),
+        mimetype=guess_type(file_name)[0] or "application/octet-stream",
+        headers=headers
+    )
+
+
+@data_access_api.route("/get-data-rows/v1", methods=['POST', "GET"])
+def get_data_rows():
+    """ Required: access key, access secret (or access token), study_id, data_stream, time_start,
+    time_end (formatted as "YYYY-MM-DDThh:mm:ss", optionally with milliseconds ".sss")
+    optional: user_ids (as in get-data), columns = a json list of column names
+    Returns a csv of the rows of the data stream from time_start up to (not including) time_end,
+    the first column is the patient_id followed by the requested columns (by default the columns of
+    the first chunk), ordered by participant and time.  Only the chunked data streams have rows. """
+    study = get_and_validate_study_id(chunked_download=True)
+    get_and_validate_researcher(study)
+    
+    data_type = request.values["data_stream"]
+    if data_type not in CHUNKABLE_FILES:
+        return abort(400)
+    try:
+        start_ms = parse_millisecond_time(request.values["time_start"])
+        end_ms = parse_millisecond_time(request.values["time_end"])
+    except ValueError:
+        return abort(400)
+    columns = determine_columns_for_row_query()
+    
+    query = {"data_types": [data_type]}
+    determine_users_for_db_query(query)  # select users
+    # the chunk with the first rows starts at the hour of time_start.
+    chunk_start_ms = start_ms - start_ms % (CHUNK_TIMESLICE_QUANTUM * 1000)
+    query["start"] = timezone.make_aware(EPOCH + timedelta(milliseconds=chunk_start_ms), timezone.utc)
+    query["end"] = timezone.make_aware(EPOCH + timedelta(milliseconds=end_ms), timezone.utc)
+    chunks = ChunkRegistry.get_chunks_time_range(study.pk, **query).order_by(
+        "participant__patient_id", "time_bin"
+    ).values_list("chunk_path", "participant__patient_id")
+    
+    return Response(
+        rows_generator(chunks, study.object_id, start_ms, end_ms, columns),
+        mimetype="text/csv"
+    )
+
+
+def determine_columns_for_row_query():
+    if 'columns' not in request.values:
+        return None
+    try:
+        columns = json.loads(request.values['columns'])
+    except JSONDecodeError:
+        columns = request.values.getlist('columns')
+    if not columns or not isinstance(columns, list):
+        return abort(400)
+    return [unicode(column).encode("utf-8") for column in columns]
+
+
+# Note: you cannot access the request context inside a generator function
+def rows_generator(chunks, study_object_id, start_ms, end_ms, columns):
+    """ Retrieves and slices the chunks (ordered, ahead of the client, see libs.adaptive_fetch),
+    the chunks are sliced on the fetching threads. """
+    
+    def retrieve_and_slice(chunk):
+        chunk_path, patient_id = chunk
+        chunk_contents = retrieve_chunk_contents(chunk_path, study_object_id)
+        header, lines = slice_chunk(chunk_contents, start_ms, end_ms, columns)
+        return patient_id, header, lines
+    
+    sliced_chunks = fetch_ordered(retrieve_and_slice, chunks.iterator(), sliced_chunk_size)
+    output_columns = columns
+    if output_columns is not None:
+        yield "patient_id," + ",".join(output_columns) + "\n"
+    
+    for patient_id, header, lines in sliced_chunks:
+        if not header:
+            continue
+        if output_columns is None:
+            output_columns = header
+            yield "patient_id," + ",".join(output_columns) + "\n"
+        elif columns is None and header != output_columns:
+            # (the columns of a data stream have changed between app versions)
+            column_indexes = project_columns(header, output_columns)
+            lines = [project_line(line, column_indexes) for line in lines]
+        if lines:
+            prefix = patient_id + ","
+            yield "".join(prefix + line + "\n" for line in lines)
+
+
+def sliced_chunk_size(sliced_chunk):
+    return sum(len(line) for line in sliced_chunk[2])
+
+
+@data_access_api.route("/get-aggregates/v1", methods=['POST', "GET"])
+def get_aggregates():
+    """ Required: access key, access secret (or access token), study_id, data_stream, time_start,
+    time_end (as in get-data-rows)
+    optional: user_ids (as in get-data), columns = a json list of column names (default all
+        columns, "magnitude" is the magnitude of the x, y and z columns),
+        reductions = a json list of "count", "min", "max", "mean" and "sum" (default all),
+        window_seconds = the length of the time windows (default 3600), format = "json" or "csv"
+    Returns the number of rows, and the reductions of the numeric values of each column, of the
+    rows of the data stream from time_start up to time_end, grouped by participant and time window
+    (window_start is in unix milliseconds). """
+    study = get_and_validate_study_id(chunked_download=True)
+    get_and_validate_researcher(study)
+    
+    data_type = request.values["data_stream"]
+    if data_type not in CHUNKABLE_FILES:
+        return abort(400)
+    try:
+        start_ms = parse_millisecond_time(request.values["time_start"])
+        end_ms = parse_millisecond_time(request.values["time_end"])
+        window_ms = int(request.values.get("window_seconds", 3600)) * 1000
+    except ValueError:
+        return abort(400)
+    if window_ms <= 0:
+        return abort(400)
+    columns = determine_columns_for_row_query()
+    reductions = determine_reductions_for_aggregate_query()
+    output_format = request.values.get("format", "json")
+    if output_format not in ("json", "csv"):
+        return abort(400)
+    
+    query = {"data_types": [data_type]}
+    determine_users_for_db_query(query)  # select users
+    chunk_start_ms = start_ms - start_ms % (CHUNK_TIMESLICE_QUANTUM * 1000)
+    query["start"] = timezone.make_aware(EPOCH + timedelta(milliseconds=chunk_start_ms), timezone.utc)
+    query["end"] = timezone.make_aware(EPOCH + timedelta(milliseconds=end_ms), timezone.utc)
+    chunks = ChunkRegistry.get_chunks_time_range(study.pk, **query).values_list(
+        "chunk_path", "participant__patient_id"
+    )
+    
+    def retrieve_and_aggregate(chunk):
+        chunk_path, patient_id = chunk
+        chunk_contents = retrieve_chunk_contents(chunk_path, study.object_id)
+        return aggregate_chunk(chunk_contents, patient_id, start_ms, end_ms, window_ms, columns)
+    
+    total = {}
+    # (partial aggregates are small, their size is not worth measuring)
+    for partial in fetch_unordered(retrieve_and_aggregate, chunks.iterator(), len):
+        merge_aggregates(total, partial)
+    results = finish_aggregates(total, reductions)
+    
+    if output_format == "csv":
+        return Response(aggregates_to_csv(results, reductions), mimetype="text/csv")
+    return json.dumps({"window_seconds": window_ms / 1000, "aggregates": results})
+
+
+def determine_reductions_for_aggregate_query():
+    if 'reductions' not in request.values:
+        return REDUCTIONS
+    try:
+        reductions = json.loads(request.values['reductions'])
+    except JSONDecodeError:
+        reductions = request.values.getlist('reductions')
+    if not reductions or not isinstance(reductions, list) or not set(reductions) <= set(REDUCTIONS):
+        return abort(400)
+    return [str(reduction) for reduction in reductions]
+
+
+@data_access_api.route("/get-summaries/v1", methods=['POST', "GET"])
+def get_summaries():
+    """ Required: access key, access secret (or access token), study_id
+    Takes the query parameters of get-data (data_streams, user_ids, time_start, time_end).
+    Returns the hourly summaries of the chunks of the query (see libs.chunk_summaries) as JSON
+    lines, one object per chunk with its patient_id, data_type, time_bin, row_count, coverage and
+    the values of its data stream, ordered by participant, data stream and time.  Chunks saved
+    before summaries were added have no summary. """
+    study = get_and_validate_study_id(chunked_download=True)
+    get_and_validate_researcher(study)
+    
+    query = {}
+    determine_data_streams_for_db_query(query)  # select data streams
+    determine_users_for_db_query(query)  # select users
+    determine_time_range_for_db_query(query)  # construct time ranges
+    
+    summaries = ChunkRegistry.get_chunks_time_range(study.pk, **query).filter(summary__isnull=False).order_by(
+        "participant__patient_id", "data_type", "time_bin"
+    ).values_list(
+        "participant__patient_id", "data_type", "time_bin", "summary__row_count", "summary__coverage",
+        "summary__stream_values"
+    )
+    return Response(summaries_generator(summaries), mimetype="application/x-ndjson")
+
+
+def summaries_generator(summaries):
+    for patient_id, data_type, time_bin, row_count, coverage, stream_values in summaries.iterator():
+        summary = json.loads(stream_values)
+        summary.update({
+            "patient_id": patient_id,
+            "data_type": data_type,
+            "time_bin": time_bin.strftime(API_TIME_FORMAT),
+            "row_count": row_count,
+            "coverage": coverage,
+        })
+        yield json.dumps(summary) + "\n"
+
+
+@data_access_api.route("/get-survey-answers/v1", methods=['POST', "GET"])
+def get_survey_answers():
+    """ Required: access key, access secret (or access token), study_id
+    optional: user_ids (as in get-data), survey_ids = a json list of survey ids, question_ids = a
+        json list of question ids, time_start and time_end (of the answers, as in get-data)
+    Returns the answers of the survey answers index (see libs.survey_answers) as JSON lines, one
+    object per answer with its patient_id, survey_id, question_id, question_text, answered_at,
+    answer and numeric_answer (null if the answer is not a number), ordered by participant, survey
+    and time. """
+    study = get_and_validate_study_id(chunked_download=True)
+    get_and_validate_researcher(study)
+    
+    query = {}
+    determine_users_for_db_query(query)  # select users
+    determine_time_range_for_db_query(query)  # construct time ranges
+    
+    answers = SurveyAnswer.objects.filter(survey__study=study)
+    if "user_ids" in query:
+        answers = answers.filter(participant__patient_id__in=query["user_ids"])
+    if "start" in query:
+        answers = answers.filter(answered_at__gte=query["start"])
+    if "end" in query:
+        answers = answers.filter(answered_at__lte=query["end"])
+    survey_ids = determine_json_list_parameter("survey_ids")
+    if survey_ids is not None:
+        answers = answers.filter(survey__object_id__in=survey_ids)
+    question_ids = determine_json_list_parameter("question_ids")
+    if question_ids is not None:
+        answers = answers.filter(question_id__in=question_ids)
+    
+    answers = answers.order_by("participant__patient_id", "survey__object_id", "answered_at", "pk").values_list(
+        "participant__patient_id", "survey__object_id", "question_id", "question_text", "answered_at", "answer",
+        "numeric_answer"
+    )
+    return Response(survey_answers_generator(answers), mimetype="application/x-ndjson")
+
+
+def determine_json_list_parameter(name):
+    """ The json list (or repeated form values) of a parameter, None if it is not provided. """
+    if name not in request.values:
+        return None
+    try:
+        values = json.loads(request.values[name])
+    except JSONDecodeError:
+        values = request.values.getlist(name)
+    if not isinstance(values, list):
+        return abort(400)
+    return values
+
+
+def survey_answers_generator(answers):
+    for patient_id, survey_id, question_id, question_text, answered_at, answer, numeric_answer in answers.iterator():
+        yield json.dumps({
+            "patient_id": patient_id,
+            "survey_id": survey_id,
+            "question_id": question_id,
+            "question_text": question_text,
+            "answered_at": answered_at.strftime(API_TIME_FORMAT),
+            "answer": answer,
+            "numeric_answer": numeric_answer,
+        }) + "\n"
+
+
+@data_access_api.route("/get-data-coverage/v1", methods=['POST', "GET"])
+def get_data_coverage():
+    """ Required: access key, access secret (or access token), study_id
+    Takes the query parameters of get-data (data_streams, user_ids, time_start, time_end), the
+    time range is of whole hours, it defaults to the hours from a participant's first data up to
+    the current hour.
+    Returns the data coverage index (see libs.data_coverage) as JSON lines, one object per
+    participant and data stream with its patient_id, data_type, time_start and time_end (of the
+    range), hours (in the range), hours_with_data and gaps (a list of the [start, end) time ranges
+    without data), ordered by participant and data stream. """
+    study = get_and_validate_study_id(chunked_download=True)
+    get_and_validate_researcher(study)
+    
+    query = {}
+    determine_data_streams_for_db_query(query)  # select data streams
+    determine_users_for_db_query(query)  # select users
+    determine_time_range_for_db_query(query)  # construct time ranges
+    
+    coverages = DataCoverage.objects.filter(participant__study=study)
+    if "user_ids" in query:
+        coverages = coverages.filter(participant__patient_id__in=query["user_ids"])
+    if "data_types" in query:
+        coverages = coverages.filter(data_type__in=query["data_types"])
+    start_hour = hour_of(query["start"]) if "start" in query else None
+    # (as in get-data, the hour of time_end is included)
+    end_hour = hour_of(query["end"] if "end" in query else datetime.utcnow()) + 1
+    
+    coverages = coverages.select_related("participant").order_by("participant__patient_id", "data_type")
+    return Response(coverage_generator(coverages, start_hour, end_hour), mimetype="application/x-ndjson")
+
+
+def coverage_generator(coverages, start_hour, end_hour):
+    for coverage in coverages.iterator():
+        coverage_start_hour = start_hour
+        if coverage_start_hour is None:
+            # (a data stream's index has at least one hour with data)
+            coverage_start_hour = coverage.first_data_hour()
+        yield json.dumps({
+            "patient_id": coverage.participant.patient_id,
+            "data_type": coverage.data_type,
+            "time_start": hour_to_datetime(coverage_start_hour).strftime(API_TIME_FORMAT),
+            "time_end": hour_to_datetime(end_hour).strftime(API_TIME_FORMAT),
+            "hours": max(end_hour - coverage_start_hour, 0),
+            "hours_with_data": coverage.count_hours(coverage_start_hour, end_hour),
+            "gaps": [
+                [hour_to_datetime(gap_start).strftime(API_TIME_FORMAT),
+                 hour_to_datetime(gap_end).strftime(API_TIME_FORMAT)]
+                for gap_start, gap_end in coverage.missing_hour_ranges(coverage_start_hour, end_hour)
+            ],
+        }) + "\n"
+
+
+@data_access_api.route("/get-data-volume/v1", methods=['POST', "GET"])
+def get_data_volume():
+    """ Required: access key, access secret (or access token), study_id
+    Takes the query parameters of get-data (data_streams, user_ids, time_start, time_end, the time
+    range is of days).
+    Returns the daily data volume rollups (see libs.volume_rollups) as JSON lines, one object per
+    participant, data stream and (utc) day with its patient_id, data_type, day, files and bytes
+    (uploaded that day), rows (processed that day), and first_seen and last_seen (the times of the
+    first and last uploads, null if there were none), ordered by participant, data stream and day. """
+    study = get_and_validate_study_id(chunked_download=True)
+    get_and_validate_researcher(study)
+    
+    query = {}
+    determine_data_streams_for_db_query(query)  # select data streams
+    determine_users_for_db_query(query)  # select users
+    determine_time_range_for_db_query(query)  # construct time ranges
+    
+    rollups = DataVolumeRollup.objects.filter(study=study)
+    if "user_ids" in query:
+        rollups = rollups.filter(participant__patient_id__in=query["user_ids"])
+    if "data_types" in query:
+        rollups = rollups.filter(data_type__in=query["data_types"])
+    if "start" in query:
+        rollups = rollups.filter(day__gte=query["start"].date())
+    if "end" in query:
+        rollups = rollups.filter(day__lte=query["end"].date())
+    
+    rollups = rollups.order_by("participant__patient_id", "data_type", "day").values_list(
+        "participant__patient_id", "data_type", "day", "files", "bytes", "rows", "first_seen", "last_seen"
+    )
+    return Response(volume_generator(rollups), mimetype="application/x-ndjson")
+
+
+def volume_generator(rollups):
+    for patient_id, data_type, day, files, size, rows, first_seen, last_seen in rollups.iterator():
+        yield json.dumps({
+            "patient_id": patient_id,
+            "data_type": data_type,
+            "day": day.isoformat(),
+            "files": files,
+            "bytes": size,
+            "rows": rows,
+            "first_seen": first_seen.astimezone(timezone.utc).strftime(API_TIME_FORMAT) if first_seen else None,
+            "last_seen": last_seen.astimezone(timezone.utc).strftime(API_TIME_FORMAT) if last_seen else None,
+        }) + "\n"
+
+
+@data_access_api.route("/get-data-freshness/v1", methods=['POST', "GET"])
+def get_data_freshness():
+    """ Required: access key, access secret (or access token), study_id
+    Takes the data_streams and user_ids query parameters of get-data.
+    Returns the latest data of every participant's data streams (see DataFreshness) as JSON lines,
+    one object per participant and data stream with its patient_id, data_type, last_upload (the
+    time of the last upload), last_time_bin (the time bin of the latest chunk) and
+    last_app_version (of the last upload that sent it), the times are null if there is none,
+    ordered by participant and data stream. """
+    study = get_and_validate_study_id(chunked_download=True)
+    get_and_validate_researcher(study)
+    
+    query = {}
+    determine_data_streams_for_db_query(query)  # select data streams
+    determine_users_for_db_query(query)  # select users
+    
+    freshness = DataFreshness.objects.filter(study=study)
+    if "user_ids" in query:
+        freshness = freshness.filter(participant__patient_id__in=query["user_ids"])
+    if "data_types" in query:
+        freshness = freshness.filter(data_type__in=query["data_types"])
+    
+    freshness = freshness.order_by("participant__patient_id", "data_type").values_list(
+        "participant__patient_id", "data_type", "last_upload", "last_time_bin", "last_app_version"
+    )
+    return Response(freshness_generator(freshness), mimetype="application/x-ndjson")
+
+
+def freshness_generator(freshness):
+    for patient_id, data_type, last_upload, last_time_bin, last_app_version in freshness.iterator():
+        yield json.dumps({
+            "patient_id": patient_id,
+            "data_type": data_type,
+            "last_upload": last_upload.astimezone(timezone.utc).strftime(API_TIME_FORMAT) if last_upload else None,
+            "last_time_bin": last_time_bin.astimezone(timezone.utc).strftime(API_TIME_FORMAT) if last_time_bin else None,
+            "last_app_version": last_app_version,
+        }) + "\n"
+
+
+#########################################################################################
+##################################### Data Exports ######################################
+#########################################################################################
+
+@data_access_api.route("/create-data-export/v1", methods=['POST'])
+def create_data_export():
+    """ Required: access key, access secret (or access token), study_id
+    Takes the query parameters of get-data (data_streams, user_ids, time_start, time_end,
+    archive_format), and returns the export_id and status of a data export that builds the archive
+    in the background, see libs.data_exports.  The same query made again within
+    DATA_EXPORT_REUSE_SECONDS returns the same export. """
+    study = get_and_validate_study_id(chunked_download=True)
+    researcher = get_and_validate_researcher(study)
+    
+    query = {}
+    determine_data_streams_for_db_query(query)  # select data streams
+    determine_users_for_db_query(query)  # select users
+    determine_time_range_for_db_query(query)  # construct time ranges
+    
+    archive_format = request.values.get("archive_format", ZIP_ARCHIVE)
+    if archive_format not in ARCHIVE_FORMATS:
+        return abort(400)
+    
+    data_export = find_or_create_data_export(study, researcher, query, archive_format)
+    return json.dumps(data_export_status(data_export))
+
+
+@data_access_api.route("/get-data-export-status/v1", methods=['POST', "GET"])
+def get_data_export_status():
+    """ Required: access key, access secret (or access token), study_id, export_id
+    Returns the export_id, status ("queued", "running", "done" or "failed"), file_size and
+    archive_format of a data export. """
+    study = get_and_validate_study_id(chunked_download=True)
+    get_and_validate_researcher(study)
+    data_export = get_and_validate_data_export(study)
+    return json.dumps(data_export_status(data_export))
+
+
+@data_access_api.route("/download-data-export/v1", methods=['POST', "GET"])
+def download_data_export():
+    """ Required: access key, access secret (or access token), study_id, export_id
+    Returns the archive of a finished data export, or the part of it requested by a Range header.
+    Returns a 404 if the export is not finished. """
+    study = get_and_validate_study_id(chunked_download=True)
+    get_and_validate_researcher(study)
+    data_export = get_and_validate_data_export(study)
+    if data_export.status != DataExport.DONE:
+        return abort(404)
+    
+    file_size = data_export.file_size
+    file_name = "data_export_{0}.{1}".format(data_export.pk, archive_file_extension(data_export.archive_format))
+    headers = {
+        'Accept-Ranges': 'bytes',
+        'Content-Disposition': 'attachment; filename="{0}"'.format(file_name),
+    }
+    start, stop, status = 0, file_size, 200
+    if request.range is not None:
+        byte_range = request.range.range_for_length(file_size)
+        if byte_range is None:
+            return abort(416)
+        start, stop = byte_range
+        status = 206
+        headers['Content-Range'] = request.range.to_content_range_header(file_size)
+    headers['Content-Length'] = str(stop - start)
+    
+    return Response(
+        stream_data_export(data_export, start, stop),
+        status=status,
+        mimetype=archive_mimetype(data_export.archive_format),
+        headers=headers
+    )
+
+
+def get_and_validate_data_export(study):
+    """ Returns the data export of the export_id, 404 if the study has no such export. """
+    try:
+        return DataExport.objects.get(pk=int(request.values["export_id"]), study=study)
+    except (ValueError, DataExport.DoesNotExist):
+        return abort(404)
+
+
 #########################################################################################
 
 def parse_registry(reg_dat):
@@ -274,10 +1010,12 @@ def parse_registry(reg_dat):
     return ret
 
 
-def determine_file_name(chunk):
+def determine_file_name(chunk, raw_chunks=False):
     """ Generates the correct file name to provide the file with in the zip file.
         (This also includes the folder location files in the zip.) """
     extension = chunk["chunk_path"][-3:]  # get 3 letter file extension from the source.
+    if raw_chunks and chunk.get("file_format") == ChunkRegistry.BINARY_FORMAT:
+        extension = "bin"
     if chunk["data_type"] == SURVEY_ANSWERS:
         # add the survey_id from the file path.
         return "%s/%s/%s/%s.%s" % (chunk["participant__patient_id"], chunk["data_type"],
@@ -315,6 +1053,50 @@ def determine_file_name(chunk):
                             str(chunk["time_bin"]).replace(":", "_"), extension)
 
 
+def get_resume_from():
+    try:
+        resume_from = int(request.values.get("resume_from", 0))
+    except ValueError:
+        return abort(400)
+    if resume_from < 0:
+        return abort(400)
+    return resume_from
+
+
+def encode_sync_cursor(sync_cursor_time):
+    """ Sync cursors are opaque to clients, they contain the time (in microseconds) up to which
+    chunk changes have been downloaded. """
+    return urlsafe_b64encode("1:%d" % timegm_microseconds(sync_cursor_time))
+
+
+def decode_sync_cursor(sync_cursor):
+    """ Returns the time of a sync cursor, raises a 400 if it is not a valid cursor. """
+    try:
+        version, microseconds = urlsafe_b64decode(sync_cursor.encode("ascii")).split(":")
+        if version != "1":
+            raise ValueError
+        return timezone.make_aware(EPOCH + timedelta(microseconds=int(microseconds)), timezone.utc)
+    except (TypeError, ValueError, UnicodeEncodeError):
+        return abort(400)
+
+
+def determine_sync_window(sync_cursor):
+    """ Returns the time after which chunks have changed since the sync cursor (None for "" which
+    is the first download) and the time of the new sync cursor.
+    The new cursor lags SYNC_CURSOR_LAG_SECONDS behind the current time, chunks that are
+    being saved now may have an earlier last_updated time than chunks that have been saved. """
+    changed_after = decode_sync_cursor(sync_cursor) if sync_cursor else None
+    sync_cursor_time = timezone.now() - timedelta(seconds=SYNC_CURSOR_LAG_SECONDS)
+    if changed_after and changed_after > sync_cursor_time:
+        sync_cursor_time = changed_after
+    return changed_after, sync_cursor_time
+
+
+def timegm_microseconds(dt):
+    delta = dt.astimezone(timezone.utc).replace(tzinfo=None) - EPOCH
+    return (delta.days * 86400 + delta.seconds) * 1000000 + delta.microseconds
+
+
 def str_to_datetime(time_string):
     """ Translates a time string to a datetime object, raises a 400 if the format is wrong."""
     try:
@@ -324,11 +1106,26 @@ def str_to_datetime(time_string):
             return abort(400)
 
 
-def batch_retrieve_s3(chunk):
+def retrieved_file_size(chunk_and_content):
+    return len(chunk_and_content[1])
+
+
+def encoded_file_size(chunk_and_encoded_file):
+    return len(chunk_and_encoded_file[1].data)
+
+
+def batch_retrieve_s3(chunk, raw_chunks=False):
     """ Data is returned in the form (chunk_object, file_data). """
-    return chunk, s3_retrieve(chunk["chunk_path"],
-                              study_object_id=Study.objects.get(id=chunk["study_id"]).object_id,
-                              raw_path=True)
+    return chunk, retrieve_chunk_contents(chunk["chunk_path"], chunk["study__object_id"], raw_chunks)
+
+
+def retrieve_chunk_contents(chunk_path, study_object_id, raw_chunks=False):
+    """ Chunks stored in the binary encoding (see libs.binary_chunks) are returned as csv, unless
+    raw_chunks. """
+    file_contents = s3_retrieve(chunk_path, study_object_id, raw_path=True)
+    if raw_chunks:
+        return file_contents
+    return chunk_to_csv(file_contents)
 
 
 #########################################################################################
@@ -380,17 +1177,28 @@ def determine_time_range_for_db_query(query):
         query['end'] = str_to_datetime(request.values['time_end'])
 
 
-def handle_database_query(study_id, query, registry=None):
+# the chunk fields of the file lists of downloads
+CHUNK_FIELDS = ["pk", "participant_id", "data_type", "chunk_path", "time_bin", "chunk_hash",
+                "participant__patient_id", "study_id", "study__object_id", "survey_id", "survey__object_id",
+                "file_format"]
+
+
+def handle_database_query(study_id, query, registry=None, changed_after=None, changed_until=None):
     """
     Runs the database query and returns a QuerySet.
+    If changed_until is provided only the chunks last updated after changed_after (if provided)
+    and up to changed_until are returned, and the registry is ignored.
     """
-    chunk_fields = ["pk", "participant_id", "data_type", "chunk_path", "time_bin", "chunk_hash",
-                    "participant__patient_id", "study_id", "survey_id", "survey__object_id"]
-
     chunks = ChunkRegistry.get_chunks_time_range(study_id, **query)
     
+    if changed_until:
+        chunks = chunks.filter(last_updated__lte=changed_until)
+        if changed_after:
+            chunks = chunks.filter(last_updated__gt=changed_after)
+        return chunks.values(*CHUNK_FIELDS)
+    
     if not registry:
-        return chunks.values(*chunk_fields)
+        return chunks.values(*CHUNK_FIELDS)
     
     # If there is a registry, we need to filter the chunks
     else:
@@ -409,16 +1217,15 @@ def handle_database_query(study_id, query, registry=None):
         
         # add the exclude and return the queryset
         unregistered_chunks = chunks.exclude(pk__in=registered_chunk_pks)
-        return unregistered_chunks.values(*chunk_fields)
+        return unregistered_chunks.values(*CHUNK_FIELDS)
 
 
 #########################################################################################
 ################################### Pipeline ############################################
 #########################################################################################
 
-VALID_PIPELINE_POST_PARAMS = PipelineUpload.REQUIREDS
-VALID_PIPELINE_POST_PARAMS.append("access_key")
-VALID_PIPELINE_POST_PARAMS.append("secret_key")
+# (a new list, the credentials are not required parameters of a PipelineUpload)
+VALID_PIPELINE_POST_PARAMS = PipelineUpload.REQUIREDS + ["access_key", "secret_key", "access_token"]
 
 # before reenabling, audio filenames on s3 were incorrectly enforced to have millisecond
 # precision, remove trailing zeros this does not affect data downloading because those file times
@@ -426,14 +1233,7 @@ VALID_PIPELINE_POST_PARAMS.append("secret_key")
 @data_access_api.route("/pipeline-upload/v1", methods=['POST', 'GET'])
 def data_pipeline_upload():
     #Cases: invalid access creds
-    access_key = request.values["access_key"]
-    access_secret = request.values["secret_key"]
-
-    if not Researcher.objects.filter(access_key_id=access_key).exists():
-        return abort(403) # access key DNE
-    researcher = Researcher.objects.get(access_key_id=access_key)
-    if not researcher.validate_access_credentials(access_secret):
-        return abort( 403 )  # incorrect secret key
+    study_access = get_and_validate_study_access()
     # case: invalid study
     study_id = request.values["study_id"]
 
@@ -443,7 +1243,7 @@ def data_pipeline_upload():
     study_obj = Study.objects.get(object_id=study_id)
 
     # case: study not authorized for user
-    if not study_obj.get_researchers().filter(id=researcher.id).exists():
+    if study_obj.pk not in study_access.study_ids:
         return abort(403)
 
     # block extra keys
@@ -493,6 +1293,8 @@ def pipeline_data_download():
         
     else:
         query = PipelineUpload.objects.filter(study__id=study_obj.id)
+    # the files are retrieved on a thread pool that doesn't query the database.
+    query = query.select_related("study")
     
     ####################################
     return Response(
@@ -503,45 +1305,28 @@ def pipeline_data_download():
     
 #TODO: This is a trivial rewrite of the other zip generator function for minor differences. refactor when you get to django.
 def zip_generator_for_pipeline(files_list):
-    pool = ThreadPool(3)
     zip_output = StreamingBytesIO()
     zip_input = ZipFile(zip_output, mode="w", compression=ZIP_STORED, allowZip64=True)
-    try:
-        # chunks_and_content is a list of tuples, of the chunk and the content of the file.
-        # chunksize (which is a keyword argument of imap, not to be confused with Beiwe Chunks)
-        # is the size of the batches that are handed to the pool. We always want to add the next
-        # file to retrieve to the pool asap, so we want a chunk size of 1.
-        # (In the documentation there are comments about the timeout, it is irrelevant under this construction.)
-        chunks_and_content = pool.imap_unordered(batch_retrieve_pipeline_s3, files_list, chunksize=1)
-        for pipeline_upload, file_contents in chunks_and_content:
-            # file_name = determine_file_name(chunk)
-            zip_input.writestr("data/" + pipeline_upload.file_name, file_contents)
-            # These can be large, and we don't want them sticking around in memory as we wait for the yield
-            del file_contents, pipeline_upload
-            yield zip_output.getvalue()  # yield the (compressed) file information
-            zip_output.empty()
-        
-        # close, then yield all remaining data in the zip.
-        zip_input.close()
-        yield zip_output.getvalue()
-    
-    except None:
-        # The try-except-finally block is here to guarantee the Threadpool is closed and terminated.
-        # we don't handle any errors, we just re-raise any error that shows up.
-        # (with statement does not work.)
-        raise
-    finally:
-        # We rely on the finally block to ensure that the threadpool will be closed and terminated,
-        # and also to print an error to the log if we need to.
-        pool.close()
-        pool.terminate()
-        
-        
+    # chunks_and_content is a list of tuples, of the chunk and the content of the file.
+    chunks_and_content = fetch_unordered(batch_retrieve_pipeline_s3, files_list, retrieved_file_size)
+    for pipeline_upload, file_contents in chunks_and_content:
+        # file_name = determine_file_name(chunk)
+        zip_input.writestr("data/" + pipeline_upload.file_name, file_contents)
+        # These can be large, and we don't want them sticking around in memory as we wait for the yield
+        del file_contents, pipeline_upload
+        yield zip_output.getvalue()  # yield the (compressed) file information
+        zip_output.empty()
+    
+    # close, then yield all remaining data in the zip.
+    zip_input.close()
+    yield zip_output.getvalue()
+
+
 def batch_retrieve_pipeline_s3(pipeline_upload):
     """ Data is returned in the form (chunk_object, file_data). """
-    study = Study.objects.get(id = pipeline_upload.study_id)
+    # (the study is selected with the upload, see pipeline_data_download)
     return pipeline_upload, s3_retrieve(pipeline_upload.s3_path,
-                                        study.object_id,
+                                        pipeline_upload.study.object_id,
                                         raw_path=True)
 
 
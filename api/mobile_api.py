@@ -1,18 +1,19 @@
-from django.utils import timezone
-from flask import Blueprint, request, abort, render_template, json
+from flask import Blueprint, request, abort, render_template, json, Response
 from werkzeug.datastructures import FileStorage
 from werkzeug.exceptions import BadRequestKeyError
 
-from config.constants import ALLOWED_EXTENSIONS
-from database.data_access_models import FileToProcess
-from database.profiling_models import UploadTracking, DecryptionKeyError
+from config.constants import DEFERRED_UPLOAD_INGEST, UPLOAD_INGEST_MODE
 from database.user_models import Participant
+from libs.admission_control import admission_controlled
 from libs.android_error_reporting import send_android_error_report
-from libs.encryption import decrypt_device_file, HandledError, DecryptionKeyInvalidError
 from libs.http_utils import determine_os_api
-from libs.logging import log_error
-from libs.s3 import s3_upload, get_client_public_key_string, get_client_private_key
+from libs.s3 import get_client_public_key_string, get_client_private_key
 from libs.sentry import make_sentry_client
+from libs.streaming_form_parser import StreamingFormDataParser
+from libs.study_payload_cache import get_device_settings_payload, get_surveys_payload
+from libs.upload_processing import (contains_valid_extension, decrypt_and_register_upload,
+    defer_upload, is_duplicate_upload, read_upload, record_upload_fingerprint, report_invalid_upload,
+    upload_fingerprint, upload_size)
 from libs.user_authentication import (authenticate_user, authenticate_user_registration,
                                       authenticate_user_ignore_password)
 
@@ -23,6 +24,15 @@ from business_logic.participant_bl import DeviceInfo, ParticipantBL
 ################################################################################
 mobile_api = Blueprint('mobile_api', __name__)
 
+
+@mobile_api.before_request
+def stream_upload_request_bodies():
+    """ Upload request bodies are parsed as they are read rather than being loaded into memory
+    first, see StreamingFormDataParser.  This has to be set before anything (e.g. authentication)
+    reads the form. """
+    if request.endpoint in ("mobile_api.upload", "mobile_api.upload_batch"):
+        request.form_data_parser_class = StreamingFormDataParser
+
 ################################################################################
 ################################ UPLOADS #######################################
 ################################################################################
@@ -39,6 +49,7 @@ mobile_api = Blueprint('mobile_api', __name__)
 @mobile_api.route('/upload', methods=['POST'])
 @mobile_api.route('/upload/ios/', methods=['GET', 'POST'])
 @determine_os_api
+@admission_controlled
 @authenticate_user
 def upload(OS_API=""):
     """ Entry point to upload GPS, Accelerometer, Audio, PowerState, Calls Log, Texts Log,
@@ -65,12 +76,23 @@ def upload(OS_API=""):
     emailed and the event will be logged. The app should not delete the file, it should try to
     upload it again at some point.
 
+    When UPLOAD_INGEST_MODE is "deferred" a valid upload is stored without being decrypted and a
+    200 is returned immediately, decryption errors are then handled by the upload processing task
+    (see libs.upload_processing).
+
     Request format:
     send an http post request to [domain name]/upload, remember to include security
     parameters (see user_authentication for documentation). Provide the contents of the file,
     encrypted (see encryption specification) and properly converted to Base64 encoded text,
     as a request parameter entitled "file".
-    Provide the file name in a request parameter entitled "file_name". """
+    Provide the file name in a request parameter entitled "file_name".
+    Optionally provide the version of the app in a request parameter entitled "app_version".
+    Request bodies larger than UPLOAD_MAX_SIZE get a 413 response.  When the server is overloaded
+    uploads get a 503 response with a Retry-After header (see libs.admission_control), the app
+    should not delete the file.  Overload is judged before the request body is read, so the study's
+    upload priority only applies to uploads that identify the participant outside of the body:
+    android should send the patient_id in the query string (/upload?patient_id=...), ios sends it
+    in the basic auth username. """
     patient_id = request.values['patient_id']
     user = Participant.objects.get(patient_id=patient_id)
 
@@ -87,75 +109,109 @@ def upload(OS_API=""):
         uploaded_file = request.data
 
     if isinstance(uploaded_file, FileStorage):
-        uploaded_file = uploaded_file.read()
+        # (this is a file object, the contents are read as they are needed)
+        uploaded_file = uploaded_file.stream
 
     file_name = request.values['file_name']
     # print "uploaded file name:", file_name, len(uploaded_file)
-    if "crashlog" in file_name.lower():
-        send_android_error_report(patient_id, uploaded_file)
-        return render_template('blank.html'), 200
-
-    if file_name[:6] == "rList-":
+    client_private_key = lambda: get_client_private_key(patient_id, user.study.object_id)
+    app_version = request.values.get("app_version")
+    if handle_upload(user, file_name, uploaded_file, client_private_key, app_version) == 200:
         return render_template('blank.html'), 200
+    return abort(400)
 
-    client_private_key = get_client_private_key(patient_id, user.study.object_id)
-    try:
-        uploaded_file = decrypt_device_file(patient_id, uploaded_file, client_private_key, user)
-    except HandledError as e:
-        # when decrypting fails, regardless of why, we rely on the decryption code
-        # to log it correctly and return 200 OK to get the device to delete the file.
-        # We do not want emails on these types of errors, so we use log_error explicitly.
-        print("the following error was handled:")
-        log_error(e, "%s; %s; %s" % (patient_id, file_name, e.message))
-        return render_template('blank.html'), 200
-    # This is what the decryption failure mode SHOULD be, but we are still identifying the decryption bug
-    except DecryptionKeyInvalidError:
-        tags = {
-            "participant": patient_id,
-            "operating system": "ios" if "ios" in request.path.lower() else "android",
-            "DecryptionKeyError id": str(DecryptionKeyError.objects.last().id),
-            "file_name": file_name,
-        }
-        make_sentry_client('eb', tags).captureMessage("DecryptionKeyInvalidError")
 
-        return render_template('blank.html'), 200
+@mobile_api.route('/upload_batch', methods=['POST'])
+@mobile_api.route('/upload_batch/ios/', methods=['POST'])
+@determine_os_api
+@admission_controlled
+@authenticate_user
+def upload_batch(OS_API=""):
+    """ Uploads several files in one request, each file is handled exactly as it would be by the
+    upload endpoint.
 
-    # print "decryption success:", file_name
-    # if uploaded data a) actually exists, B) is validly named and typed...
-    if uploaded_file and file_name and contains_valid_extension(file_name):
-        s3_upload(file_name.replace("_", "/"), uploaded_file, user.study.object_id)
-        FileToProcess.append_file_for_processing(file_name.replace("_", "/"), user.study.object_id, participant=user)
-        UploadTracking.objects.create(
-            file_path=file_name.replace("_", "/"),
-            file_size=len(uploaded_file),
-            timestamp=timezone.now(),
-            participant=user,
-        )
-        return render_template('blank.html'), 200
-    else:
-        error_message = "an upload has failed " + patient_id + ", " + file_name + ", "
-        if not uploaded_file:
-            # it appears that occasionally the app creates some spurious files
-            # with a name like "rList-org.beiwe.app.LoadingActivity"
-            error_message += "there was no/an empty file, returning 200 OK so device deletes bad file."
-            log_error(Exception("upload error"), error_message)
-            return render_template('blank.html'), 200
-
-        elif not file_name:
-            error_message += "there was no provided file name, this is an app error."
-        elif file_name and not contains_valid_extension(file_name):
-            error_message += "contains an invalid extension, it was interpretted as "
-            error_message += grab_file_extension(file_name)
-        else:
-            error_message += "AN UNKNOWN ERROR OCCURRED."
-
-        print "upload error ", error_message
-        tags = {"upload_error": "upload error", "user_id": patient_id}
-        sentry_client = make_sentry_client('eb', tags)
-        sentry_client.captureMessage(error_message)
+    Request format:
+    a multipart post request with the usual security parameters, every file is a part named "file"
+    whose filename is the file name, and optionally the "app_version" parameter.  As for the upload
+    endpoint, the patient_id should be in the query string for the study's upload priority to apply.
+
+    Response format:
+    a json object of file name to the status code the upload endpoint would have returned for that
+    file, the app should delete exactly the files with a 200.  Server errors on a single file are
+    reported as a 500 for that file and do not affect the other files.  A request with two files of
+    the same name gets a 400 without any of its files being handled. """
+    patient_id = request.values['patient_id']
+    user = Participant.objects.get(patient_id=patient_id)
 
+    # the RSA key is the same for every file, it is retrieved once and only if it is needed.
+    private_key_cache = []
+    def client_private_key():
+        if not private_key_cache:
+            private_key_cache.append(get_client_private_key(patient_id, user.study.object_id))
+        return private_key_cache[0]
+
+    uploaded_files = request.files.getlist('file')
+    file_names = [uploaded_file.filename for uploaded_file in uploaded_files]
+    if len(set(file_names)) != len(file_names):
+        # (the statuses of the files could not be told apart)
         return abort(400)
 
+    app_version = request.values.get("app_version")
+    statuses = {}
+    for uploaded_file in uploaded_files:
+        file_name = uploaded_file.filename
+        try:
+            statuses[file_name] = handle_upload(
+                user, file_name, uploaded_file.stream, client_private_key, app_version
+            )
+        except Exception:
+            tags = {"upload_error": "batch upload error", "user_id": patient_id, "file_name": file_name}
+            make_sentry_client('eb', tags).captureException()
+            statuses[file_name] = 500
+    return Response(json.dumps(statuses), mimetype="application/json")
+
+
+def handle_upload(user, file_name, uploaded_file, client_private_key, app_version=None):
+    """ Handles a single uploaded file, returns the status code of the upload (200 or 400), see the
+    documentation of the upload endpoint.  client_private_key is a function returning the user's
+    private key, it is not called for uploads that don't need it.  The data freshness of the upload's
+    data stream is updated when its data is registered (see register_decrypted_upload), for
+    deferred uploads that is when they are decrypted. """
+    patient_id = user.patient_id
+    if "crashlog" in file_name.lower():
+        send_android_error_report(patient_id, read_upload(uploaded_file))
+        return 200
+
+    if file_name[:6] == "rList-":
+        return 200
+
+    # exact re-uploads of a file that has already been handled are acknowledged without
+    # storing or processing it again.
+    uploaded_file_size = upload_size(uploaded_file)
+    fingerprint = upload_fingerprint(patient_id, file_name, uploaded_file) if uploaded_file_size else None
+    if fingerprint and is_duplicate_upload(fingerprint):
+        return 200
+
+    if UPLOAD_INGEST_MODE == DEFERRED_UPLOAD_INGEST:
+        # Only store the upload, decryption is done by the upload processing task. The checks
+        # that can be done without decrypting the file are done here, so that the device gets
+        # the same response it would get from a synchronous upload.
+        if not uploaded_file_size:
+            # (this is the response for a file with no data in it, see decrypt_device_file)
+            return 200
+        if not file_name or not contains_valid_extension(file_name):
+            report_invalid_upload(patient_id, file_name)
+            return 400
+        defer_upload(user, file_name, read_upload(uploaded_file), app_version)
+        record_upload_fingerprint(user, fingerprint)
+        return 200
+
+    if decrypt_and_register_upload(user, file_name, uploaded_file, client_private_key(), app_version):
+        if fingerprint:
+            record_upload_fingerprint(user, fingerprint)
+        return 200
+    return 400
+
 
 ################################################################################
 ############################## Registration ####################################
@@ -211,8 +267,7 @@ def register_user_full(OS_API=""):
     participant = ParticipantBL.create_full(study_object_id, user_name, password, OS_API, device_info)
     patient_id = participant.patient_id
 
-    device_settings = participant.study.device_settings.as_native_python()
-    device_settings.pop('_id', None)
+    device_settings = get_device_settings_payload(participant.study)
     return_obj = {'patient_id': patient_id,
                   'client_public_key': get_client_public_key_string(patient_id, study_object_id),
                   'device_settings': device_settings}
@@ -261,8 +316,7 @@ def register_user(OS_API=""):
     study_object_id = user.study.object_id
     ParticipantBL.register_created(user, request.values['new_password'], OS_API, device_info)
 
-    device_settings = user.study.device_settings.as_native_python()
-    device_settings.pop('_id', None)
+    device_settings = get_device_settings_payload(user.study)
     return_obj = {'client_public_key': get_client_public_key_string(patient_id, study_object_id),
                   'device_settings': device_settings}
     return json.dumps(return_obj), 200
@@ -284,21 +338,6 @@ def set_password(OS_API=""):
     return render_template('blank.html'), 200
 
 
-################################################################################
-########################## FILE NAME FUNCTIONALITY #############################
-################################################################################
-
-
-def grab_file_extension(file_name):
-    """ grabs the chunk of text after the final period. """
-    return file_name.rsplit('.', 1)[1]
-
-
-def contains_valid_extension(file_name):
-    """ Checks if string has a recognized file extension, this is not necessarily limited to 4 characters. """
-    return '.' in file_name and grab_file_extension(file_name) in ALLOWED_EXTENSIONS
-
-
 ################################################################################
 ################################# Download #####################################
 ################################################################################
@@ -309,6 +348,12 @@ def contains_valid_extension(file_name):
 @determine_os_api
 @authenticate_user
 def get_latest_surveys(OS_API=""):
+    """ Returns the json list of the study's surveys, with an ETag.  If the request has an
+    If-None-Match header with the current ETag the surveys have not changed, a 304 is returned
+    without a body. """
     participant = Participant.objects.get(patient_id=request.values['patient_id'])
-    study = participant.study
-    return json.dumps(study.get_surveys_for_study(requesting_os=OS_API))
+    surveys, etag = get_surveys_payload(participant.study, OS_API)
+    headers = {"ETag": '"%s"' % etag}
+    if etag in request.if_none_match:
+        return "", 304, headers
+    return surveys, 200, headers
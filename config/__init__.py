@@ -54,6 +54,37 @@ constants.DEFAULT_S3_RETRIES = int(constants.DEFAULT_S3_RETRIES)
 constants.CONCURRENT_NETWORK_OPS = int(constants.CONCURRENT_NETWORK_OPS)
 constants.FILE_PROCESS_PAGE_SIZE = int(constants.FILE_PROCESS_PAGE_SIZE)
 constants.CELERY_EXPIRY_MINUTES = int(constants.CELERY_EXPIRY_MINUTES)
+constants.DECRYPTION_BATCH_SIZE = int(constants.DECRYPTION_BATCH_SIZE)
+constants.DECRYPTION_POOL_LINE_THRESHOLD = int(constants.DECRYPTION_POOL_LINE_THRESHOLD)
+constants.CONCURRENT_DECRYPTION_OPS = int(constants.CONCURRENT_DECRYPTION_OPS)
+constants.PENDING_UPLOAD_PAGE_SIZE = int(constants.PENDING_UPLOAD_PAGE_SIZE)
+constants.PENDING_UPLOAD_MAX_ATTEMPTS = int(constants.PENDING_UPLOAD_MAX_ATTEMPTS)
+constants.PENDING_UPLOAD_CLAIM_SECONDS = int(constants.PENDING_UPLOAD_CLAIM_SECONDS)
+constants.UPLOAD_FINGERPRINT_RETENTION_DAYS = int(constants.UPLOAD_FINGERPRINT_RETENTION_DAYS)
+constants.UPLOAD_MAX_SIZE = int(constants.UPLOAD_MAX_SIZE)
+constants.UPLOAD_SHED_BACKLOG_FILES = int(constants.UPLOAD_SHED_BACKLOG_FILES)
+constants.UPLOAD_SHED_BACKLOG_AGE_SECONDS = int(constants.UPLOAD_SHED_BACKLOG_AGE_SECONDS)
+constants.UPLOAD_SHED_IN_FLIGHT_REQUESTS = int(constants.UPLOAD_SHED_IN_FLIGHT_REQUESTS)
+constants.UPLOAD_SHED_RETRY_AFTER_SECONDS = int(constants.UPLOAD_SHED_RETRY_AFTER_SECONDS)
+constants.DATA_ACCESS_TOKEN_SECONDS = int(constants.DATA_ACCESS_TOKEN_SECONDS)
+constants.DATA_ACCESS_STUDY_CACHE_SECONDS = int(constants.DATA_ACCESS_STUDY_CACHE_SECONDS)
+constants.SYNC_CURSOR_LAG_SECONDS = int(constants.SYNC_CURSOR_LAG_SECONDS)
+constants.DOWNLOAD_FETCH_THREADS = int(constants.DOWNLOAD_FETCH_THREADS)
+constants.DOWNLOAD_FETCH_MAX_CONCURRENCY = int(constants.DOWNLOAD_FETCH_MAX_CONCURRENCY)
+constants.DOWNLOAD_PREFETCH_MAX_BYTES = int(constants.DOWNLOAD_PREFETCH_MAX_BYTES)
+constants.PARQUET_FILE_MAX_BYTES = int(constants.PARQUET_FILE_MAX_BYTES)
+constants.DOWNLOAD_SNAPSHOT_RETENTION_DAYS = int(constants.DOWNLOAD_SNAPSHOT_RETENTION_DAYS)
+constants.DATA_EXPORT_REUSE_SECONDS = int(constants.DATA_EXPORT_REUSE_SECONDS)
+constants.DATA_EXPORT_TIMEOUT_SECONDS = int(constants.DATA_EXPORT_TIMEOUT_SECONDS)
+constants.DATA_EXPORT_RETENTION_DAYS = int(constants.DATA_EXPORT_RETENTION_DAYS)
+constants.BINARY_CHUNK_ENCODING = constants.BINARY_CHUNK_ENCODING.upper() == "TRUE"
+constants.UPLOAD_MEMORY_BUFFER_SIZE = int(constants.UPLOAD_MEMORY_BUFFER_SIZE)
+constants.UPLOAD_SPOOL_MAX_BYTES = int(constants.UPLOAD_SPOOL_MAX_BYTES)
+constants.UPLOAD_SPOOL_MAX_AGE_SECONDS = int(constants.UPLOAD_SPOOL_MAX_AGE_SECONDS)
+constants.TELEMETRY_FLUSH_SIZE = int(constants.TELEMETRY_FLUSH_SIZE)
+constants.TELEMETRY_FLUSH_SECONDS = int(constants.TELEMETRY_FLUSH_SECONDS)
+constants.TELEMETRY_BUFFER_CAPACITY = int(constants.TELEMETRY_BUFFER_CAPACITY)
+constants.TELEMETRY_WRITE_BEHIND = constants.TELEMETRY_WRITE_BEHIND.upper() == "TRUE"
 
 # email addresses are parsed from a comma separated list
 # whitespace before and after addresses are stripped
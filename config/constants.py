@@ -21,6 +21,99 @@ CONCURRENT_NETWORK_OPS = getenv("CONCURRENT_NETWORK_OPS") or 10
 # Higher values reduce s3 usage, reduce processing time, but increase ram requirements.
 FILE_PROCESS_PAGE_SIZE = getenv("FILE_PROCESS_PAGE_SIZE") or 250
 
+## Device file decryption
+# Uploaded files are decrypted in batches of this many lines.
+DECRYPTION_BATCH_SIZE = getenv("DECRYPTION_BATCH_SIZE") or 2000
+# Lines of a file beyond this many have their batches decrypted on a thread pool, set to 0 to
+# always decrypt on the request thread.  (The AES code releases the GIL.)
+DECRYPTION_POOL_LINE_THRESHOLD = getenv("DECRYPTION_POOL_LINE_THRESHOLD") or 20000
+# Number of threads used for decrypting a single large file.
+CONCURRENT_DECRYPTION_OPS = getenv("CONCURRENT_DECRYPTION_OPS") or 4
+
+## Upload ingest
+# In "synchronous" mode an upload is decrypted, stored and registered for processing inside the
+# request.  In "deferred" mode the request only stores the raw (device-encrypted) upload, the
+# decryption is done later by the upload processing celery task, see libs.upload_processing.
+SYNCHRONOUS_UPLOAD_INGEST = "synchronous"
+DEFERRED_UPLOAD_INGEST = "deferred"
+UPLOAD_INGEST_MODE = getenv("UPLOAD_INGEST_MODE") or SYNCHRONOUS_UPLOAD_INGEST
+# Number of deferred uploads pulled in for decryption at a time, per participant.
+PENDING_UPLOAD_PAGE_SIZE = getenv("PENDING_UPLOAD_PAGE_SIZE") or 100
+# Deferred uploads that error this many times are no longer retried, they are reported and left
+# (with their raw data on S3) for an administrator to look into.
+PENDING_UPLOAD_MAX_ATTEMPTS = getenv("PENDING_UPLOAD_MAX_ATTEMPTS") or 5
+# A deferred upload is claimed by the task decrypting it, a claim older than this many seconds is
+# from a task that died and can be taken over. (default 1 hour)
+PENDING_UPLOAD_CLAIM_SECONDS = getenv("PENDING_UPLOAD_CLAIM_SECONDS") or 60*60
+# Device upload request bodies larger than this are rejected with a 413. (default 256MB)
+UPLOAD_MAX_SIZE = getenv("UPLOAD_MAX_SIZE") or 256*1024*1024
+# Uploaded file data is buffered in memory up to this size, and on disk beyond it. (default 1MB)
+UPLOAD_MEMORY_BUFFER_SIZE = getenv("UPLOAD_MEMORY_BUFFER_SIZE") or 1024*1024
+# Uploads are shed (answered with a 503 and a Retry-After) when any of these limits is exceeded:
+# the number of files waiting for data processing, the age in seconds of the oldest of them, and
+# the number of uploads being handled at once by a server process.  0 disables a limit.  Low
+# priority studies are shed at half of these limits, high priority studies at twice them.
+UPLOAD_SHED_BACKLOG_FILES = getenv("UPLOAD_SHED_BACKLOG_FILES") or 0
+UPLOAD_SHED_BACKLOG_AGE_SECONDS = getenv("UPLOAD_SHED_BACKLOG_AGE_SECONDS") or 0
+UPLOAD_SHED_IN_FLIGHT_REQUESTS = getenv("UPLOAD_SHED_IN_FLIGHT_REQUESTS") or 0
+# Shed uploads are told to retry after between 1 and 2 times this many seconds.
+UPLOAD_SHED_RETRY_AFTER_SECONDS = getenv("UPLOAD_SHED_RETRY_AFTER_SECONDS") or 60*10
+# Re-uploads of a file handled within this many days are acknowledged without handling it again.
+UPLOAD_FINGERPRINT_RETENTION_DAYS = getenv("UPLOAD_FINGERPRINT_RETENTION_DAYS") or 30
+
+## Upload spool
+# If set, decrypted uploads are also written (server-encrypted) to this local folder, and data
+# processing running on the same machine reads them from here instead of from S3.  Disabled when
+# not set, see libs.upload_spool.
+UPLOAD_SPOOL_DIRECTORY = getenv("UPLOAD_SPOOL_DIRECTORY") or None
+# Size limit of the spool folder, the oldest files are evicted above it. (default 1GB)
+UPLOAD_SPOOL_MAX_BYTES = getenv("UPLOAD_SPOOL_MAX_BYTES") or 1024*1024*1024
+# Spooled files older than this are evicted, data processing should have run well before then.
+UPLOAD_SPOOL_MAX_AGE_SECONDS = getenv("UPLOAD_SPOOL_MAX_AGE_SECONDS") or 60*60*6
+
+## Telemetry write-behind
+# If "true", upload tracking and decryption error records are buffered and written in bulk by a
+# background thread rather than inside the upload request, see libs.telemetry.
+TELEMETRY_WRITE_BEHIND = getenv("TELEMETRY_WRITE_BEHIND") or "false"
+# The buffer is written when it contains this many records, or after this many seconds.
+TELEMETRY_FLUSH_SIZE = getenv("TELEMETRY_FLUSH_SIZE") or 500
+TELEMETRY_FLUSH_SECONDS = getenv("TELEMETRY_FLUSH_SECONDS") or 5
+# Records beyond this number are dropped (and counted) if the database can't keep up.
+TELEMETRY_BUFFER_CAPACITY = getenv("TELEMETRY_BUFFER_CAPACITY") or 10000
+
+## Data access API
+# Access tokens (see libs.data_access_tokens) expire after this many seconds.
+DATA_ACCESS_TOKEN_SECONDS = getenv("DATA_ACCESS_TOKEN_SECONDS") or 60*60
+# The studies a researcher can access are cached for this many seconds for token requests.
+DATA_ACCESS_STUDY_CACHE_SECONDS = getenv("DATA_ACCESS_STUDY_CACHE_SECONDS") or 60
+# Sync cursors for incremental downloads lag this many seconds behind the current time, this must
+# be longer than it takes to save a chunk.
+SYNC_CURSOR_LAG_SECONDS = getenv("SYNC_CURSOR_LAG_SECONDS") or 60*2
+# Data downloads fetch files from S3 on a thread pool of this many threads shared by all the
+# downloads of a process, see libs.adaptive_fetch.
+DOWNLOAD_FETCH_THREADS = getenv("DOWNLOAD_FETCH_THREADS") or 12
+# The most fetches in flight for a single download.
+DOWNLOAD_FETCH_MAX_CONCURRENCY = getenv("DOWNLOAD_FETCH_MAX_CONCURRENCY") or 8
+# The most bytes fetched for a single download that its client has not read yet.
+DOWNLOAD_PREFETCH_MAX_BYTES = getenv("DOWNLOAD_PREFETCH_MAX_BYTES") or 64*1024*1024
+# Parquet downloads split a data stream into several files of about this size, a file is built in
+# memory before it is sent. (default 64MB)
+PARQUET_FILE_MAX_BYTES = getenv("PARQUET_FILE_MAX_BYTES") or 64*1024*1024
+# The chunk lists of resumable downloads (see libs.download_snapshots) are kept this many days.
+DOWNLOAD_SNAPSHOT_RETENTION_DAYS = getenv("DOWNLOAD_SNAPSHOT_RETENTION_DAYS") or 7
+# A data export (see libs.data_exports) is reused for identical queries made within this many seconds.
+DATA_EXPORT_REUSE_SECONDS = getenv("DATA_EXPORT_REUSE_SECONDS") or 60*60
+# A data export that has been running for this many seconds is from a task that died, it is marked
+# as failed. (default 12 hours)
+DATA_EXPORT_TIMEOUT_SECONDS = getenv("DATA_EXPORT_TIMEOUT_SECONDS") or 12*60*60
+# Data exports (the archive on S3 and the database record) are deleted after this many days.
+DATA_EXPORT_RETENTION_DAYS = getenv("DATA_EXPORT_RETENTION_DAYS") or 7
+
+## Binary chunk encoding
+# If "true", chunks of the BINARY_CHUNK_DATA_STREAMS are stored in a typed binary encoding instead
+# of csv, see libs.binary_chunks.  The data access API renders them back to csv.
+BINARY_CHUNK_ENCODING = getenv("BINARY_CHUNK_ENCODING") or "false"
+
 #This string will be printed into non-error hourly reports to improve error filtering.
 DATA_PROCESSING_NO_ERROR_STRING = getenv("DATA_PROCESSING_NO_ERROR_STRING") or "2HEnBwlawY"
 
@@ -89,6 +182,8 @@ CHUNK_TIMESLICE_QUANTUM = 3600
 # the name of the s3 folder that contains chunked data
 CHUNKS_FOLDER = "CHUNKED_DATA"
 PIPELINE_FOLDER = "PIPELINE_DATA"
+# the name of the s3 folder that contains deferred uploads that have not been decrypted yet
+RAW_UPLOADS_FOLDER = "RAW_UPLOAD_DATA"
 
 ## Constants for for the keys in data_stream_to_s3_file_name_string
 ACCELEROMETER = "accelerometer"
@@ -198,6 +293,12 @@ CHUNKABLE_FILES = {ACCELEROMETER,
                    REACHABILITY,
                    IOS_LOG_FILE}
 
+# high-rate sensor streams, see BINARY_CHUNK_ENCODING
+BINARY_CHUNK_DATA_STREAMS = {ACCELEROMETER,
+                             GYRO,
+                             MAGNETOMETER,
+                             DEVICEMOTION}
+
 ## Survey Question Types
 FREE_RESPONSE = "free_response"
 CHECKBOX = "checkbox"
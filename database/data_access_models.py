@@ -1,16 +1,22 @@
 import json
 import random
 import string
+import zlib
 
 from datetime import datetime
 
-from django.db import models
+from django.core.exceptions import ValidationError
+from django.db import IntegrityError, models, transaction
+from django.db.models import DateTimeField, F, Value
+from django.db.models.functions import Coalesce, Greatest
 from django.utils import timezone
 
 from config.constants import ALL_DATA_STREAMS, CHUNKABLE_FILES, CHUNK_TIMESLICE_QUANTUM, PIPELINE_FOLDER
 from database.validators import LengthValidator
+from libs.chunk_summaries import summarize_chunk
+from libs.data_coverage import count_hours, first_set_hour, hour_of, missing_hour_ranges, set_hour
 from libs.security import chunk_hash, low_memory_chunk_hash
-from database.models import AbstractModel
+from database.models import AbstractModel, JSONTextField
 from database.study_models import Study
 
 
@@ -23,9 +29,20 @@ class ChunkRegistry(AbstractModel):
 
     DATA_TYPE_CHOICES = tuple([(stream_name, stream_name) for stream_name in ALL_DATA_STREAMS])
 
+    # how the chunk is stored on S3, see libs.binary_chunks
+    CSV_FORMAT = "csv"
+    BINARY_FORMAT = "binary"
+    FILE_FORMAT_CHOICES = (
+        (CSV_FORMAT, CSV_FORMAT),
+        (BINARY_FORMAT, BINARY_FORMAT),
+    )
+
     is_chunkable = models.BooleanField()
     chunk_path = models.CharField(max_length=256, db_index=True)  # , unique=True)
     chunk_hash = models.CharField(max_length=25, blank=True)
+    # the size of the (decrypted) chunk in bytes, unknown for unchunkable data and older chunks.
+    file_size = models.BigIntegerField(null=True, blank=True)
+    file_format = models.CharField(max_length=16, choices=FILE_FORMAT_CHOICES, default=CSV_FORMAT)
 
     data_type = models.CharField(max_length=32, choices=DATA_TYPE_CHOICES, db_index=True)
     time_bin = models.DateTimeField(db_index=True)
@@ -34,8 +51,13 @@ class ChunkRegistry(AbstractModel):
     participant = models.ForeignKey('Participant', on_delete=models.PROTECT, related_name='chunk_registries', db_index=True)
     survey = models.ForeignKey('Survey', blank=True, null=True, on_delete=models.PROTECT, related_name='chunk_registries', db_index=True)
     
+    class Meta:
+        # for incremental downloads, see data_access_api.get_data
+        index_together = [("study", "last_updated")]
+    
     @classmethod
-    def register_chunked_data(cls, data_type, time_bin, chunk_path, file_contents, study_id, participant_id, survey_id=None):
+    def register_chunked_data(cls, data_type, time_bin, chunk_path, file_contents, study_id, participant_id, survey_id=None,
+                              file_format=CSV_FORMAT):
         
         if data_type not in CHUNKABLE_FILES:
             raise UnchunkableDataTypeError
@@ -54,16 +76,21 @@ class ChunkRegistry(AbstractModel):
         # timezone so it should be generalizable) is to add UTC as a timezone when storing a naive
         # datetime in the database.
         
-        cls.objects.create(
+        chunk = cls.objects.create(
             is_chunkable=True,
             chunk_path=chunk_path,
             chunk_hash=chunk_hash_str,
+            file_size=len(file_contents),
+            file_format=file_format,
             data_type=data_type,
             time_bin=time_bin,
             study_id=study_id,
             participant_id=participant_id,
             survey_id=survey_id,
         )
+        DataCoverage.record_hour(participant_id, data_type, time_bin)
+        DataFreshness.record_chunk(study_id, participant_id, data_type, time_bin)
+        return chunk
     
     @classmethod
     def register_unchunked_data(cls, data_type, unix_timestamp, chunk_path, study_id, participant_id, survey_id=None):
@@ -83,6 +110,8 @@ class ChunkRegistry(AbstractModel):
             participant_id=participant_id,
             survey_id=survey_id,
         )
+        DataCoverage.record_hour(participant_id, data_type, time_bin)
+        DataFreshness.record_chunk(study_id, participant_id, data_type, time_bin)
 
     @classmethod
     def get_chunks_time_range(cls, study_id, user_ids=None, data_types=None, start=None, end=None):
@@ -103,15 +132,161 @@ class ChunkRegistry(AbstractModel):
             query['time_bin__lte'] = end
         return cls.objects.filter(**query)
 
-    def update_chunk_hash(self, data_to_hash):
+    def update_chunk_hash(self, data_to_hash, file_format=CSV_FORMAT):
         self.chunk_hash = chunk_hash(data_to_hash)
+        self.file_size = len(data_to_hash)
+        self.file_format = file_format
         self.save()
 
-    def low_memory_update_chunk_hash(self, list_data_to_hash):
+    def low_memory_update_chunk_hash(self, list_data_to_hash, file_size=None, file_format=CSV_FORMAT):
         self.chunk_hash = low_memory_chunk_hash(list_data_to_hash)
+        self.file_size = file_size
+        self.file_format = file_format
         self.save()
 
 
+class DataCoverage(AbstractModel):
+    """ A bitmap of the hours that have data of a participant's data stream, updated when chunks
+    are registered, see libs.data_coverage. """
+    
+    participant = models.ForeignKey('Participant', on_delete=models.PROTECT, related_name='data_coverage')
+    data_type = models.CharField(max_length=32, choices=ChunkRegistry.DATA_TYPE_CHOICES)
+    # the hour (since the unix epoch) of the first bit of the bitmap
+    first_hour = models.IntegerField()
+    bitmap = models.BinaryField()
+    
+    class Meta:
+        unique_together = (("participant", "data_type"),)
+    
+    @classmethod
+    def record_hour(cls, participant_id, data_type, time_bin):
+        # Chunks of the same data stream are registered concurrently (see upload_binified_data),
+        # the bitmap is locked while it is updated so that no bit is lost.
+        hour = hour_of(time_bin)
+        coverages = cls.objects.select_for_update().filter(participant_id=participant_id, data_type=data_type)
+        with transaction.atomic():
+            coverage = coverages.first()
+            if coverage is None:
+                bitmap, first_hour, _ = set_hour(bytearray(), None, hour)
+                try:
+                    with transaction.atomic():
+                        cls.objects.create(
+                            participant_id=participant_id, data_type=data_type, first_hour=first_hour,
+                            bitmap=bytes(bitmap),
+                        )
+                    return
+                except (IntegrityError, ValidationError):
+                    # (created by a concurrent registration, full_clean may catch the unique
+                    # constraint before the database does)
+                    coverage = coverages.get()
+            bitmap, first_hour, changed = set_hour(bytearray(coverage.bitmap), coverage.first_hour, hour)
+            if changed:
+                coverage.update(first_hour=first_hour, bitmap=bytes(bitmap))
+    
+    def count_hours(self, start_hour, end_hour):
+        return count_hours(bytearray(self.bitmap), self.first_hour, start_hour, end_hour)
+    
+    def missing_hour_ranges(self, start_hour, end_hour):
+        return missing_hour_ranges(bytearray(self.bitmap), self.first_hour, start_hour, end_hour)
+    
+    def first_data_hour(self):
+        """ The first hour with data, None if there is none. """
+        return first_set_hour(bytearray(self.bitmap), self.first_hour)
+    
+    def end_hour(self):
+        """ The hour after the last bit of the bitmap. """
+        return self.first_hour + len(self.bitmap) * 8
+
+
+class DataFreshness(AbstractModel):
+    """ The latest data of a participant's data stream: the last upload (and the app version that
+    sent it) and the latest chunk time_bin.  Updated when files are uploaded and when chunks are
+    registered, so that finding the participants whose devices stopped sending data doesn't
+    aggregate over the UploadTracking table. """
+    
+    study = models.ForeignKey('Study', on_delete=models.PROTECT, related_name='data_freshness')
+    participant = models.ForeignKey('Participant', on_delete=models.PROTECT, related_name='data_freshness')
+    data_type = models.CharField(max_length=32, choices=ChunkRegistry.DATA_TYPE_CHOICES)
+    last_upload = models.DateTimeField(null=True, blank=True)
+    last_time_bin = models.DateTimeField(null=True, blank=True)
+    # (the app version is sent by newer versions of the app, it is blank until one has been sent)
+    last_app_version = models.CharField(max_length=32, blank=True)
+    
+    class Meta:
+        unique_together = (("participant", "data_type"),)
+    
+    @classmethod
+    def record_upload(cls, participant, data_type, app_version=None, uploaded_on=None):
+        # (deferred uploads are registered later, and not in upload order, the latest is kept)
+        uploaded_on = uploaded_on or timezone.now()
+        uploaded_on_value = Value(uploaded_on, output_field=DateTimeField())
+        changes = {"last_upload": Greatest(Coalesce(F("last_upload"), uploaded_on_value), uploaded_on_value)}
+        initial_values = {"last_upload": uploaded_on}
+        if app_version:
+            changes["last_app_version"] = initial_values["last_app_version"] = app_version[:32]
+        cls._upsert(participant.study_id, participant.pk, data_type, changes, initial_values)
+    
+    @classmethod
+    def record_chunk(cls, study_id, participant_id, data_type, time_bin):
+        # chunks are not registered in time order, the latest time_bin is kept
+        time_bin_value = Value(time_bin, output_field=DateTimeField())
+        cls._upsert(study_id, participant_id, data_type, {
+            "last_time_bin": Greatest(Coalesce(F("last_time_bin"), time_bin_value), time_bin_value)
+        }, {"last_time_bin": time_bin})
+    
+    @classmethod
+    def _upsert(cls, study_id, participant_id, data_type, changes, initial_values=None):
+        freshness = cls.objects.filter(participant_id=participant_id, data_type=data_type)
+        if freshness.update(last_updated=timezone.now(), **changes):
+            return
+        try:
+            cls.objects.create(study_id=study_id, participant_id=participant_id, data_type=data_type,
+                               **(initial_values or changes))
+        except (IntegrityError, ValidationError):
+            # (created by a concurrent update, full_clean catches the unique constraint)
+            freshness.update(last_updated=timezone.now(), **changes)
+
+
+class ChunkSummary(AbstractModel):
+    """ Hourly numbers of the rows of a chunk, saved when the chunk is saved, see
+    libs.chunk_summaries. """
+    
+    chunk = models.OneToOneField(ChunkRegistry, on_delete=models.CASCADE, related_name='summary')
+    row_count = models.IntegerField()
+    # the fraction of the minutes of the chunk's hour that have rows
+    coverage = models.FloatField()
+    # the values of the chunk's data stream, a json dictionary
+    stream_values = JSONTextField(default="{}")
+    
+    @classmethod
+    def save_chunk_summary(cls, chunk, chunk_contents):
+        row_count, coverage, values = summarize_chunk(chunk.data_type, chunk_contents)
+        summary, created = cls.objects.get_or_create(
+            chunk=chunk, defaults={"row_count": row_count, "coverage": coverage, "stream_values": json.dumps(values)}
+        )
+        if not created:
+            summary.update(row_count=row_count, coverage=coverage, stream_values=json.dumps(values))
+        return summary
+
+
+class SurveyAnswer(AbstractModel):
+    """ An answer to a survey question, indexed from the survey answers files when they are
+    processed, see libs.survey_answers. """
+    
+    participant = models.ForeignKey('Participant', on_delete=models.PROTECT, related_name='survey_answers')
+    survey = models.ForeignKey('Survey', on_delete=models.PROTECT, related_name='survey_answers')
+    question_id = models.CharField(max_length=256)
+    question_text = models.TextField(blank=True)
+    # the time of the survey answers file
+    answered_at = models.DateTimeField()
+    answer = models.TextField(blank=True)
+    # the answer as a number, if it is one
+    numeric_answer = models.FloatField(null=True, blank=True)
+    
+    class Meta:
+        index_together = [("participant", "survey", "answered_at"), ("survey", "question_id", "answered_at")]
+
+
 class FileToProcess(AbstractModel):
 
     s3_file_path = models.CharField(max_length=256, blank=False)
@@ -124,10 +299,52 @@ class FileToProcess(AbstractModel):
         # Get the study's primary key
         study_pk = Study.objects.filter(object_id=study_object_id).values_list('pk', flat=True).get()
         
-        if file_path[:24] == study_object_id:
-            cls.objects.create(s3_file_path=file_path, study_id=study_pk, **kwargs)
-        else:
-            cls.objects.create(s3_file_path=study_object_id + '/' + file_path, study_id=study_pk, **kwargs)
+        if file_path[:24] != study_object_id:
+            file_path = study_object_id + '/' + file_path
+        
+        # Uploads can be registered more than once (device retries, deferred uploads are processed
+        # at-least-once), the file only needs to be processed once.  Returns whether the file was
+        # added.
+        if cls.objects.filter(s3_file_path=file_path, study_id=study_pk, **kwargs).exists():
+            return False
+        cls.objects.create(s3_file_path=file_path, study_id=study_pk, **kwargs)
+        return True
+
+
+class PendingUpload(AbstractModel):
+    """ A device upload that has been stored, still encrypted with the device's key, but has not
+    been decrypted yet.  These are created by the upload endpoint when UPLOAD_INGEST_MODE is
+    "deferred" and are consumed by libs.upload_processing.process_pending_uploads. """
+    
+    file_name = models.CharField(max_length=256)
+    s3_file_path = models.CharField(max_length=256)
+    attempts = models.PositiveIntegerField(default=0)
+    app_version = models.CharField(max_length=32, blank=True)
+    # set while a task is decrypting the upload, see libs.upload_processing.claim_pending_upload
+    claimed_on = models.DateTimeField(null=True, blank=True)
+    
+    study = models.ForeignKey('Study', on_delete=models.PROTECT, related_name='pending_uploads')
+    participant = models.ForeignKey('Participant', on_delete=models.PROTECT, related_name='pending_uploads')
+    
+    class Meta:
+        # a device retrying an upload sends the same file name, it must not be processed twice.
+        unique_together = (("participant", "file_name"),)
+    
+    @classmethod
+    def add_pending_upload(cls, participant, file_name, s3_file_path, app_version=None):
+        """ Creates the PendingUpload of a file unless the file is already pending, a device can
+        retry an upload while the first request is still being handled. """
+        try:
+            cls.objects.create(
+                file_name=file_name,
+                s3_file_path=s3_file_path,
+                app_version=(app_version or "")[:32],
+                study_id=participant.study_id,
+                participant=participant,
+            )
+        except (IntegrityError, ValidationError):
+            # (full_clean catches the unique constraint before the database does)
+            pass
 
 
 class FileProcessLock(AbstractModel):
@@ -242,3 +459,48 @@ class PipelineUpload(AbstractModel):
 class PipelineUploadTags(AbstractModel):
     pipeline_upload = models.ForeignKey(PipelineUpload, related_name="tags")
     tag = models.TextField()
+
+
+class DownloadSnapshot(AbstractModel):
+    """ The files of a resumable data download, see libs.download_snapshots. """
+    
+    study = models.ForeignKey(Study, on_delete=models.PROTECT, related_name='download_snapshots')
+    # the new sync cursor of the download, if it had one
+    sync_cursor = models.CharField(max_length=64, blank=True)
+    # the ids of the chunks of the download's files in the order they are sent, zlib compressed json
+    chunk_ids = models.BinaryField()
+    
+    @classmethod
+    def create_snapshot(cls, study_id, chunk_ids, sync_cursor=None):
+        return cls.objects.create(
+            study_id=study_id, sync_cursor=sync_cursor or "", chunk_ids=zlib.compress(json.dumps(chunk_ids))
+        )
+    
+    def get_chunk_ids(self):
+        return json.loads(zlib.decompress(self.chunk_ids))
+
+
+class DataExport(AbstractModel):
+    """ An archive of the data of a data access API query, built in the background (see
+    libs.data_exports) and stored on S3.  Identical queries share an export for a while. """
+    
+    QUEUED = "queued"
+    RUNNING = "running"
+    DONE = "done"
+    FAILED = "failed"
+    STATUS_CHOICES = (
+        (QUEUED, QUEUED),
+        (RUNNING, RUNNING),
+        (DONE, DONE),
+        (FAILED, FAILED),
+    )
+    
+    study = models.ForeignKey(Study, on_delete=models.PROTECT, related_name='data_exports')
+    researcher = models.ForeignKey('Researcher', on_delete=models.PROTECT, related_name='data_exports')
+    query = JSONTextField()
+    query_hash = models.CharField(max_length=40, db_index=True)
+    archive_format = models.CharField(max_length=16)
+    status = models.CharField(max_length=16, choices=STATUS_CHOICES, default=QUEUED)
+    s3_path = models.CharField(max_length=256, blank=True)
+    file_size = models.BigIntegerField(null=True, blank=True)
+    finished_on = models.DateTimeField(null=True, blank=True)
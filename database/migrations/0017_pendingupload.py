@@ -0,0 +1,34 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.18 on 2026-10-19 01:11
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('database', '0016_auto_20181210_1757'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PendingUpload',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('deleted', models.BooleanField(default=False)),
+                ('created_on', models.DateTimeField(auto_now_add=True)),
+                ('last_updated', models.DateTimeField(auto_now=True)),
+                ('file_name', models.CharField(max_length=256)),
+                ('s3_file_path', models.CharField(max_length=256)),
+                ('attempts', models.PositiveIntegerField(default=0)),
+                ('participant', models.ForeignKey(on_delete=django.db.models.deletion.PROTECT, related_name='pending_uploads', to='database.Participant')),
+                ('study', models.ForeignKey(on_delete=django.db.models.deletion.PROTECT, related_name='pending_uploads', to='database.Study')),
+            ],
+        ),
+        migrations.AlterUniqueTogether(
+            name='pendingupload',
+            unique_together=set([('participant', 'file_name')]),
+        ),
+    ]
@@ -0,0 +1,31 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.18 on 2026-10-19 01:15
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('database', '0017_pendingupload'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='UploadFingerprint',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('deleted', models.BooleanField(default=False)),
+                ('created_on', models.DateTimeField(auto_now_add=True)),
+                ('last_updated', models.DateTimeField(auto_now=True)),
+                ('fingerprint', models.CharField(max_length=40, unique=True)),
+                ('duplicate_count', models.PositiveIntegerField(default=0)),
+                ('participant', models.ForeignKey(on_delete=django.db.models.deletion.PROTECT, related_name='upload_fingerprints', to='database.Participant')),
+            ],
+            options={
+                'abstract': False,
+            },
+        ),
+    ]
@@ -0,0 +1,19 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.18 on 2026-10-19 01:21
+from __future__ import unicode_literals
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('database', '0019_study_upload_priority'),
+    ]
+
+    operations = [
+        migrations.AlterIndexTogether(
+            name='chunkregistry',
+            index_together=set([('study', 'last_updated')]),
+        ),
+    ]
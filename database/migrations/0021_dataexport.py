@@ -0,0 +1,38 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.18 on 2026-10-19 01:33
+from __future__ import unicode_literals
+
+import database.common_models
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('database', '0020_chunkregistry_study_last_updated_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DataExport',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('deleted', models.BooleanField(default=False)),
+                ('created_on', models.DateTimeField(auto_now_add=True)),
+                ('last_updated', models.DateTimeField(auto_now=True)),
+                ('query', database.common_models.JSONTextField()),
+                ('query_hash', models.CharField(db_index=True, max_length=40)),
+                ('archive_format', models.CharField(max_length=16)),
+                ('status', models.CharField(choices=[(b'queued', b'queued'), (b'running', b'running'), (b'done', b'done'), (b'failed', b'failed')], default=b'queued', max_length=16)),
+                ('s3_path', models.CharField(blank=True, max_length=256)),
+                ('file_size', models.BigIntegerField(blank=True, null=True)),
+                ('finished_on', models.DateTimeField(blank=True, null=True)),
+                ('researcher', models.ForeignKey(on_delete=django.db.models.deletion.PROTECT, related_name='data_exports', to='database.Researcher')),
+                ('study', models.ForeignKey(on_delete=django.db.models.deletion.PROTECT, related_name='data_exports', to='database.Study')),
+            ],
+            options={
+                'abstract': False,
+            },
+        ),
+    ]
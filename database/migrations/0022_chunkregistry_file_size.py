@@ -0,0 +1,20 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.18 on 2026-10-19 01:34
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('database', '0021_dataexport'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='chunkregistry',
+            name='file_size',
+            field=models.BigIntegerField(blank=True, null=True),
+        ),
+    ]
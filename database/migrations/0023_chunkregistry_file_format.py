@@ -0,0 +1,20 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.18 on 2026-10-19 01:40
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('database', '0022_chunkregistry_file_size'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='chunkregistry',
+            name='file_format',
+            field=models.CharField(choices=[(b'csv', b'csv'), (b'binary', b'binary')], default=b'csv', max_length=16),
+        ),
+    ]
@@ -0,0 +1,33 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.18 on 2026-10-19 01:42
+from __future__ import unicode_literals
+
+import database.common_models
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('database', '0023_chunkregistry_file_format'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ChunkSummary',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('deleted', models.BooleanField(default=False)),
+                ('created_on', models.DateTimeField(auto_now_add=True)),
+                ('last_updated', models.DateTimeField(auto_now=True)),
+                ('row_count', models.IntegerField()),
+                ('coverage', models.FloatField()),
+                ('stream_values', database.common_models.JSONTextField(default=b'{}')),
+                ('chunk', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='summary', to='database.ChunkRegistry')),
+            ],
+            options={
+                'abstract': False,
+            },
+        ),
+    ]
@@ -0,0 +1,36 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.18 on 2026-10-19 01:44
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('database', '0024_chunksummary'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SurveyAnswer',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('deleted', models.BooleanField(default=False)),
+                ('created_on', models.DateTimeField(auto_now_add=True)),
+                ('last_updated', models.DateTimeField(auto_now=True)),
+                ('question_id', models.CharField(max_length=256)),
+                ('question_text', models.TextField(blank=True)),
+                ('answered_at', models.DateTimeField()),
+                ('answer', models.TextField(blank=True)),
+                ('numeric_answer', models.FloatField(blank=True, null=True)),
+                ('participant', models.ForeignKey(on_delete=django.db.models.deletion.PROTECT, related_name='survey_answers', to='database.Participant')),
+                ('survey', models.ForeignKey(on_delete=django.db.models.deletion.PROTECT, related_name='survey_answers', to='database.Survey')),
+            ],
+        ),
+        migrations.AlterIndexTogether(
+            name='surveyanswer',
+            index_together=set([('survey', 'question_id', 'answered_at'), ('participant', 'survey', 'answered_at')]),
+        ),
+    ]
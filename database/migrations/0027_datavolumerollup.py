@@ -0,0 +1,42 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.18 on 2026-10-19 01:48
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('database', '0026_datacoverage'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DataVolumeRollup',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('deleted', models.BooleanField(default=False)),
+                ('created_on', models.DateTimeField(auto_now_add=True)),
+                ('last_updated', models.DateTimeField(auto_now=True)),
+                ('data_type', models.CharField(max_length=32)),
+                ('day', models.DateField()),
+                ('files', models.PositiveIntegerField(default=0)),
+                ('bytes', models.BigIntegerField(default=0)),
+                ('rows', models.BigIntegerField(default=0)),
+                ('first_seen', models.DateTimeField(blank=True, null=True)),
+                ('last_seen', models.DateTimeField(blank=True, null=True)),
+                ('participant', models.ForeignKey(on_delete=django.db.models.deletion.PROTECT, related_name='data_volume_rollups', to='database.Participant')),
+                ('study', models.ForeignKey(on_delete=django.db.models.deletion.PROTECT, related_name='data_volume_rollups', to='database.Study')),
+            ],
+        ),
+        migrations.AlterUniqueTogether(
+            name='datavolumerollup',
+            unique_together=set([('participant', 'data_type', 'day')]),
+        ),
+        migrations.AlterIndexTogether(
+            name='datavolumerollup',
+            index_together=set([('study', 'day')]),
+        ),
+    ]
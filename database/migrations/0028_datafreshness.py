@@ -0,0 +1,35 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.18 on 2026-10-19 01:50
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('database', '0027_datavolumerollup'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DataFreshness',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('deleted', models.BooleanField(default=False)),
+                ('created_on', models.DateTimeField(auto_now_add=True)),
+                ('last_updated', models.DateTimeField(auto_now=True)),
+                ('data_type', models.CharField(choices=[(b'accelerometer', b'accelerometer'), (b'bluetooth', b'bluetooth'), (b'calls', b'calls'), (b'gps', b'gps'), (b'identifiers', b'identifiers'), (b'app_log', b'app_log'), (b'power_state', b'power_state'), (b'survey_answers', b'survey_answers'), (b'survey_timings', b'survey_timings'), (b'texts', b'texts'), (b'audio_recordings', b'audio_recordings'), (b'wifi', b'wifi'), (b'proximity', b'proximity'), (b'gyro', b'gyro'), (b'magnetometer', b'magnetometer'), (b'devicemotion', b'devicemotion'), (b'reachability', b'reachability'), (b'ios_log', b'ios_log'), (b'image_survey', b'image_survey')], max_length=32)),
+                ('last_upload', models.DateTimeField(blank=True, null=True)),
+                ('last_time_bin', models.DateTimeField(blank=True, null=True)),
+                ('last_app_version', models.CharField(blank=True, max_length=32)),
+                ('participant', models.ForeignKey(on_delete=django.db.models.deletion.PROTECT, related_name='data_freshness', to='database.Participant')),
+                ('study', models.ForeignKey(on_delete=django.db.models.deletion.PROTECT, related_name='data_freshness', to='database.Study')),
+            ],
+        ),
+        migrations.AlterUniqueTogether(
+            name='datafreshness',
+            unique_together=set([('participant', 'data_type')]),
+        ),
+    ]
@@ -0,0 +1,31 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.18 on 2026-10-19 02:04
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('database', '0028_datafreshness'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DownloadSnapshot',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('deleted', models.BooleanField(default=False)),
+                ('created_on', models.DateTimeField(auto_now_add=True)),
+                ('last_updated', models.DateTimeField(auto_now=True)),
+                ('sync_cursor', models.CharField(blank=True, max_length=64)),
+                ('chunk_ids', models.BinaryField()),
+                ('study', models.ForeignKey(on_delete=django.db.models.deletion.PROTECT, related_name='download_snapshots', to='database.Study')),
+            ],
+            options={
+                'abstract': False,
+            },
+        ),
+    ]
@@ -0,0 +1,20 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.18 on 2026-10-19 02:15
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('database', '0029_downloadsnapshot'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='pendingupload',
+            name='claimed_on',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+    ]
@@ -0,0 +1,20 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.18 on 2026-10-19 02:21
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('database', '0030_pendingupload_claimed_on'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='pendingupload',
+            name='app_version',
+            field=models.CharField(blank=True, max_length=32),
+        ),
+    ]
@@ -77,6 +77,8 @@ class UploadTracking(AbstractModel):
     
     @classmethod
     def weekly_stats(cls, days=7, get_usernames=False):
+        """ The megabytes and number of files uploaded of each data stream, and in total, in the
+        last days (whole utc days, from the daily DataVolumeRollups). """
         ALL_FILETYPES = UPLOAD_FILE_TYPE_MAPPING.values()
         if get_usernames:
             data = {filetype: {"megabytes": 0., "count": 0, "users": set()} for filetype in ALL_FILETYPES}
@@ -87,32 +89,23 @@ class UploadTracking(AbstractModel):
         data["totals"]["total_megabytes"] = 0
         data["totals"]["total_count"] = 0
         data["totals"]["users"] = set()
-        days_delta = timezone.now() - timedelta(days=days)
-        # .values is a huge speedup, .iterator isn't but it does let us print progress realistically
-        query = UploadTracking.objects.filter(timestamp__gte=days_delta).values(
-                "file_path", "file_size", "participant"
+        first_day = (timezone.now() - timedelta(days=days)).astimezone(timezone.utc).date()
+        query = DataVolumeRollup.objects.filter(day__gte=first_day, files__gt=0).values_list(
+                "participant", "data_type", "files", "bytes"
         ).iterator()
         
-        for i, upload in enumerate(query):
+        for participant, file_type, files, size in query:
             # global stats
-            data["totals"]["total_count"] += 1
-            data["totals"]["total_megabytes"] += upload["file_size"]/ 1024. / 1024.
-            data["totals"]["users"].add(upload["participant"])
+            data["totals"]["total_count"] += files
+            data["totals"]["total_megabytes"] += size / 1024. / 1024.
+            data["totals"]["users"].add(participant)
             
-            # get data stream type from file_path (woops, ios log broke this code, fixed)
-            path_extraction = upload["file_path"].split("/", 2)[1]
-            if path_extraction == "ios":
-                path_extraction = "ios_log"
-                
-            file_type = UPLOAD_FILE_TYPE_MAPPING[path_extraction]
             # update per-data-stream information
-            data[file_type]["megabytes"] += upload["file_size"]/ 1024. / 1024.
-            data[file_type]["count"] += 1
+            data[file_type]["megabytes"] += size / 1024. / 1024.
+            data[file_type]["count"] += files
             
             if get_usernames:
-                data[file_type]["users"].add(upload["participant"])
-            if i % 10000 == 0:
-                print("processed %s uploads..." % i)
+                data[file_type]["users"].add(participant)
         
         data["totals"]["user_count"] = len(data["totals"]["users"])
         
@@ -120,3 +113,46 @@ class UploadTracking(AbstractModel):
             del data["totals"]["users"]
         
         return data
+
+
+class DataVolumeRollup(AbstractModel):
+    """ The files and bytes uploaded, and the rows processed, of a participant's data stream on a
+    (utc) day: the day the server received the files and processed the rows.  Updated as uploads
+    are recorded and chunked, see libs.volume_rollups. """
+    
+    study = models.ForeignKey('Study', on_delete=models.PROTECT, related_name='data_volume_rollups')
+    participant = models.ForeignKey('Participant', on_delete=models.PROTECT, related_name='data_volume_rollups')
+    data_type = models.CharField(max_length=32)
+    day = models.DateField()
+    
+    files = models.PositiveIntegerField(default=0)
+    bytes = models.BigIntegerField(default=0)
+    rows = models.BigIntegerField(default=0)
+    # the first and last uploads of the day
+    first_seen = models.DateTimeField(null=True, blank=True)
+    last_seen = models.DateTimeField(null=True, blank=True)
+    
+    class Meta:
+        unique_together = (("participant", "data_type", "day"),)
+        index_together = [("study", "day")]
+
+
+class UploadFingerprint(AbstractModel):
+    """ Identifies an upload that has already been handled, so that a device re-sending a file
+    (because it missed the response) can be acknowledged without handling the file again.
+    The fingerprint is a digest of the patient id, the file name and the uploaded content. """
+    
+    fingerprint = models.CharField(max_length=40, unique=True)
+    duplicate_count = models.PositiveIntegerField(default=0)
+    
+    participant = models.ForeignKey('Participant', on_delete=models.PROTECT, related_name='upload_fingerprints')
+    
+    @classmethod
+    def duplicate_stats(cls, days=7):
+        """ Returns the number of unique uploads and the number of re-uploads of those in the
+        last days. """
+        stats = cls.objects.filter(created_on__gte=timezone.now() - timedelta(days=days)).aggregate(
+            unique_uploads=models.Count("id"), duplicate_uploads=models.Sum("duplicate_count")
+        )
+        stats["duplicate_uploads"] = stats["duplicate_uploads"] or 0
+        return stats
@@ -5,6 +5,7 @@ from django.db.models.signals import post_save, pre_save
 from django.dispatch import receiver
 
 from database.study_models import DeviceSettings, Study, Survey, SurveyArchive
+from libs.study_payload_cache import invalidate_study_payloads
 
 
 @receiver(post_save, sender=Study)
@@ -73,3 +74,13 @@ def create_survey_archive(sender, **kwargs):
         # previous archive to extend to the current time. Note that object.update saves the
         # object, unlike QuerySet.update. See base_models.AbstractModel for details.
         last_archive.update(archive_end=timezone.now())
+
+
+@receiver(post_save, sender=Survey)
+@receiver(post_save, sender=DeviceSettings)
+def invalidate_cached_study_payloads(sender, **kwargs):
+    """
+    Drop this process's cached survey and device settings payloads of the study, other processes
+    see the change through the version check in libs.study_payload_cache.
+    """
+    invalidate_study_payloads(kwargs['instance'].study_id)
@@ -33,6 +33,19 @@ class Study(AbstractModel):
 
     is_test = models.BooleanField(default=True)
     
+    # Sets how early this study's uploads are shed when the server is overloaded, see
+    # libs.admission_control.
+    LOW_UPLOAD_PRIORITY = 0
+    NORMAL_UPLOAD_PRIORITY = 1
+    HIGH_UPLOAD_PRIORITY = 2
+    UPLOAD_PRIORITY_CHOICES = (
+        (LOW_UPLOAD_PRIORITY, "low"),
+        (NORMAL_UPLOAD_PRIORITY, "normal"),
+        (HIGH_UPLOAD_PRIORITY, "high"),
+    )
+    upload_priority = models.PositiveSmallIntegerField(default=NORMAL_UPLOAD_PRIORITY,
+                                                       choices=UPLOAD_PRIORITY_CHOICES)
+    
     @classmethod
     def create_with_object_id(cls, **kwargs):
         """
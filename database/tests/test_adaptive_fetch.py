@@ -0,0 +1,54 @@
+from threading import Lock
+from time import sleep
+
+from django.test import TestCase
+
+from libs.adaptive_fetch import fetch_ordered, fetch_unordered, target_concurrency
+from libs.metrics import get_counter, reset_counters
+
+
+class AdaptiveFetchTests(TestCase):
+
+    def setUp(self):
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.lock = Lock()
+        reset_counters()
+
+    def fetch(self, item):
+        with self.lock:
+            self.in_flight += 1
+            self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        sleep(0.01)
+        with self.lock:
+            self.in_flight -= 1
+        return item, "x" * 100
+
+    def test_fetches_every_item(self):
+        results = fetch_unordered(self.fetch, xrange(20), lambda result: len(result[1]))
+        self.assertEqual(sorted(item for item, _ in results), range(20))
+
+    def test_fetch_ordered(self):
+        def fetch(item):
+            sleep(0.001 * (item % 3))
+            return item
+        self.assertEqual(list(fetch_ordered(fetch, xrange(20), lambda result: 1)), range(20))
+
+    def test_fetch_errors_are_raised(self):
+        def fetch(item):
+            if item == 3:
+                raise ValueError("failed fetch")
+            return item
+        with self.assertRaises(ValueError):
+            list(fetch_unordered(fetch, xrange(5), lambda result: 1))
+
+    def test_prefetched_bytes_are_capped(self):
+        results = fetch_unordered(self.fetch, xrange(10), lambda result: len(result[1]), max_prefetch_bytes=150)
+        self.assertEqual(len(list(results)), 10)
+        self.assertGreater(get_counter("download.prefetch.memory_capped"), 0)
+
+    def test_slow_clients_get_less_concurrency(self):
+        self.assertEqual(target_concurrency(0.1, 1.0), 1)
+        self.assertEqual(target_concurrency(0.3, 0.1), 3)
+        self.assertEqual(target_concurrency(10.0, 0.001), 8)
+        self.assertEqual(target_concurrency(0.1, 0), 8)
@@ -0,0 +1,77 @@
+from base64 import b64encode
+
+from django.test import TestCase
+from flask import Flask, request
+
+from database.data_access_models import FileToProcess
+from database.study_models import Study
+from database.user_models import Participant
+from libs import admission_control
+from libs.admission_control import admission_controlled, get_shed_reason
+from libs.metrics import get_counter, reset_counters
+
+
+class AdmissionControlTests(TestCase):
+
+    def setUp(self):
+        self.study = Study.create_with_object_id(
+            name="TEST_STUDY_FOR_ADMISSION", encryption_key='aabbccddefggiijjkklmnoppqqrrsstt'
+        )
+        self.patient_id, _ = Participant.create_with_rnd_password(study=self.study)
+        self.participant = Participant.objects.get(patient_id=self.patient_id)
+        self.original_limit = admission_control.UPLOAD_SHED_BACKLOG_FILES
+        admission_control.UPLOAD_SHED_BACKLOG_FILES = 2
+        admission_control._backlog["checked"] = None
+        self.app = Flask(__name__)
+        reset_counters()
+
+    def tearDown(self):
+        admission_control.UPLOAD_SHED_BACKLOG_FILES = self.original_limit
+        admission_control._backlog["checked"] = None
+
+    def add_files_to_process(self, count):
+        for i in xrange(count):
+            FileToProcess.append_file_for_processing("%s/file_%s.csv" % (self.patient_id, i),
+                                                     self.study.object_id, participant=self.participant)
+        admission_control._backlog["checked"] = None
+
+    def shed_reason(self):
+        with self.app.test_request_context(method="POST", query_string={"patient_id": self.patient_id}):
+            return get_shed_reason()
+
+    def test_sheds_by_priority(self):
+        self.add_files_to_process(3)
+        self.assertEqual(self.shed_reason(), "backlog")
+        self.study.upload_priority = Study.HIGH_UPLOAD_PRIORITY
+        self.study.save()
+        self.assertIsNone(self.shed_reason())
+
+    def test_low_priority_sheds_first(self):
+        self.add_files_to_process(2)
+        self.assertIsNone(self.shed_reason())
+        self.study.upload_priority = Study.LOW_UPLOAD_PRIORITY
+        self.study.save()
+        self.assertEqual(self.shed_reason(), "backlog")
+
+    def test_priority_does_not_parse_the_body(self):
+        self.add_files_to_process(2)
+        self.study.upload_priority = Study.LOW_UPLOAD_PRIORITY
+        self.study.save()
+        # (ios sends the patient id in the basic auth username)
+        headers = {"Authorization": "Basic " + b64encode(self.patient_id + "@device:password")}
+        with self.app.test_request_context(method="POST", data={"file": "x" * 100}, headers=headers):
+            self.assertEqual(get_shed_reason(), "backlog")
+            self.assertNotIn("form", request.__dict__)
+        # without a patient id in the query string or headers the upload is normal priority
+        with self.app.test_request_context(method="POST", data={"patient_id": self.patient_id}):
+            self.assertIsNone(get_shed_reason())
+
+    def test_shed_response(self):
+        self.add_files_to_process(3)
+        view = admission_controlled(lambda: ("ok", 200))
+        with self.app.test_request_context(method="POST", query_string={"patient_id": self.patient_id}):
+            body, status, headers = view()
+        self.assertEqual(status, 503)
+        self.assertTrue(600 <= int(headers["Retry-After"]) <= 1200)
+        self.assertEqual(get_counter("upload.shed.backlog"), 1)
+        self.assertEqual(admission_control._in_flight["count"], 0)
@@ -0,0 +1,76 @@
+from django.test import TestCase
+
+from api import data_access_api
+from database.data_access_models import ChunkRegistry
+from database.study_models import Study
+from database.user_models import Participant
+from libs.binary_chunks import (chunk_to_csv, decode_binary_chunk, encode_binary_chunk,
+    is_binary_chunk)
+
+ACCELEROMETER_CHUNK = (
+    "timestamp,UTC time,accuracy,x,y,z\n"
+    "1524000000000,2018-04-17T21:20:00.000,unknown,0.0123,-9.81,0.5\n"
+    "1524000000020,2018-04-17T21:20:00.020,unknown,0.0125,-9.8,0.25\n"
+    "1524000000041,2018-04-17T21:20:00.041,high,-0.001,-9.79,1.0"
+)
+
+
+class BinaryChunkTests(TestCase):
+
+    def test_round_trip(self):
+        encoded = encode_binary_chunk(ACCELEROMETER_CHUNK)
+        self.assertTrue(is_binary_chunk(encoded))
+        self.assertEqual(decode_binary_chunk(encoded), ACCELEROMETER_CHUNK)
+
+    def test_header_only_chunk(self):
+        self.assertEqual(decode_binary_chunk(encode_binary_chunk("timestamp,x")), "timestamp,x")
+
+    def test_values_that_would_change_are_strings(self):
+        # "1e-05" and "1.50" are not how their floats are written, they are kept as text.
+        chunk = "timestamp,x,y\n1000,1e-05,1.50\n2000,,2"
+        self.assertEqual(decode_binary_chunk(encode_binary_chunk(chunk)), chunk)
+
+    def test_chunks_that_cant_be_encoded(self):
+        self.assertIsNone(encode_binary_chunk("timestamp,x\nsoon,1"))
+        self.assertIsNone(encode_binary_chunk("timestamp,x\n1000,1,2"))
+        self.assertIsNone(encode_binary_chunk("x,timestamp\n1,1000"))
+
+    def test_csv_chunks_are_unchanged(self):
+        self.assertEqual(chunk_to_csv(ACCELEROMETER_CHUNK), ACCELEROMETER_CHUNK)
+
+
+class BinaryChunkDownloadTests(TestCase):
+
+    def setUp(self):
+        self.study = Study.create_with_object_id(
+            name="TEST_STUDY_FOR_BINARY_CHUNKS", encryption_key='aabbccddefggiijjkklmnoppqqrrsstt'
+        )
+        patient_id, _ = Participant.create_with_rnd_password(study=self.study)
+        participant = Participant.objects.get(patient_id=patient_id)
+        ChunkRegistry.register_chunked_data(
+            "accelerometer", 1, "chunk_path.csv", ACCELEROMETER_CHUNK, self.study.pk, participant.pk,
+            file_format=ChunkRegistry.BINARY_FORMAT
+        )
+        self.encoded = encode_binary_chunk(ACCELEROMETER_CHUNK)
+        self.original_s3_retrieve = data_access_api.s3_retrieve
+        data_access_api.s3_retrieve = lambda *args, **kwargs: self.encoded
+
+    def tearDown(self):
+        data_access_api.s3_retrieve = self.original_s3_retrieve
+
+    def test_chunks_are_downloaded_as_csv(self):
+        chunk = data_access_api.handle_database_query(self.study.pk, {}).get()
+        _, contents = data_access_api.batch_retrieve_s3(chunk)
+        self.assertEqual(contents, ACCELEROMETER_CHUNK)
+        self.assertTrue(data_access_api.determine_file_name(chunk).endswith(".csv"))
+
+    def test_raw_chunks(self):
+        chunk = data_access_api.handle_database_query(self.study.pk, {}).get()
+        _, contents = data_access_api.batch_retrieve_s3(chunk, raw_chunks=True)
+        self.assertEqual(contents, self.encoded)
+        self.assertTrue(data_access_api.determine_file_name(chunk, raw_chunks=True).endswith(".bin"))
+
+    def test_hash_and_size_are_of_the_csv(self):
+        chunk = ChunkRegistry.objects.get()
+        self.assertEqual(chunk.file_size, len(ACCELEROMETER_CHUNK))
+        self.assertEqual(chunk.file_format, ChunkRegistry.BINARY_FORMAT)
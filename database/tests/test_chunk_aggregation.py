@@ -0,0 +1,34 @@
+from django.test import TestCase
+
+from libs.chunk_aggregation import aggregate_chunk, aggregates_to_csv, finish_aggregates, merge_aggregates
+
+FIRST_CHUNK = "timestamp,UTC time,accuracy,x,y,z\n0,a,unknown,3,4,0\n1000,b,unknown,1,1,1\n60000,c,unknown,0,0,2\n"
+SECOND_CHUNK = "timestamp,UTC time,accuracy,x,y,z\n30000,d,unknown,-1,0,0\n"
+
+
+class ChunkAggregationTests(TestCase):
+
+    def aggregate(self, columns=None, end_ms=120000):
+        total = {}
+        for chunk in (FIRST_CHUNK, SECOND_CHUNK):
+            merge_aggregates(total, aggregate_chunk(chunk, "patient", 0, end_ms, 60000, columns))
+        return finish_aggregates(total)
+
+    def test_group_by_window(self):
+        first, second = self.aggregate()
+        self.assertEqual((first["window_start"], first["count"]), (0, 3))
+        self.assertEqual(first["x"], {"count": 3, "min": -1.0, "max": 3.0, "mean": 1.0, "sum": 3.0})
+        self.assertEqual((second["window_start"], second["count"]), (60000, 1))
+        # columns without numbers are left out
+        self.assertNotIn("accuracy", first)
+
+    def test_time_range_and_derived_columns(self):
+        results = self.aggregate(columns=["magnitude"], end_ms=60000)
+        self.assertEqual(len(results), 1)
+        self.assertEqual(results[0]["magnitude"]["max"], 5.0)
+        self.assertEqual(results[0]["magnitude"]["count"], 3)
+
+    def test_csv(self):
+        results = finish_aggregates({("patient", 0): [2, {"x": [2, 3.0, 1.0, 2.0]}]}, reductions=["mean", "sum"])
+        self.assertEqual(aggregates_to_csv(results, ["mean", "sum"]),
+                         "patient_id,window_start,count,x_mean,x_sum\npatient,0,2,1.5,3.0\n")
@@ -0,0 +1,53 @@
+import json
+
+from django.test import TestCase
+
+from api.data_access_api import manifest_generator
+from database.data_access_models import ChunkRegistry
+from database.study_models import Study
+from database.user_models import Participant
+from libs.file_processing import register_chunk_contents
+from libs.security import chunk_hash
+
+
+class ChunkManifestTests(TestCase):
+
+    def setUp(self):
+        self.study = Study.create_with_object_id(
+            name="TEST_STUDY_FOR_MANIFEST", encryption_key='aabbccddefggiijjkklmnoppqqrrsstt'
+        )
+        self.patient_id, _ = Participant.create_with_rnd_password(study=self.study)
+        self.participant = Participant.objects.get(patient_id=self.patient_id)
+
+    def manifest(self):
+        chunks = ChunkRegistry.get_chunks_time_range(self.study.pk).order_by("pk").values_list(
+            "pk", "chunk_path", "data_type", "time_bin", "participant__patient_id", "chunk_hash", "file_size",
+            "file_format"
+        )
+        return [json.loads(line) for line in manifest_generator(chunks)]
+
+    def test_manifest_lines(self):
+        ChunkRegistry.register_chunked_data("gps", 1, "chunk_path", "a,b\n1,2", self.study.pk, self.participant.pk)
+        ChunkRegistry.register_unchunked_data("audio_recordings", 3600, "audio_path", self.study.pk, self.participant.pk)
+        chunk, audio = self.manifest()
+        self.assertEqual(chunk["chunk_path"], "chunk_path")
+        self.assertEqual(chunk["patient_id"], self.patient_id)
+        self.assertEqual(chunk["file_size"], 7)
+        self.assertEqual(chunk["chunk_hash"], ChunkRegistry.objects.get(chunk_path="chunk_path").chunk_hash)
+        self.assertIsNone(audio["file_size"])
+
+    def test_file_size_is_updated(self):
+        ChunkRegistry.register_chunked_data("gps", 1, "chunk_path", "a,b\n1,2", self.study.pk, self.participant.pk)
+        ChunkRegistry.objects.get(chunk_path="chunk_path").update_chunk_hash("a,b\n1,2\n3,4")
+        self.assertEqual(self.manifest()[0]["file_size"], 11)
+
+    def test_appended_chunk_hash(self):
+        # chunks that rows are appended to are updated as they are by data processing
+        ChunkRegistry.register_chunked_data("gps", 1, "chunk_path", "timestamp,b\n1,2", self.study.pk, self.participant.pk)
+        chunk = ChunkRegistry.objects.get(chunk_path="chunk_path")
+        register_chunk_contents(chunk, "timestamp,b\n1,2\n3,4", ChunkRegistry.CSV_FORMAT)
+        self.assertEqual(self.manifest()[0]["chunk_hash"], chunk_hash("timestamp,b\n1,2\n3,4"))
+        contents = "timestamp,b\n1,2\n3,4\n5,6"
+        register_chunk_contents(chunk, contents, ChunkRegistry.CSV_FORMAT)
+        self.assertEqual(self.manifest()[0]["chunk_hash"], chunk_hash(contents))
+        self.assertEqual(self.manifest()[0]["file_size"], len(contents))
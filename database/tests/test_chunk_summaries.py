@@ -0,0 +1,63 @@
+import json
+
+from django.test import TestCase
+
+from api.data_access_api import summaries_generator
+from database.data_access_models import ChunkRegistry, ChunkSummary
+from database.study_models import Study
+from database.user_models import Participant
+from libs.chunk_summaries import haversine_distance, summarize_chunk
+
+ACCELEROMETER_CHUNK = "timestamp,UTC time,accuracy,x,y,z\n0,a,unknown,3,4,0\n1000,b,unknown,0,0,1\n60000,c,unknown,0,,0"
+GPS_CHUNK = "timestamp,UTC time,latitude,longitude,altitude,accuracy\n0,a,0,0,0,1\n1000,b,0,1,0,1"
+
+
+class ChunkSummaryTests(TestCase):
+
+    def test_accelerometer_summary(self):
+        row_count, coverage, values = summarize_chunk("accelerometer", ACCELEROMETER_CHUNK)
+        self.assertEqual(row_count, 3)
+        self.assertAlmostEqual(coverage, 2 / 60.0)
+        # the row with a missing y is left out
+        self.assertEqual(values, {"magnitude_mean": 3.0, "magnitude_variance": 4.0})
+
+    def test_gps_summary(self):
+        _, _, values = summarize_chunk("gps", GPS_CHUNK)
+        one_degree = haversine_distance((0, 0), (0, 1))
+        self.assertAlmostEqual(one_degree, 111195, places=-1)
+        self.assertAlmostEqual(values["distance_m"], one_degree)
+        self.assertAlmostEqual(values["radius_of_gyration_m"], one_degree / 2, places=3)
+
+    def test_data_streams_without_values(self):
+        self.assertEqual(summarize_chunk("calls", "timestamp,UTC time,type\n0,a,Outgoing Call"), (1, 1 / 60.0, {}))
+        self.assertEqual(summarize_chunk("calls", ""), (0, 0.0, {}))
+
+
+class ChunkSummaryStoreTests(TestCase):
+
+    def setUp(self):
+        self.study = Study.create_with_object_id(
+            name="TEST_STUDY_FOR_SUMMARIES", encryption_key='aabbccddefggiijjkklmnoppqqrrsstt'
+        )
+        self.patient_id, _ = Participant.create_with_rnd_password(study=self.study)
+        participant = Participant.objects.get(patient_id=self.patient_id)
+        self.chunk = ChunkRegistry.register_chunked_data(
+            "gps", 1, "chunk_path", GPS_CHUNK, self.study.pk, participant.pk
+        )
+
+    def test_summary_is_replaced(self):
+        ChunkSummary.save_chunk_summary(self.chunk, "timestamp,latitude,longitude\n0,0,0")
+        ChunkSummary.save_chunk_summary(self.chunk, GPS_CHUNK)
+        self.assertEqual(ChunkSummary.objects.get().row_count, 2)
+
+    def test_summaries_generator(self):
+        ChunkSummary.save_chunk_summary(self.chunk, GPS_CHUNK)
+        summaries = ChunkRegistry.objects.values_list(
+            "participant__patient_id", "data_type", "time_bin", "summary__row_count", "summary__coverage",
+            "summary__stream_values"
+        )
+        summary, = [json.loads(line) for line in summaries_generator(summaries)]
+        self.assertEqual(summary["patient_id"], self.patient_id)
+        self.assertEqual(summary["time_bin"], "1970-01-01T01:00:00")
+        self.assertEqual(summary["row_count"], 2)
+        self.assertIn("distance_m", summary)
@@ -0,0 +1,66 @@
+from hashlib import pbkdf2_hmac
+from StringIO import StringIO
+
+from django.test import TestCase
+from flask import Flask, json
+
+from api import data_access_api
+from config.constants import ITERATIONS
+from database.data_access_models import PipelineUpload
+from database.study_models import Study
+from database.user_models import Researcher
+from libs.data_access_tokens import create_access_token, get_token_study_access
+from libs.security import encode_base64
+
+
+class DataAccessApiTests(TestCase):
+    """ Data access API requests posted through the flask test client, without storing files on S3. """
+
+    def setUp(self):
+        self.study = Study.create_with_object_id(
+            name="TEST_STUDY_FOR_PIPELINE_UPLOADS", encryption_key='aabbccddefggiijjkklmnoppqqrrsstt'
+        )
+        self.researcher = Researcher.create_with_password("pipeline_researcher", "password")
+        self.researcher.studies.add(self.study)
+        # The secret is hashed from unicode values as they are compared (the pure python
+        # pbkdf2_hmac of python builds without openssl hashes unicode differently).
+        self.researcher.access_key_id = "testaccesskey"
+        self.researcher.access_key_secret_salt = u"test_salt"
+        self.researcher.access_key_secret = encode_base64(
+            pbkdf2_hmac("sha1", u"test_secret_key", u"test_salt", iterations=ITERATIONS, dklen=32)
+        )
+        self.researcher.save()
+        self.uploaded = []
+        self.original_s3_upload = data_access_api.s3_upload
+        data_access_api.s3_upload = lambda s3_path, data, study_object_id, raw_path: self.uploaded.append(s3_path)
+        app = Flask(__name__)
+        app.register_blueprint(data_access_api.data_access_api)
+        self.client = app.test_client()
+
+    def tearDown(self):
+        data_access_api.s3_upload = self.original_s3_upload
+
+    def pipeline_upload(self, file_name, **credentials):
+        data = dict(credentials, study_id=self.study.object_id, tags='["a_tag"]', file_name=file_name,
+                    file=(StringIO("some,data\n"), file_name))
+        return self.client.post("/pipeline-upload/v1", data=data)
+
+    def test_upload_with_access_key(self):
+        response = self.pipeline_upload("file_1.csv", access_key="testaccesskey", secret_key="test_secret_key")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(PipelineUpload.objects.get().file_name, "file_1.csv")
+        self.assertEqual(len(self.uploaded), 1)
+
+    def test_upload_with_access_token(self):
+        response = self.pipeline_upload("file_1.csv", access_token=create_access_token(self.researcher))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(PipelineUpload.objects.get().file_name, "file_1.csv")
+        self.assertEqual(PipelineUpload.REQUIREDS, ["study_id", "tags", "file_name"])
+
+    def test_get_token_validates_the_credentials(self):
+        response = self.client.post("/get-token/v1", data={"access_key": "testaccesskey", "secret_key": "wrong"})
+        self.assertEqual(response.status_code, 403)
+        response = self.client.post("/get-token/v1", data={"access_key": "testaccesskey", "secret_key": "test_secret_key"})
+        self.assertEqual(response.status_code, 200)
+        study_access = get_token_study_access(json.loads(response.data)["access_token"])
+        self.assertEqual(study_access.study_ids, frozenset([self.study.pk]))
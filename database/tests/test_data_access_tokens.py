@@ -0,0 +1,44 @@
+from django.test import TestCase
+
+from database.study_models import Study
+from database.user_models import Researcher
+from libs import data_access_tokens
+from libs.data_access_tokens import create_access_token, get_token_study_access
+
+
+class DataAccessTokenTests(TestCase):
+
+    def setUp(self):
+        self.study = Study.create_with_object_id(
+            name="TEST_STUDY_FOR_TOKENS", encryption_key='aabbccddefggiijjkklmnoppqqrrsstt'
+        )
+        Study.create_with_object_id(name="OTHER_STUDY_FOR_TOKENS", encryption_key='aabbccddefggiijjkklmnoppqqrrsstt')
+        self.researcher = Researcher.create_with_password("token_researcher", "password")
+        self.researcher.studies.add(self.study)
+        data_access_tokens._study_access_cache.clear()
+
+    def test_token_grants_access_to_researchers_studies(self):
+        study_access = get_token_study_access(create_access_token(self.researcher))
+        self.assertEqual(study_access.researcher_id, self.researcher.pk)
+        self.assertEqual(study_access.study_ids, frozenset([self.study.pk]))
+
+    def test_invalid_tokens(self):
+        token = create_access_token(self.researcher)
+        self.assertIsNone(get_token_study_access(token[:-1]))
+        self.assertIsNone(get_token_study_access("not a token"))
+
+    def test_expired_token(self):
+        token = create_access_token(self.researcher)
+        original_seconds = data_access_tokens.DATA_ACCESS_TOKEN_SECONDS
+        data_access_tokens.DATA_ACCESS_TOKEN_SECONDS = -1
+        try:
+            self.assertIsNone(get_token_study_access(token))
+        finally:
+            data_access_tokens.DATA_ACCESS_TOKEN_SECONDS = original_seconds
+
+    def test_resetting_credentials_invalidates_tokens(self):
+        token = create_access_token(self.researcher)
+        self.researcher.reset_access_credentials()
+        # (after the study access cache expires)
+        data_access_tokens._study_access_cache.clear()
+        self.assertIsNone(get_token_study_access(token))
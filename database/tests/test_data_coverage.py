@@ -0,0 +1,95 @@
+import json
+from datetime import datetime
+
+from django.test import TestCase
+
+from api.data_access_api import coverage_generator
+from database.data_access_models import ChunkRegistry, DataCoverage
+from database.study_models import Study
+from database.user_models import Participant
+from libs.data_coverage import (count_hours, daily_hour_counts, first_set_hour, hour_of, missing_hour_ranges,
+    set_hour)
+
+
+def bitmap_of(hours):
+    bitmap, first_hour = bytearray(), None
+    for hour in hours:
+        bitmap, first_hour, _ = set_hour(bitmap, first_hour, hour)
+    return bitmap, first_hour
+
+
+class CoverageBitmapTests(TestCase):
+
+    def test_set_hour_grows_both_ways(self):
+        bitmap, first_hour = bitmap_of([100, 130, 90])
+        self.assertEqual(first_hour, 88)
+        self.assertEqual(len(bitmap), 6)
+        self.assertEqual(count_hours(bitmap, first_hour, 0, 1000), 3)
+        self.assertFalse(set_hour(bitmap, first_hour, 100)[2])
+
+    def test_count_hours(self):
+        hours = [3, 4, 8, 15, 16, 31, 40]
+        bitmap, first_hour = bitmap_of(hours)
+        for start in range(0, 45, 3):
+            for end in range(start, 45, 5):
+                self.assertEqual(count_hours(bitmap, first_hour, start, end),
+                                 len([hour for hour in hours if start <= hour < end]))
+
+    def test_missing_hour_ranges(self):
+        bitmap, first_hour = bitmap_of([10, 11, 14])
+        self.assertEqual(missing_hour_ranges(bitmap, first_hour, 8, 17), [(8, 10), (12, 14), (15, 17)])
+
+    def test_first_set_hour(self):
+        self.assertEqual(first_set_hour(*bitmap_of([21, 13, 30])), 13)
+        self.assertIsNone(first_set_hour(bytearray(2), 8))
+
+    def test_daily_hour_counts(self):
+        gps = bitmap_of([0, 1, 30])
+        accelerometer = bitmap_of([1, 2])
+        self.assertEqual(daily_hour_counts([gps, accelerometer], 0, 3), [3, 1, 0])
+
+
+class DataCoverageTests(TestCase):
+
+    def setUp(self):
+        self.study = Study.create_with_object_id(
+            name="TEST_STUDY_FOR_COVERAGE", encryption_key='aabbccddefggiijjkklmnoppqqrrsstt'
+        )
+        self.patient_id, _ = Participant.create_with_rnd_password(study=self.study)
+        self.participant = Participant.objects.get(patient_id=self.patient_id)
+
+    def test_chunk_registration_updates_coverage(self):
+        # time bins are in hours since the epoch
+        for time_bin in [10, 12, 12]:
+            ChunkRegistry.register_chunked_data(
+                "gps", time_bin, "chunk_%s" % time_bin, "a,b", self.study.pk, self.participant.pk
+            )
+        ChunkRegistry.register_unchunked_data(
+            "audio_recordings", 11 * 3600, "audio_path", self.study.pk, self.participant.pk
+        )
+        coverage = DataCoverage.objects.get(data_type="gps")
+        self.assertEqual(coverage.count_hours(0, 100), 2)
+        self.assertEqual(coverage.missing_hour_ranges(10, 13), [(11, 12)])
+        self.assertEqual(DataCoverage.objects.get(data_type="audio_recordings").count_hours(11, 12), 1)
+
+    def test_coverage_generator(self):
+        ChunkRegistry.register_chunked_data("gps", 10, "chunk_path", "a,b", self.study.pk, self.participant.pk)
+        coverage, = [
+            json.loads(line) for line in coverage_generator(DataCoverage.objects.all(), 9, hour_of(datetime(1970, 1, 1, 13)))
+        ]
+        self.assertEqual(coverage["patient_id"], self.patient_id)
+        self.assertEqual(coverage["time_start"], "1970-01-01T09:00:00")
+        self.assertEqual((coverage["hours"], coverage["hours_with_data"]), (4, 1))
+        self.assertEqual(coverage["gaps"], [
+            ["1970-01-01T09:00:00", "1970-01-01T10:00:00"], ["1970-01-01T11:00:00", "1970-01-01T13:00:00"]
+        ])
+
+    def test_coverage_generator_default_range(self):
+        # the range starts at the first hour with data, not at the start of the bitmap
+        ChunkRegistry.register_chunked_data("gps", 13, "chunk_path", "a,b", self.study.pk, self.participant.pk)
+        coverage, = [
+            json.loads(line) for line in coverage_generator(DataCoverage.objects.all(), None, hour_of(datetime(1970, 1, 1, 15)))
+        ]
+        self.assertEqual(coverage["time_start"], "1970-01-01T13:00:00")
+        self.assertEqual((coverage["hours"], coverage["hours_with_data"]), (2, 1))
+        self.assertEqual(coverage["gaps"], [["1970-01-01T14:00:00", "1970-01-01T15:00:00"]])
@@ -0,0 +1,68 @@
+from datetime import datetime, timedelta
+
+from django.test import TestCase
+from django.utils import timezone
+
+from database.data_access_models import DataExport
+from database.study_models import Study
+from database.user_models import Researcher
+from libs import data_exports
+from libs.data_exports import (dump_query, fail_stale_data_exports, find_or_create_data_export, load_query,
+    prune_data_exports, start_data_export)
+
+
+class DataExportTests(TestCase):
+
+    def setUp(self):
+        self.study = Study.create_with_object_id(
+            name="TEST_STUDY_FOR_EXPORTS", encryption_key='aabbccddefggiijjkklmnoppqqrrsstt'
+        )
+        self.researcher = Researcher.create_with_password("export_researcher", "password")
+        self.query = {"data_types": ["gps"], "start": datetime(2018, 1, 2, 3, 4, 5)}
+
+    def test_query_round_trip(self):
+        self.assertEqual(load_query(dump_query(self.query)), self.query)
+
+    def test_identical_queries_share_an_export(self):
+        data_export = find_or_create_data_export(self.study, self.researcher, self.query, "zip")
+        self.assertEqual(find_or_create_data_export(self.study, self.researcher, dict(self.query), "zip"), data_export)
+        self.assertNotEqual(find_or_create_data_export(self.study, self.researcher, self.query, "tar.gz"), data_export)
+        self.assertNotEqual(find_or_create_data_export(self.study, self.researcher, {}, "zip"), data_export)
+
+    def test_failed_and_old_exports_are_not_reused(self):
+        data_export = find_or_create_data_export(self.study, self.researcher, self.query, "zip")
+        data_export.update(status=DataExport.FAILED)
+        new_export = find_or_create_data_export(self.study, self.researcher, self.query, "zip")
+        self.assertNotEqual(new_export, data_export)
+        DataExport.objects.filter(pk=new_export.pk).update(created_on=new_export.created_on - timedelta(days=1))
+        self.assertNotEqual(find_or_create_data_export(self.study, self.researcher, self.query, "zip"), new_export)
+
+    def test_export_is_started_once(self):
+        data_export = find_or_create_data_export(self.study, self.researcher, self.query, "zip")
+        self.assertTrue(start_data_export(data_export.pk))
+        self.assertFalse(start_data_export(data_export.pk))
+        self.assertEqual(DataExport.objects.get(pk=data_export.pk).status, DataExport.RUNNING)
+
+    def test_stale_running_export_is_failed(self):
+        data_export = find_or_create_data_export(self.study, self.researcher, self.query, "zip")
+        start_data_export(data_export.pk)
+        self.assertEqual(fail_stale_data_exports(), 0)
+        DataExport.objects.filter(pk=data_export.pk).update(last_updated=timezone.now() - timedelta(days=1))
+        self.assertEqual(fail_stale_data_exports(), 1)
+        self.assertEqual(DataExport.objects.get(pk=data_export.pk).status, DataExport.FAILED)
+        self.assertNotEqual(find_or_create_data_export(self.study, self.researcher, self.query, "zip"), data_export)
+
+    def test_old_exports_are_pruned(self):
+        old_export = find_or_create_data_export(self.study, self.researcher, self.query, "zip")
+        old_export.update(status=DataExport.DONE, s3_path=self.study.object_id + "/exports/1.zip")
+        DataExport.objects.filter(pk=old_export.pk).update(created_on=timezone.now() - timedelta(days=30))
+        new_export = find_or_create_data_export(self.study, self.researcher, self.query, "zip")
+        deleted = []
+        original_s3_delete = data_exports.s3_delete_data_export
+        data_exports.s3_delete_data_export = deleted.append
+        try:
+            prune_data_exports()
+        finally:
+            data_exports.s3_delete_data_export = original_s3_delete
+        self.assertEqual(list(DataExport.objects.all()), [new_export])
+        self.assertEqual(deleted, [self.study.object_id + "/exports/1.zip"])
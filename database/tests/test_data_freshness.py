@@ -0,0 +1,77 @@
+import json
+from datetime import datetime, timedelta
+
+from django.test import TestCase
+from django.utils import timezone
+
+from api.data_access_api import freshness_generator
+from database.data_access_models import ChunkRegistry, DataFreshness
+from database.study_models import Study
+from database.user_models import Participant
+from libs import upload_processing
+from libs.upload_processing import record_upload_freshness, register_decrypted_upload
+from pages.admin_pages import get_last_uploads
+
+
+class DataFreshnessTests(TestCase):
+
+    def setUp(self):
+        self.study = Study.create_with_object_id(
+            name="TEST_STUDY_FOR_FRESHNESS", encryption_key='aabbccddefggiijjkklmnoppqqrrsstt'
+        )
+        self.patient_id, _ = Participant.create_with_rnd_password(study=self.study)
+        self.participant = Participant.objects.get(patient_id=self.patient_id)
+
+    def test_uploads_update_freshness(self):
+        record_upload_freshness(self.participant, self.patient_id + "_accel_1516000000000.csv", "2.4")
+        record_upload_freshness(self.participant, self.patient_id + "_accel_1516000001000.csv")
+        record_upload_freshness(self.participant, "not_a_data_stream.csv", "2.4")
+        freshness = DataFreshness.objects.get()
+        self.assertEqual((freshness.study_id, freshness.data_type), (self.study.pk, "accelerometer"))
+        self.assertEqual(freshness.last_app_version, "2.4")
+        self.assertIsNotNone(freshness.last_upload)
+        self.assertIsNone(freshness.last_time_bin)
+
+    def test_chunk_registration_keeps_latest_time_bin(self):
+        # time bins are in hours since the epoch
+        for time_bin in [12, 10]:
+            ChunkRegistry.register_chunked_data(
+                "gps", time_bin, "chunk_%s" % time_bin, "a,b", self.study.pk, self.participant.pk
+            )
+        freshness = DataFreshness.objects.get()
+        self.assertEqual(freshness.last_time_bin, timezone.make_aware(datetime(1970, 1, 1, 12), timezone.utc))
+        self.assertIsNone(freshness.last_upload)
+
+    def test_freshness_generator(self):
+        ChunkRegistry.register_chunked_data("gps", 10, "chunk_path", "a,b", self.study.pk, self.participant.pk)
+        record_upload_freshness(self.participant, self.patient_id + "_gps_1516000000000.csv", "2.4")
+        freshness = DataFreshness.objects.values_list(
+            "participant__patient_id", "data_type", "last_upload", "last_time_bin", "last_app_version"
+        )
+        line, = [json.loads(line) for line in freshness_generator(freshness)]
+        self.assertEqual((line["patient_id"], line["data_type"]), (self.patient_id, "gps"))
+        self.assertEqual(line["last_time_bin"], "1970-01-01T10:00:00")
+        self.assertEqual(line["last_app_version"], "2.4")
+        self.assertIsNotNone(line["last_upload"])
+
+    def test_last_uploads(self):
+        ChunkRegistry.register_chunked_data("gps", 10, "chunk_path", "a,b", self.study.pk, self.participant.pk)
+        record_upload_freshness(self.participant, self.patient_id + "_accel_1516000000000.csv")
+        (data_type, last_upload), = get_last_uploads(self.study)[self.participant.pk]
+        self.assertEqual(data_type, "accelerometer")
+        self.assertEqual(last_upload, DataFreshness.objects.get(data_type="accelerometer").last_upload)
+
+    def test_registered_upload_updates_freshness(self):
+        original_s3_upload = upload_processing.s3_upload
+        upload_processing.s3_upload = lambda *args: None
+        try:
+            uploaded_on = timezone.now() - timedelta(hours=1)
+            file_name = self.patient_id + "_gps_1516000000000.csv"
+            register_decrypted_upload(self.participant, file_name, "a,b\n", "2.4", uploaded_on)
+            # a deferred upload registered out of order doesn't move the last upload back
+            register_decrypted_upload(self.participant, file_name, "a,b\n", None, uploaded_on - timedelta(hours=1))
+        finally:
+            upload_processing.s3_upload = original_s3_upload
+        freshness = DataFreshness.objects.get()
+        self.assertEqual((freshness.data_type, freshness.last_app_version), ("gps", "2.4"))
+        self.assertEqual(freshness.last_upload, uploaded_on)
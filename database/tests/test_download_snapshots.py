@@ -0,0 +1,59 @@
+from django.test import TestCase
+from django.utils import timezone
+
+from api.data_access_api import CHUNK_FIELDS, determine_file_name, handle_database_query
+from database.data_access_models import ChunkRegistry
+from database.study_models import Study
+from database.user_models import Participant
+from libs.download_snapshots import (create_download_snapshot, decode_download_snapshot,
+    encode_download_snapshot, snapshot_chunks)
+
+
+class DownloadSnapshotTests(TestCase):
+
+    def setUp(self):
+        self.study = Study.create_with_object_id(
+            name="TEST_STUDY_FOR_SNAPSHOTS", encryption_key='aabbccddefggiijjkklmnoppqqrrsstt'
+        )
+        patient_id, _ = Participant.create_with_rnd_password(study=self.study)
+        self.participant = Participant.objects.get(patient_id=patient_id)
+        self.query = {"data_types": ["accelerometer"], "user_ids": [patient_id]}
+        self.all_chunks = ChunkRegistry.objects.values(*CHUNK_FIELDS)
+
+    def register_chunk(self, time_bin):
+        return ChunkRegistry.register_chunked_data(
+            "accelerometer", time_bin, "chunk_%s" % time_bin, "a,b\n1,2", self.study.pk, self.participant.pk
+        )
+
+    def snapshot(self, chunks):
+        return create_download_snapshot(self.study.pk, chunks, determine_file_name)
+
+    def chunk_paths(self, snapshot, start=0):
+        return [chunk["chunk_path"] for chunk in snapshot_chunks(self.all_chunks, snapshot.get_chunk_ids()[start:])]
+
+    def test_snapshot_token(self):
+        snapshot = create_download_snapshot(self.study.pk, self.all_chunks, determine_file_name, "cursor")
+        token = encode_download_snapshot(snapshot, self.query)
+        self.assertEqual(decode_download_snapshot(token, self.query, self.study.pk), snapshot)
+        self.assertEqual(decode_download_snapshot(token, self.query, self.study.pk).sync_cursor, "cursor")
+        self.assertIsNone(decode_download_snapshot(token, dict(self.query, data_types=["gps"]), self.study.pk))
+        self.assertIsNone(decode_download_snapshot(token[:-1], self.query, self.study.pk))
+        self.assertIsNone(decode_download_snapshot(token, self.query, self.study.pk + 1))
+
+    def test_snapshot_excludes_later_chunks(self):
+        for time_bin in (3, 1, 2):
+            self.register_chunk(time_bin)
+        snapshot = self.snapshot(handle_database_query(self.study.pk, self.query))
+        self.register_chunk(4)
+        self.assertEqual(self.chunk_paths(snapshot), ["chunk_3", "chunk_1", "chunk_2"])
+
+    def test_resume_after_chunks_change(self):
+        # a sync download, of the chunks changed up to now
+        chunks = [self.register_chunk(time_bin) for time_bin in (1, 2, 3, 4)]
+        snapshot = self.snapshot(handle_database_query(self.study.pk, self.query, changed_until=timezone.now()))
+        # the client received 2 files, then the first one is rewritten (it is no longer in the
+        # sync window) and the third is deleted before the download is resumed.
+        chunks[0].update_chunk_hash("a,b\n1,3")
+        chunks[2].delete()
+        self.assertEqual(self.chunk_paths(snapshot, start=2), ["chunk_4"])
+        self.assertEqual(self.chunk_paths(snapshot, start=1), ["chunk_2", "chunk_4"])
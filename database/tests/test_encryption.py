@@ -0,0 +1,109 @@
+import sys
+from os import urandom
+from StringIO import StringIO
+from traceback import extract_tb
+
+from Crypto.Cipher import AES
+from Crypto.PublicKey import RSA
+from django.test import TestCase
+
+from database.study_models import Study
+from database.user_models import Participant
+from libs import encryption
+from libs.encryption import decrypt_device_file, HandledError
+from libs.security import encode_base64
+
+
+class DeviceFileDecryptionTests(TestCase):
+
+    def setUp(self):
+        self.study = Study.create_with_object_id(
+            name="TEST_STUDY_FOR_DECRYPTION", encryption_key='aabbccddefggiijjkklmnoppqqrrsstt'
+        )
+        patient_id, _ = Participant.create_with_rnd_password(study=self.study)
+        self.participant = Participant.objects.get(patient_id=patient_id)
+        self.private_key = RSA.generate(1024)
+        self.aes_key = urandom(16)
+
+    def encrypt_device_line(self, line):
+        """ Mimics the encryption done on the device: AES CBC with PKCS5 padding. """
+        iv = urandom(16)
+        padding_length = 16 - len(line) % 16
+        padded = line + chr(padding_length) * padding_length
+        encrypted = AES.new(self.aes_key, mode=AES.MODE_CBC, IV=iv).encrypt(padded)
+        return encode_base64(iv) + ":" + encode_base64(encrypted)
+
+    def encrypt_device_file(self, lines):
+        key_line = encode_base64(
+            self.private_key.publickey().encrypt(encode_base64(self.aes_key), "")[0]
+        )
+        return "\n".join([key_line] + [self.encrypt_device_line(line) for line in lines])
+
+    def decrypt(self, file_contents):
+        return decrypt_device_file(self.participant.patient_id, file_contents, self.private_key,
+                                   self.participant, "some_file_name.csv")
+
+    def test_decrypts_lines_in_order(self):
+        lines = ["%s,1,2,3" % i for i in xrange(50)]
+        self.assertEqual(self.decrypt(self.encrypt_device_file(lines)), "\n".join(lines) + "\n")
+
+    def test_decrypts_lines_in_order_on_thread_pool(self):
+        original_batch_size = encryption.DECRYPTION_BATCH_SIZE
+        original_threshold = encryption.DECRYPTION_POOL_LINE_THRESHOLD
+        encryption.DECRYPTION_BATCH_SIZE = 7
+        encryption.DECRYPTION_POOL_LINE_THRESHOLD = 10
+        try:
+            lines = ["%s,1,2,3" % i for i in xrange(100)]
+            self.assertEqual(self.decrypt(self.encrypt_device_file(lines)), "\n".join(lines) + "\n")
+        finally:
+            encryption.DECRYPTION_BATCH_SIZE = original_batch_size
+            encryption.DECRYPTION_POOL_LINE_THRESHOLD = original_threshold
+
+    def test_decrypts_file_object(self):
+        lines = ["%s,1,2,3" % i for i in xrange(50)]
+        self.assertEqual(self.decrypt(StringIO(self.encrypt_device_file(lines))), "\n".join(lines) + "\n")
+
+    def test_drops_malformed_lines(self):
+        file_contents = self.encrypt_device_file(["a,b", "c,d"]) + "\nnot_a_valid_line"
+        self.assertEqual(self.decrypt(file_contents), "a,b\nc,d\n")
+
+    def test_unknown_line_error_keeps_its_traceback(self):
+        original_decrypt_device_line = encryption.decrypt_device_line
+        def decrypt_device_line(patient_id, key, data):
+            raise ValueError("unexpected")
+        encryption.decrypt_device_line = decrypt_device_line
+        try:
+            self.decrypt(self.encrypt_device_file(["a,b"]))
+        except ValueError:
+            # the innermost frame is where the error was raised, not where it was re-raised.
+            self.assertEqual(extract_tb(sys.exc_info()[2])[-1][2], "decrypt_device_line")
+        else:
+            self.fail("the error was not raised")
+        finally:
+            encryption.decrypt_device_line = original_decrypt_device_line
+
+    def test_empty_file_is_handled(self):
+        with self.assertRaises(HandledError):
+            self.decrypt("")
+
+
+class ServerEncryptionTests(TestCase):
+
+    def setUp(self):
+        self.study = Study.create_with_object_id(
+            name="TEST_STUDY_FOR_SERVER_ENCRYPTION", encryption_key='aabbccddefggiijjkklmnoppqqrrsstt'
+        )
+
+    def test_encrypt_in_pieces_and_decrypt_a_range(self):
+        data = urandom(1000)
+        iv, cipher = encryption.server_encryptor(self.study.object_id)
+        encrypted = iv + "".join(cipher.encrypt(data[i:i + 300]) for i in xrange(0, len(data), 300))
+        self.assertEqual(encryption.decrypt_server(encrypted, self.study.object_id), data)
+        # a range of the file is decrypted with the 16 encrypted bytes before it.
+        self.assertEqual(encryption.decrypt_server(encrypted[123:16 + 456], self.study.object_id), data[123:456])
+
+    def test_study_key_is_looked_up_once(self):
+        encryption.get_study_encryption_key(self.study.object_id)
+        with self.assertNumQueries(0):
+            encrypted = encryption.encrypt_for_server("some,data", self.study.object_id)
+            self.assertEqual(encryption.decrypt_server(encrypted, self.study.object_id), "some,data")
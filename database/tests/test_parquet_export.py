@@ -0,0 +1,73 @@
+from io import BytesIO
+from unittest import skipIf
+
+from django.test import TestCase
+
+from libs import parquet_export
+from libs.parquet_export import (FLOAT64, INT64, STRING, ParquetStreamBuilder, chunk_fits, column_type,
+    parquet_available, parse_chunk, part_file_name)
+
+CHUNK = "timestamp,UTC time,latitude,accuracy\n1000,a,1.5,high\n2000,b,,low\n"
+
+
+class ParquetExportTests(TestCase):
+
+    def test_parse_chunk_drops_utc_time(self):
+        names, columns = parse_chunk(CHUNK)
+        self.assertEqual(names, ["timestamp", "latitude", "accuracy"])
+        self.assertEqual(columns, [["1000", "2000"], ["1.5", ""], ["high", "low"]])
+
+    def test_column_types(self):
+        names, columns = parse_chunk(CHUNK)
+        self.assertEqual([column_type(name, values) for name, values in zip(names, columns)],
+                         [INT64, FLOAT64, STRING])
+
+    def test_chunk_fits(self):
+        names, types = ["timestamp", "latitude", "accuracy"], [INT64, FLOAT64, STRING]
+        self.assertTrue(chunk_fits(names, types, *parse_chunk(CHUNK)))
+        self.assertTrue(chunk_fits(names, types, *parse_chunk("timestamp,latitude\n3600000,2.5\n")))
+        # a number column with a string, or a new column
+        self.assertFalse(chunk_fits(names, types, *parse_chunk("timestamp,latitude\n3600000,north\n")))
+        self.assertFalse(chunk_fits(names, types, *parse_chunk("timestamp,altitude\n3600000,2.5\n")))
+
+    def test_part_file_names(self):
+        self.assertEqual(part_file_name("abc/gps.parquet", 1), "abc/gps.parquet")
+        self.assertEqual(part_file_name("abc/gps.parquet", 2), "abc/gps.part2.parquet")
+
+    @skipIf(not parquet_available(), "pyarrow is not installed")
+    def test_row_group_per_chunk(self):
+        import pyarrow.parquet
+        builder = ParquetStreamBuilder("abc/gps.parquet")
+        self.assertIsNone(builder.add_chunk(CHUNK))
+        self.assertIsNone(builder.add_chunk("timestamp,UTC time,latitude\n3600000,c,2.5\n"))
+        file_name, parquet_file = builder.finish()
+        self.assertEqual(file_name, "abc/gps.parquet")
+        parquet_file = pyarrow.parquet.ParquetFile(BytesIO(parquet_file))
+        self.assertEqual(parquet_file.num_row_groups, 2)
+        self.assertEqual(parquet_file.read().column("accuracy").to_pylist(), ["high", "low", ""])
+
+    @skipIf(not parquet_available(), "pyarrow is not installed")
+    def test_chunk_that_does_not_fit_starts_a_new_file(self):
+        import pyarrow.parquet
+        builder = ParquetStreamBuilder("abc/gps.parquet")
+        builder.add_chunk(CHUNK)
+        file_name, _ = builder.add_chunk("timestamp,UTC time,latitude,accuracy\n3600000,c,north,5\n")
+        self.assertEqual(file_name, "abc/gps.parquet")
+        file_name, parquet_file = builder.finish()
+        self.assertEqual(file_name, "abc/gps.part2.parquet")
+        table = pyarrow.parquet.read_table(BytesIO(parquet_file))
+        self.assertEqual(table.column("latitude").to_pylist(), ["north"])
+        # (accuracy was a string column, it stays one)
+        self.assertEqual(table.schema.field("accuracy").type, pyarrow.string())
+
+    @skipIf(not parquet_available(), "pyarrow is not installed")
+    def test_large_file_is_split(self):
+        original_max_bytes = parquet_export.PARQUET_FILE_MAX_BYTES
+        parquet_export.PARQUET_FILE_MAX_BYTES = 1
+        try:
+            builder = ParquetStreamBuilder("abc/gps.parquet")
+            self.assertIsNone(builder.add_chunk(CHUNK))
+            self.assertEqual(builder.add_chunk(CHUNK)[0], "abc/gps.parquet")
+            self.assertEqual(builder.finish()[0], "abc/gps.part2.parquet")
+        finally:
+            parquet_export.PARQUET_FILE_MAX_BYTES = original_max_bytes
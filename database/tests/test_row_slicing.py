@@ -0,0 +1,64 @@
+from django.test import TestCase
+
+from api import data_access_api
+from database.data_access_models import ChunkRegistry
+from database.study_models import Study
+from database.user_models import Participant
+from libs.row_slicing import parse_millisecond_time, slice_chunk
+
+CHUNK = "timestamp,UTC time,latitude,longitude\n1000,a,1,2\n2000,b,3,4\n3000,c,5,6\n"
+
+
+class RowSlicingTests(TestCase):
+
+    def test_parse_millisecond_time(self):
+        self.assertEqual(parse_millisecond_time("1970-01-01T00:00:01"), 1000)
+        self.assertEqual(parse_millisecond_time("1970-01-01T00:00:01.250"), 1250)
+        self.assertRaises(ValueError, parse_millisecond_time, "yesterday")
+
+    def test_slice_rows(self):
+        header, lines = slice_chunk(CHUNK, 2000, 3000)
+        self.assertEqual(header, ["timestamp", "UTC time", "latitude", "longitude"])
+        self.assertEqual(lines, ["2000,b,3,4"])
+
+    def test_project_columns(self):
+        _, lines = slice_chunk(CHUNK, 0, 5000, columns=["longitude", "timestamp", "altitude"])
+        self.assertEqual(lines, ["2,1000,", "4,2000,", "6,3000,"])
+
+
+class RowsGeneratorTests(TestCase):
+
+    def setUp(self):
+        self.study = Study.create_with_object_id(
+            name="TEST_STUDY_FOR_ROWS", encryption_key='aabbccddefggiijjkklmnoppqqrrsstt'
+        )
+        self.patient_id, _ = Participant.create_with_rnd_password(study=self.study)
+        participant = Participant.objects.get(patient_id=self.patient_id)
+        self.chunks = {
+            "first": CHUNK,
+            "second": "timestamp,UTC time,longitude\n4000,d,8\n",
+        }
+        for time_bin, chunk_path in enumerate(["first", "second"]):
+            ChunkRegistry.register_chunked_data(
+                "gps", time_bin, chunk_path, self.chunks[chunk_path], self.study.pk, participant.pk
+            )
+        self.original_s3_retrieve = data_access_api.s3_retrieve
+        data_access_api.s3_retrieve = lambda chunk_path, *args, **kwargs: self.chunks[chunk_path]
+
+    def tearDown(self):
+        data_access_api.s3_retrieve = self.original_s3_retrieve
+
+    def rows(self, columns):
+        chunks = ChunkRegistry.objects.order_by("time_bin").values_list("chunk_path", "participant__patient_id")
+        return "".join(data_access_api.rows_generator(chunks, self.study.object_id, 2000, 5000, columns))
+
+    def test_rows_are_merged_across_chunks(self):
+        self.assertEqual(self.rows(None), (
+            "patient_id,timestamp,UTC time,latitude,longitude\n"
+            "{0},2000,b,3,4\n{0},3000,c,5,6\n{0},4000,d,,8\n"
+        ).format(self.patient_id))
+
+    def test_requested_columns(self):
+        self.assertEqual(self.rows(["timestamp", "longitude"]), (
+            "patient_id,timestamp,longitude\n{0},2000,4\n{0},3000,6\n{0},4000,8\n"
+        ).format(self.patient_id))
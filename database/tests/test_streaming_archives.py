@@ -0,0 +1,38 @@
+import tarfile
+from io import BytesIO
+from zipfile import ZIP_DEFLATED, ZipFile
+
+from django.test import TestCase
+
+from libs.streaming_archives import (DEFLATED_ZIP_ARCHIVE, TAR_GZ_ARCHIVE, ZIP_ARCHIVE,
+    create_streaming_archive)
+
+FILES = [("a/first.csv", "timestamp,value\n" + "1,2\n" * 1000), ("b/second.csv", ""), ("third", "x" * 513)]
+
+
+class StreamingArchiveTests(TestCase):
+
+    def build_archive(self, archive_format):
+        archive = create_streaming_archive(archive_format)
+        data = []
+        for file_name, contents in FILES:
+            archive.add_encoded_file(archive.encode_file(file_name, contents))
+            data.append(archive.read())
+        data.append(archive.close())
+        return "".join(data)
+
+    def test_zip(self):
+        zip_file = ZipFile(BytesIO(self.build_archive(ZIP_ARCHIVE)))
+        self.assertEqual([(name, zip_file.read(name)) for name in zip_file.namelist()], FILES)
+        self.assertIsNone(zip_file.testzip())
+
+    def test_deflated_zip(self):
+        data = self.build_archive(DEFLATED_ZIP_ARCHIVE)
+        zip_file = ZipFile(BytesIO(data))
+        self.assertEqual([(name, zip_file.read(name)) for name in zip_file.namelist()], FILES)
+        self.assertEqual(zip_file.getinfo("a/first.csv").compress_type, ZIP_DEFLATED)
+        self.assertLess(len(data), len(FILES[0][1]))
+
+    def test_tar_gz(self):
+        tar = tarfile.open(fileobj=BytesIO(self.build_archive(TAR_GZ_ARCHIVE)), mode="r:gz")
+        self.assertEqual([(member.name, tar.extractfile(member).read()) for member in tar], FILES)
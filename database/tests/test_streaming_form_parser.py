@@ -0,0 +1,46 @@
+from io import BytesIO
+from urllib import urlencode
+
+from django.test import SimpleTestCase
+from werkzeug.exceptions import RequestEntityTooLarge
+
+from libs import streaming_form_parser
+from libs.streaming_form_parser import StreamingFormDataParser
+
+URLENCODED = "application/x-www-form-urlencoded"
+
+
+class StreamingFormDataParserTests(SimpleTestCase):
+
+    def setUp(self):
+        self.original_settings = (streaming_form_parser.READ_SIZE, streaming_form_parser.UPLOAD_MAX_SIZE)
+
+    def tearDown(self):
+        streaming_form_parser.READ_SIZE, streaming_form_parser.UPLOAD_MAX_SIZE = self.original_settings
+
+    def parse(self, body, content_length=None):
+        _, form, files = StreamingFormDataParser().parse(BytesIO(body), URLENCODED, content_length)
+        return form, files
+
+    def test_file_field_is_streamed(self):
+        file_contents = "a+b/c==\nd e%f&g=h\n" * 50
+        body = urlencode([("patient_id", "abc"), ("file", file_contents), ("file_name", "x/y.csv")])
+        # every possible split of a percent escape across reads
+        for read_size in (1, 2, 3, 7, 64):
+            streaming_form_parser.READ_SIZE = read_size
+            form, files = self.parse(body)
+            self.assertEqual(form.to_dict(), {"patient_id": u"abc", "file_name": u"x/y.csv"})
+            self.assertEqual(files["file"].stream.read(), file_contents)
+
+    def test_fields_without_values(self):
+        form, files = self.parse("a&b=&c=1&")
+        self.assertEqual(form.to_dict(), {"a": u"", "b": u"", "c": u"1"})
+
+    def test_large_bodies_are_rejected(self):
+        streaming_form_parser.UPLOAD_MAX_SIZE = 10
+        body = urlencode([("file", "x" * 20)])
+        with self.assertRaises(RequestEntityTooLarge):
+            self.parse(body, content_length=len(body))
+        # bodies without a content length are counted as they are read
+        with self.assertRaises(RequestEntityTooLarge):
+            self.parse(body)
@@ -0,0 +1,53 @@
+import json
+from datetime import timedelta
+
+from django.test import TestCase
+from django.utils import timezone
+
+from database.study_models import Study, Survey
+from libs.metrics import get_counter, reset_counters
+from libs.study_payload_cache import get_device_settings_payload, get_surveys_payload
+
+
+class StudyPayloadCacheTests(TestCase):
+
+    def setUp(self):
+        self.study = Study.create_with_object_id(
+            name="TEST_STUDY_FOR_PAYLOADS", encryption_key='aabbccddefggiijjkklmnoppqqrrsstt'
+        )
+        self.survey = Survey.create_with_settings(Survey.TRACKING_SURVEY, study=self.study)
+        reset_counters()
+
+    def test_surveys_payload_is_cached(self):
+        payload, etag = get_surveys_payload(self.study, "ANDROID")
+        self.assertEqual(len(json.loads(payload)), 1)
+        self.assertEqual(get_surveys_payload(self.study, "ANDROID"), (payload, etag))
+        self.assertEqual(get_counter("study_payload_cache.hit"), 1)
+
+    def test_image_surveys_are_not_sent_to_android(self):
+        Survey.create_with_settings(Survey.IMAGE_SURVEY, study=self.study)
+        self.assertEqual(len(json.loads(get_surveys_payload(self.study, "ANDROID")[0])), 1)
+        self.assertEqual(len(json.loads(get_surveys_payload(self.study, "IOS")[0])), 2)
+
+    def test_survey_save_changes_payload(self):
+        _, etag = get_surveys_payload(self.study, "ANDROID")
+        self.survey.update(content=json.dumps([{"question_text": "hello"}]))
+        _, new_etag = get_surveys_payload(self.study, "ANDROID")
+        self.assertNotEqual(etag, new_etag)
+
+    def test_edits_from_other_processes_change_payload(self):
+        # a queryset update does not send signals, like a save in another process.
+        _, etag = get_surveys_payload(self.study, "ANDROID")
+        Survey.objects.filter(pk=self.survey.pk).update(
+            content=json.dumps([{"question_text": "hello"}]), last_updated=timezone.now() + timedelta(seconds=1)
+        )
+        _, new_etag = get_surveys_payload(self.study, "ANDROID")
+        self.assertNotEqual(etag, new_etag)
+
+    def test_device_settings_payload(self):
+        device_settings = get_device_settings_payload(self.study)
+        self.assertNotIn("_id", device_settings)
+        device_settings["gps"] = "modified by the caller"
+        self.assertNotEqual(get_device_settings_payload(self.study)["gps"], "modified by the caller")
+        self.study.device_settings.update(gps=not self.study.device_settings.gps)
+        self.assertNotEqual(get_device_settings_payload(self.study)["gps"], device_settings["gps"])
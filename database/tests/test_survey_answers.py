@@ -0,0 +1,100 @@
+import json
+from datetime import datetime
+
+from django.test import TestCase
+from django.utils import timezone
+
+from api.data_access_api import survey_answers_generator
+from config.constants import SURVEY_ANSWERS
+from database.data_access_models import ChunkRegistry, SurveyAnswer
+from database.study_models import Study, Survey
+from database.user_models import Participant
+from libs import file_processing
+from libs.file_processing import register_unchunkable_file
+from libs.graph_data import get_survey_results
+from libs.survey_answers import index_survey_answers
+
+HEADER = "question id,question type,question text,question answer options,answer\n"
+
+
+def answers_file(*answers):
+    return HEADER + "\n".join("q%s,slider,Question %s,,%s" % (i, i, answer) for i, answer in enumerate(answers))
+
+
+def answer_time(hour):
+    return timezone.make_aware(datetime(2018, 1, 1, hour), timezone.utc)
+
+
+class SurveyAnswerIndexTests(TestCase):
+
+    def setUp(self):
+        self.study = Study.create_with_object_id(
+            name="TEST_STUDY_FOR_SURVEY_ANSWERS", encryption_key='aabbccddefggiijjkklmnoppqqrrsstt'
+        )
+        self.survey = Survey.create_with_settings(Survey.TRACKING_SURVEY, study=self.study)
+        self.patient_id, _ = Participant.create_with_rnd_password(study=self.study)
+        self.participant = Participant.objects.get(patient_id=self.patient_id)
+
+    def index(self, hour, *answers):
+        return index_survey_answers(self.participant.pk, self.survey.pk, answer_time(hour), answers_file(*answers))
+
+    def test_index_answers(self):
+        self.assertEqual(self.index(1, "3", "not sure"), 2)
+        numeric, text = SurveyAnswer.objects.order_by("question_id")
+        self.assertEqual((numeric.question_id, numeric.question_text, numeric.answer), ("q0", "Question 0", "3"))
+        self.assertEqual(numeric.numeric_answer, 3.0)
+        self.assertIsNone(text.numeric_answer)
+
+    def test_reindexing_replaces_answers(self):
+        self.index(1, "3")
+        self.index(1, "4")
+        self.assertEqual(SurveyAnswer.objects.get().answer, "4")
+        # unanswered questions are indexed, files without answers are not
+        self.assertEqual(self.index(2, ""), 1)
+        self.assertEqual(self.index(3), 0)
+
+    def test_survey_results(self):
+        for hour in range(1, 10):
+            self.index(hour, str(hour), "x")
+        results = get_survey_results(self.participant.pk, self.survey.pk, number_points=3)
+        self.assertEqual(results, [
+            ['"Question 0"', ["7", "8", "9"]],
+            ['"Question 1"', ["null", "null", "null"]],
+        ])
+        self.assertEqual(get_survey_results(self.participant.pk, self.survey.pk + 1), [])
+
+    def test_survey_answers_generator(self):
+        self.index(1, "3")
+        answers = SurveyAnswer.objects.values_list(
+            "participant__patient_id", "survey__object_id", "question_id", "question_text", "answered_at", "answer",
+            "numeric_answer"
+        )
+        answer, = [json.loads(line) for line in survey_answers_generator(answers)]
+        self.assertEqual(answer["patient_id"], self.patient_id)
+        self.assertEqual(answer["survey_id"], self.survey.object_id)
+        self.assertEqual(answer["answered_at"], "2018-01-01T01:00:00")
+        self.assertEqual(answer["numeric_answer"], 3.0)
+
+    def test_failed_indexing_does_not_register_the_file(self):
+        s3_file_path = "%s/%s/surveyAnswers/%s/1514768400000.csv" % (
+            self.study.object_id, self.patient_id, self.survey.object_id
+        )
+        data = {
+            "data_type": SURVEY_ANSWERS,
+            "file_contents": answers_file("3"),
+            "ftp": {"s3_file_path": s3_file_path, "study": self.study, "participant": self.participant},
+        }
+        original_index_survey_answers = file_processing.index_survey_answers
+        def index_survey_answers(*args):
+            raise Exception("indexing failed")
+        file_processing.index_survey_answers = index_survey_answers
+        try:
+            with self.assertRaises(Exception):
+                register_unchunkable_file(data)
+        finally:
+            file_processing.index_survey_answers = original_index_survey_answers
+        self.assertEqual(ChunkRegistry.objects.count(), 0)
+        # the retry registers the file once
+        register_unchunkable_file(data)
+        self.assertEqual(ChunkRegistry.objects.count(), 1)
+        self.assertEqual(SurveyAnswer.objects.get().answer, "3")
@@ -0,0 +1,55 @@
+from datetime import timedelta
+
+from django.test import TestCase
+from django.utils import timezone
+from werkzeug.exceptions import BadRequest
+
+from api.data_access_api import (decode_sync_cursor, determine_sync_window, encode_sync_cursor,
+    handle_database_query)
+from database.data_access_models import ChunkRegistry
+from database.study_models import Study
+from database.user_models import Participant
+
+
+class SyncCursorTests(TestCase):
+
+    def setUp(self):
+        self.study = Study.create_with_object_id(
+            name="TEST_STUDY_FOR_SYNC", encryption_key='aabbccddefggiijjkklmnoppqqrrsstt'
+        )
+        patient_id, _ = Participant.create_with_rnd_password(study=self.study)
+        self.participant = Participant.objects.get(patient_id=patient_id)
+
+    def register_chunk(self, chunk_path, last_updated):
+        ChunkRegistry.register_chunked_data(
+            "accelerometer", 1, chunk_path, "a,b\n1,2", self.study.pk, self.participant.pk
+        )
+        ChunkRegistry.objects.filter(chunk_path=chunk_path).update(last_updated=last_updated)
+
+    def test_cursor_round_trip(self):
+        now = timezone.now()
+        self.assertEqual(decode_sync_cursor(encode_sync_cursor(now)), now)
+        self.assertRaises(BadRequest, decode_sync_cursor, "not a cursor")
+
+    def test_only_changed_chunks_are_returned(self):
+        now = timezone.now()
+        self.register_chunk("old", now - timedelta(hours=2))
+        self.register_chunk("changed", now - timedelta(hours=1))
+        self.register_chunk("too_recent", now)
+
+        changed_after, sync_cursor_time = determine_sync_window("")
+        self.assertIsNone(changed_after)
+        chunks = handle_database_query(self.study.pk, {}, changed_until=sync_cursor_time)
+        self.assertEqual(sorted(chunk["chunk_path"] for chunk in chunks), ["changed", "old"])
+
+        cursor = encode_sync_cursor(now - timedelta(minutes=90))
+        changed_after, sync_cursor_time = determine_sync_window(cursor)
+        chunks = handle_database_query(
+            self.study.pk, {}, changed_after=changed_after, changed_until=sync_cursor_time
+        )
+        self.assertEqual([chunk["chunk_path"] for chunk in chunks], ["changed"])
+
+    def test_cursor_does_not_move_backwards(self):
+        cursor_time = timezone.now()
+        changed_after, sync_cursor_time = determine_sync_window(encode_sync_cursor(cursor_time))
+        self.assertEqual(sync_cursor_time, cursor_time)
@@ -0,0 +1,50 @@
+from django.test import TestCase
+from django.utils import timezone
+
+from database.profiling_models import UploadTracking
+from database.study_models import Study
+from database.user_models import Participant
+from libs.metrics import get_counter, reset_counters
+from libs.telemetry import TelemetrySink
+
+
+class TelemetrySinkTests(TestCase):
+
+    def setUp(self):
+        study = Study.create_with_object_id(
+            name="TEST_STUDY_FOR_TELEMETRY", encryption_key='aabbccddefggiijjkklmnoppqqrrsstt'
+        )
+        patient_id, _ = Participant.create_with_rnd_password(study=study)
+        self.participant = Participant.objects.get(patient_id=patient_id)
+        self.sink = TelemetrySink(capacity=3, flush_size=2, flush_seconds=60)
+        # flush on this thread only, the test database is not shared with other threads.
+        self.sink.thread = True
+        reset_counters()
+
+    def upload_tracking(self, file_path="a/b.csv"):
+        return UploadTracking(
+            file_path=file_path, file_size=10, timestamp=timezone.now(), participant=self.participant
+        )
+
+    def test_records_are_written_on_flush(self):
+        self.sink.add(self.upload_tracking())
+        self.sink.add(self.upload_tracking())
+        self.assertEqual(UploadTracking.objects.count(), 0)
+        self.assertTrue(self.sink.flush_requested.is_set())
+        self.sink.flush()
+        self.assertEqual(UploadTracking.objects.count(), 2)
+        self.assertEqual(self.sink.buffer, [])
+
+    def test_records_over_capacity_are_dropped(self):
+        for _ in xrange(5):
+            self.sink.add(self.upload_tracking())
+        self.sink.flush()
+        self.assertEqual(UploadTracking.objects.count(), 3)
+        self.assertEqual(get_counter("telemetry.dropped"), 2)
+
+    def test_invalid_records_are_dropped(self):
+        self.sink.add(self.upload_tracking(file_path="a" * 257))
+        self.sink.add(self.upload_tracking())
+        self.sink.flush()
+        self.assertEqual(UploadTracking.objects.count(), 1)
+        self.assertEqual(get_counter("telemetry.invalid"), 1)
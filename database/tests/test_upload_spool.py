@@ -0,0 +1,78 @@
+import os
+from shutil import rmtree
+from tempfile import mkdtemp
+from time import time
+
+from django.test import TestCase
+
+from database.study_models import Study
+from libs import upload_spool
+from libs.metrics import get_counter, reset_counters
+from libs.upload_spool import (cleanup_upload_spool, discard_spooled_uploads,
+    retrieve_spooled_upload, spool_upload)
+
+
+class UploadSpoolTests(TestCase):
+
+    def setUp(self):
+        self.study = Study.create_with_object_id(
+            name="TEST_STUDY_FOR_SPOOL", encryption_key='aabbccddefggiijjkklmnoppqqrrsstt'
+        )
+        self.spool_directory = mkdtemp()
+        self.original_settings = (upload_spool.UPLOAD_SPOOL_DIRECTORY, upload_spool.UPLOAD_SPOOL_MAX_BYTES)
+        upload_spool.UPLOAD_SPOOL_DIRECTORY = self.spool_directory
+        upload_spool._bytes_since_cleanup = None
+        reset_counters()
+
+    def tearDown(self):
+        upload_spool.UPLOAD_SPOOL_DIRECTORY, upload_spool.UPLOAD_SPOOL_MAX_BYTES = self.original_settings
+        upload_spool._bytes_since_cleanup = None
+        rmtree(self.spool_directory)
+
+    def spool_file_names(self):
+        return [name for name in os.listdir(self.spool_directory) if name.endswith(".spool")]
+
+    def test_spooled_file_is_retrieved(self):
+        spool_upload("a/b.csv", "some,data\n", self.study.object_id)
+        self.assertEqual(retrieve_spooled_upload("a/b.csv", self.study.object_id), "some,data\n")
+        self.assertIsNone(retrieve_spooled_upload("a/c.csv", self.study.object_id))
+        self.assertEqual(get_counter("upload_spool.hit"), 1)
+        self.assertEqual(get_counter("upload_spool.miss"), 1)
+
+    def test_spooled_file_is_stored_encrypted(self):
+        spool_upload("a/b.csv", "some,data\n", self.study.object_id)
+        with open(os.path.join(self.spool_directory, self.spool_file_names()[0]), "rb") as f:
+            self.assertNotIn("some,data", f.read())
+
+    def test_spooling_errors_are_not_raised(self):
+        spool_upload("a/b.csv", "some,data\n", "not_a_study_object_id")
+        self.assertEqual(self.spool_file_names(), [])
+        self.assertEqual(get_counter("upload_spool.write_error"), 1)
+
+    def test_discard(self):
+        spool_upload("a/b.csv", "some,data\n", self.study.object_id)
+        discard_spooled_uploads(["a/b.csv"])
+        self.assertEqual(self.spool_file_names(), [])
+
+    def test_oldest_files_are_evicted(self):
+        for i in xrange(3):
+            spool_upload("a/%s.csv" % i, "x" * 100, self.study.object_id)
+            path = upload_spool._spool_file_path("a/%s.csv" % i)
+            os.utime(path, (time() - 100 + i, time() - 100 + i))
+        # each file is 116 bytes (iv + data)
+        upload_spool.UPLOAD_SPOOL_MAX_BYTES = 250
+        cleanup_upload_spool()
+        self.assertIsNone(retrieve_spooled_upload("a/0.csv", self.study.object_id))
+        self.assertIsNotNone(retrieve_spooled_upload("a/1.csv", self.study.object_id))
+        self.assertIsNotNone(retrieve_spooled_upload("a/2.csv", self.study.object_id))
+        self.assertEqual(get_counter("upload_spool.evicted"), 1)
+
+    def test_stale_temp_files_are_removed(self):
+        stale_path = os.path.join(self.spool_directory, "crashed.tmp")
+        fresh_path = os.path.join(self.spool_directory, "in_progress.tmp")
+        for path in (stale_path, fresh_path):
+            open(path, "wb").close()
+        os.utime(stale_path, (time() - 2 * upload_spool.STALE_TEMP_FILE_SECONDS,) * 2)
+        cleanup_upload_spool()
+        self.assertFalse(os.path.exists(stale_path))
+        self.assertTrue(os.path.exists(fresh_path))
@@ -0,0 +1,93 @@
+import json
+from datetime import date, datetime
+
+from django.test import TestCase
+from django.utils import timezone
+
+from api.data_access_api import volume_generator
+from database.profiling_models import DataVolumeRollup, UploadTracking
+from database.study_models import Study
+from database.user_models import Participant
+from libs.volume_rollups import add_to_rollup, roll_up_processed_rows, roll_up_uploads, upload_data_type
+
+
+class DataVolumeRollupTests(TestCase):
+
+    def setUp(self):
+        self.study = Study.create_with_object_id(
+            name="TEST_STUDY_FOR_VOLUME_ROLLUPS", encryption_key='aabbccddefggiijjkklmnoppqqrrsstt'
+        )
+        self.patient_id, _ = Participant.create_with_rnd_password(study=self.study)
+        self.participant = Participant.objects.get(patient_id=self.patient_id)
+
+    def upload(self, file_path, file_size, timestamp):
+        return UploadTracking(
+            file_path=file_path, file_size=file_size, participant=self.participant,
+            timestamp=timezone.make_aware(timestamp, timezone.utc),
+        )
+
+    def test_upload_data_type(self):
+        self.assertEqual(upload_data_type("patient/accel/123.csv"), "accelerometer")
+        self.assertEqual(upload_data_type("patient/ios/log/123.csv"), "ios_log")
+        self.assertIsNone(upload_data_type("a/b.csv"))
+
+    def test_add_to_rollup_accumulates(self):
+        day = date(2018, 1, 2)
+        first, middle, last = [timezone.make_aware(datetime(2018, 1, 2, hour), timezone.utc) for hour in (1, 5, 9)]
+        add_to_rollup(self.study.pk, self.participant.pk, "gps", day, files=1, bytes=10, first_seen=middle,
+                      last_seen=middle)
+        add_to_rollup(self.study.pk, self.participant.pk, "gps", day, files=2, bytes=5, first_seen=first,
+                      last_seen=last)
+        add_to_rollup(self.study.pk, self.participant.pk, "gps", day, rows=7)
+        rollup = DataVolumeRollup.objects.get()
+        self.assertEqual((rollup.files, rollup.bytes, rollup.rows), (3, 15, 7))
+        self.assertEqual((rollup.first_seen, rollup.last_seen), (first, last))
+
+    def test_roll_up_uploads(self):
+        roll_up_uploads([
+            self.upload("patient/accel/1.csv", 100, datetime(2018, 1, 2, 1)),
+            self.upload("patient/accel/2.csv", 50, datetime(2018, 1, 2, 3)),
+            self.upload("patient/accel/3.csv", 25, datetime(2018, 1, 3, 1)),
+            self.upload("patient/gps/4.csv", 10, datetime(2018, 1, 2, 2)),
+            self.upload("a/b.csv", 10, datetime(2018, 1, 2, 2)),
+        ])
+        rollups = {
+            (rollup.data_type, rollup.day): (rollup.files, rollup.bytes)
+            for rollup in DataVolumeRollup.objects.all()
+        }
+        self.assertEqual(rollups, {
+            ("accelerometer", date(2018, 1, 2)): (2, 150),
+            ("accelerometer", date(2018, 1, 3)): (1, 25),
+            ("gps", date(2018, 1, 2)): (1, 10),
+        })
+
+    def test_roll_up_processed_rows(self):
+        roll_up_processed_rows({(self.patient_id, "gps"): 12})
+        roll_up_processed_rows({(self.patient_id, "gps"): 3})
+        rollup = DataVolumeRollup.objects.get()
+        self.assertEqual((rollup.study_id, rollup.files, rollup.rows), (self.study.pk, 0, 15))
+        self.assertEqual(rollup.day, timezone.now().astimezone(timezone.utc).date())
+
+    def test_weekly_stats(self):
+        now = timezone.now().astimezone(timezone.utc).replace(tzinfo=None)
+        roll_up_uploads([
+            self.upload("patient/accel/1.csv", 1024 * 1024, now),
+            self.upload("patient/gps/2.csv", 1024 * 1024, now),
+        ])
+        roll_up_processed_rows({(self.patient_id, "wifi"): 10})
+        stats = UploadTracking.weekly_stats()
+        self.assertEqual((stats["accelerometer"]["count"], stats["accelerometer"]["megabytes"]), (1, 1.))
+        self.assertEqual(stats["wifi"]["count"], 0)
+        self.assertEqual((stats["totals"]["total_count"], stats["totals"]["total_megabytes"]), (2, 2.))
+        self.assertEqual(stats["totals"]["user_count"], 1)
+
+    def test_volume_generator(self):
+        roll_up_uploads([self.upload("patient/gps/1.csv", 10, datetime(2018, 1, 2, 3))])
+        rollups = DataVolumeRollup.objects.values_list(
+            "participant__patient_id", "data_type", "day", "files", "bytes", "rows", "first_seen", "last_seen"
+        )
+        rollup, = [json.loads(line) for line in volume_generator(rollups)]
+        self.assertEqual(rollup["patient_id"], self.patient_id)
+        self.assertEqual((rollup["data_type"], rollup["day"]), ("gps", "2018-01-02"))
+        self.assertEqual((rollup["files"], rollup["bytes"], rollup["rows"]), (1, 10, 0))
+        self.assertEqual(rollup["first_seen"], rollup["last_seen"])
@@ -0,0 +1,128 @@
+import sys
+from math import ceil
+from multiprocessing.pool import ThreadPool
+from Queue import Queue
+from threading import Lock
+from time import time
+
+from django.db import connection
+
+from config.constants import (DOWNLOAD_FETCH_MAX_CONCURRENCY, DOWNLOAD_FETCH_THREADS,
+    DOWNLOAD_PREFETCH_MAX_BYTES)
+from libs.metrics import increment_counter
+
+# Data downloads fetch files from S3 ahead of the client reading them.  The number of fetches in
+# flight for a download is the number needed to keep up with the client: the (moving average of
+# the) S3 latency of a fetch divided by the time the client takes to drain a file.  Slow clients
+# get few fetches in flight, fast clients on big instances get up to
+# DOWNLOAD_FETCH_MAX_CONCURRENCY.  The bytes fetched but not yet read by the client are capped at
+# DOWNLOAD_PREFETCH_MAX_BYTES (while a fetch is in flight its size is estimated from the average
+# size of the download's files).  All downloads in a process share one long-lived thread pool.
+# Fetches should not need the database, but a pool thread's database connection (if a fetch did
+# open one) is closed after every fetch so that idle pool threads don't hold connections.
+
+INITIAL_CONCURRENCY = 3
+# weight of the newest measurement in the moving averages.
+SMOOTHING = 0.3
+
+_pool = {"pool": None}
+_pool_lock = Lock()
+
+
+def get_fetch_pool():
+    with _pool_lock:
+        if _pool["pool"] is None:
+            _pool["pool"] = ThreadPool(DOWNLOAD_FETCH_THREADS)
+        return _pool["pool"]
+
+
+def fetch_unordered(fetch_function, items, result_size, max_prefetch_bytes=None):
+    """ Generator of fetch_function(item) for every item, in the order the fetches complete.
+    result_size(result) returns the number of bytes a result holds in memory.  An exception raised
+    by a fetch is raised here. """
+    return _fetch(fetch_function, items, result_size, max_prefetch_bytes, ordered=False)
+
+
+def fetch_ordered(fetch_function, items, result_size, max_prefetch_bytes=None):
+    """ fetch_unordered, but the results are in the order of the items. """
+    return _fetch(fetch_function, items, result_size, max_prefetch_bytes, ordered=True)
+
+
+def _fetch(fetch_function, items, result_size, max_prefetch_bytes, ordered):
+    if max_prefetch_bytes is None:
+        max_prefetch_bytes = DOWNLOAD_PREFETCH_MAX_BYTES
+    pool = get_fetch_pool()
+    items = iter(items)
+    completed = Queue()
+    completed_out_of_order = {}
+    exhausted = False
+    submitted = 0
+    next_index = 0
+    in_flight = 0  # submitted and not yet yielded, whether or not the fetch has completed
+    concurrency = INITIAL_CONCURRENCY
+    latency = None
+    drain_time = None
+    average_size = None
+
+    def run_fetch(index, item):
+        start = time()
+        try:
+            result = fetch_function(item)
+        except Exception:
+            completed.put((index, None, None, sys.exc_info()))
+        else:
+            completed.put((index, result, time() - start, None))
+        finally:
+            connection.close()
+
+    while True:
+        # submit fetches, but always keep one in flight so that the download makes progress.
+        while not exhausted and in_flight < concurrency:
+            if in_flight and average_size is not None and in_flight * average_size >= max_prefetch_bytes:
+                increment_counter("download.prefetch.memory_capped")
+                break
+            try:
+                item = next(items)
+            except StopIteration:
+                exhausted = True
+                break
+            pool.apply_async(run_fetch, (submitted, item))
+            submitted += 1
+            in_flight += 1
+
+        if not in_flight:
+            return
+
+        while not ordered or next_index not in completed_out_of_order:
+            index, result, fetch_latency, exc_info = completed.get()
+            if exc_info is not None:
+                raise exc_info[0], exc_info[1], exc_info[2]
+            latency = moving_average(latency, fetch_latency)
+            average_size = moving_average(average_size, result_size(result))
+            if not ordered:
+                break
+            completed_out_of_order[index] = result
+        if ordered:
+            result = completed_out_of_order.pop(next_index)
+            next_index += 1
+        in_flight -= 1
+
+        drain_start = time()
+        yield result
+        del result
+        drain_time = moving_average(drain_time, time() - drain_start)
+        concurrency = target_concurrency(latency, drain_time)
+
+
+def target_concurrency(latency, drain_time):
+    """ The number of fetches in flight needed for a fetch to complete each time the client has
+    drained the previous one. """
+    if not drain_time:
+        return DOWNLOAD_FETCH_MAX_CONCURRENCY
+    return max(1, min(DOWNLOAD_FETCH_MAX_CONCURRENCY, int(ceil(latency / drain_time))))
+
+
+def moving_average(average, value):
+    if average is None:
+        return value
+    return SMOOTHING * value + (1 - SMOOTHING) * average
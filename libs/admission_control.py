@@ -0,0 +1,118 @@
+import functools
+from random import uniform
+from threading import Lock
+from time import time
+
+from django.db.models import Count, Min
+from django.utils import timezone
+from flask import request
+
+from config.constants import (UPLOAD_SHED_BACKLOG_AGE_SECONDS, UPLOAD_SHED_BACKLOG_FILES,
+    UPLOAD_SHED_IN_FLIGHT_REQUESTS, UPLOAD_SHED_RETRY_AFTER_SECONDS)
+from database.data_access_models import FileToProcess
+from database.study_models import Study
+from database.user_models import Participant
+from libs.metrics import increment_counter
+
+# Uploads are shed (answered with a 503 and a Retry-After header, the app keeps the file and tries
+# again later) when the system is overloaded.  The load is the highest of the ratios of the
+# processing backlog (number of files to process), the age of the oldest file to process, and the
+# number of uploads in flight in this process to their configured limits, a limit of 0 disables
+# that signal.  A study's upload priority sets the load at which its uploads are shed.
+PRIORITY_LOAD_LIMITS = {
+    Study.LOW_UPLOAD_PRIORITY: 0.5,
+    Study.NORMAL_UPLOAD_PRIORITY: 1.0,
+    Study.HIGH_UPLOAD_PRIORITY: 2.0,
+}
+
+# The backlog is measured at most this often (per process), it is a query over the whole table.
+BACKLOG_CHECK_SECONDS = 15
+
+_backlog = {"files": 0, "age": 0, "checked": None}
+_backlog_lock = Lock()
+_in_flight = {"count": 0}
+_in_flight_lock = Lock()
+
+
+def admission_controlled(some_function):
+    """ Decorator for upload endpoints, place it above the authentication decorator so that shed
+    uploads don't do the work of authenticating.  Counts the requests in flight, and sheds the
+    request if the load is above the limit of the participant's study. """
+    @functools.wraps(some_function)
+    def admit_and_call(*args, **kwargs):
+        with _in_flight_lock:
+            _in_flight["count"] += 1
+        try:
+            reason = get_shed_reason()
+            if reason:
+                increment_counter("upload.shed")
+                increment_counter("upload.shed." + reason)
+                return "", 503, {"Retry-After": str(retry_after_seconds())}
+            increment_counter("upload.admitted")
+            return some_function(*args, **kwargs)
+        finally:
+            with _in_flight_lock:
+                _in_flight["count"] -= 1
+    return admit_and_call
+
+
+def get_shed_reason():
+    """ Returns the name of the overloaded signal if the current request should be shed, or None. """
+    loads = current_loads()
+    if not loads:
+        return None
+    reason, load = max(loads.items(), key=lambda item: item[1])
+    # (the study's priority is only looked up when it matters)
+    if load <= min(PRIORITY_LOAD_LIMITS.values()):
+        return None
+    if load <= PRIORITY_LOAD_LIMITS[get_request_upload_priority()]:
+        return None
+    return reason
+
+
+def current_loads():
+    """ Returns a dictionary of signal name to its current value relative to its limit. """
+    loads = {}
+    if UPLOAD_SHED_IN_FLIGHT_REQUESTS:
+        # (this includes the current request)
+        loads["in_flight"] = float(_in_flight["count"]) / UPLOAD_SHED_IN_FLIGHT_REQUESTS
+    if UPLOAD_SHED_BACKLOG_FILES or UPLOAD_SHED_BACKLOG_AGE_SECONDS:
+        backlog = get_backlog()
+        if UPLOAD_SHED_BACKLOG_FILES:
+            loads["backlog"] = float(backlog["files"]) / UPLOAD_SHED_BACKLOG_FILES
+        if UPLOAD_SHED_BACKLOG_AGE_SECONDS:
+            loads["backlog_age"] = float(backlog["age"]) / UPLOAD_SHED_BACKLOG_AGE_SECONDS
+    return loads
+
+
+def get_backlog():
+    """ Returns the number of files to process and the age in seconds of the oldest one, measured
+    at most every BACKLOG_CHECK_SECONDS. """
+    with _backlog_lock:
+        if _backlog["checked"] is None or time() - _backlog["checked"] > BACKLOG_CHECK_SECONDS:
+            stats = FileToProcess.objects.aggregate(files=Count("id"), oldest=Min("created_on"))
+            _backlog["files"] = stats["files"]
+            _backlog["age"] = (timezone.now() - stats["oldest"]).total_seconds() if stats["oldest"] else 0
+            _backlog["checked"] = time()
+        return dict(_backlog)
+
+
+def get_request_upload_priority():
+    """ The upload priority of the study of the participant in the request, unknown participants
+    are normal priority (they will fail authentication).  The request body is not read, parsing
+    an upload is the work that shedding avoids: the participant is taken from the query string or
+    the basic auth username (patient_id@device_id, sent by ios), requests without either are normal
+    priority.  (Authentication also prefers the query string's patient_id, see request.values, so
+    the priority is that of the participant that is authenticated.) """
+    patient_id = request.args.get("patient_id")
+    if patient_id is None and request.authorization and request.authorization.username:
+        patient_id = request.authorization.username.split("@", 1)[0]
+    if patient_id is None:
+        return Study.NORMAL_UPLOAD_PRIORITY
+    priorities = Participant.objects.filter(patient_id=patient_id).values_list("study__upload_priority", flat=True)
+    return priorities[0] if priorities else Study.NORMAL_UPLOAD_PRIORITY
+
+
+def retry_after_seconds():
+    # devices that were shed together should not all come back at the same time.
+    return int(uniform(1, 2) * UPLOAD_SHED_RETRY_AFTER_SECONDS)
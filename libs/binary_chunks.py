@@ -0,0 +1,140 @@
+import json
+import struct
+import zlib
+from datetime import datetime
+
+from config.constants import API_TIME_FORMAT
+
+# High-rate sensor chunks can be stored in a typed binary encoding instead of csv, see
+# BINARY_CHUNK_ENCODING.  The data access API renders them back to the exact csv they were encoded
+# from (unless a client asks for the stored encoding), so an encoding is only used for a chunk if
+# it decodes to the same csv.
+#
+# Encoding: MAGIC, a 4 byte length and a json header of the column names, column types and the
+# number of rows, then the zlib compressed columns, each a 4 byte length and the column data.
+# Column types:
+#   delta_int64 - the timestamp, the first value then the differences, little endian int64s
+#   int64, float64 - little endian values
+#   utc_time - the "UTC time" column, computed from the timestamp, no data is stored
+#   string - the values joined by newlines
+
+MAGIC = "BEIWEBIN\x01"
+DELTA_INT64 = "delta_int64"
+INT64 = "int64"
+FLOAT64 = "float64"
+UTC_TIME = "utc_time"
+STRING = "string"
+
+
+def is_binary_chunk(data):
+    return data.startswith(MAGIC)
+
+
+def chunk_to_csv(data):
+    """ Returns the csv of a chunk, chunks that are csv are returned as they are. """
+    if is_binary_chunk(data):
+        return decode_binary_chunk(data)
+    return data
+
+
+def encode_binary_chunk(csv_string):
+    """ Returns the binary encoding of a chunk's csv, or None if the csv can't be encoded exactly
+    (a timestamp that is not an integer, rows with a different number of columns than the header). """
+    lines = csv_string.split("\n")
+    header = lines[0].split(",")
+    rows = [line.split(",") for line in lines[1:]]
+    if not header or header[0] != "timestamp" or any(len(row) != len(header) for row in rows):
+        return None
+    columns = zip(*rows) if rows else [[] for _ in header]
+
+    try:
+        timestamps = [int(value) for value in columns[0]]
+    except ValueError:
+        return None
+    if [str(timestamp) for timestamp in timestamps] != list(columns[0]):
+        return None
+
+    types = [DELTA_INT64]
+    blocks = [pack_int64s([timestamps[0]] + [b - a for a, b in zip(timestamps, timestamps[1:])] if timestamps else [])]
+    for name, values in zip(header[1:], columns[1:]):
+        value_type = choose_type(name, values, timestamps)
+        types.append(value_type)
+        if value_type == INT64:
+            blocks.append(pack_int64s([int(value) for value in values]))
+        elif value_type == FLOAT64:
+            blocks.append(struct.pack("<%dd" % len(values), *[float(value) for value in values]))
+        elif value_type == UTC_TIME:
+            blocks.append("")
+        else:
+            blocks.append("\n".join(values))
+
+    body = zlib.compress("".join(struct.pack("<I", len(block)) + block for block in blocks))
+    header_json = json.dumps({"columns": header, "types": types, "rows": len(rows)})
+    encoded = MAGIC + struct.pack("<I", len(header_json)) + header_json + body
+    if decode_binary_chunk(encoded) != csv_string:
+        return None
+    return encoded
+
+
+def choose_type(name, values, timestamps):
+    """ The most compact type that renders back to exactly the same values. """
+    if name == "UTC time" and all(value == utc_time_string(timestamp) for value, timestamp in zip(values, timestamps)):
+        return UTC_TIME
+    try:
+        if all(str(int(value)) == value for value in values):
+            return INT64
+    except ValueError:
+        pass
+    try:
+        if all(repr(float(value)) == value for value in values):
+            return FLOAT64
+    except ValueError:
+        pass
+    return STRING
+
+
+def decode_binary_chunk(data):
+    """ Returns the csv of a binary chunk. """
+    offset = len(MAGIC)
+    header_length, = struct.unpack_from("<I", data, offset)
+    offset += 4
+    header = json.loads(data[offset:offset + header_length])
+    body = zlib.decompress(data[offset + header_length:])
+    row_count = header["rows"]
+
+    columns = []
+    offset = 0
+    for value_type in header["types"]:
+        block_length, = struct.unpack_from("<I", body, offset)
+        block = body[offset + 4:offset + 4 + block_length]
+        offset += 4 + block_length
+        if value_type == DELTA_INT64:
+            timestamps = []
+            timestamp = 0
+            for delta in struct.unpack("<%dq" % row_count, block):
+                timestamp += delta
+                timestamps.append(timestamp)
+            columns.append([str(timestamp) for timestamp in timestamps])
+        elif value_type == INT64:
+            columns.append([str(value) for value in struct.unpack("<%dq" % row_count, block)])
+        elif value_type == FLOAT64:
+            columns.append([repr(value) for value in struct.unpack("<%dd" % row_count, block)])
+        elif value_type == UTC_TIME:
+            columns.append([utc_time_string(timestamp) for timestamp in timestamps])
+        else:
+            columns.append(block.split("\n") if row_count else [])
+
+    lines = [",".join(column.encode("utf-8") if isinstance(column, unicode) else column
+                      for column in header["columns"])]
+    lines.extend(",".join(row) for row in zip(*columns))
+    return "\n".join(lines)
+
+
+def pack_int64s(values):
+    return struct.pack("<%dq" % len(values), *values)
+
+
+def utc_time_string(unix_millisecond):
+    # the same as libs.file_processing.convert_unix_to_human_readable_timestamps
+    return (datetime.utcfromtimestamp(unix_millisecond / 1000).strftime(API_TIME_FORMAT)
+            + ".%03d" % (unix_millisecond % 1000))
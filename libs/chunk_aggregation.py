@@ -0,0 +1,122 @@
+from math import sqrt
+
+# Aggregates (count, min, max, mean, sum) of the numeric columns of the chunks of a data stream,
+# grouped by participant and time window, see data_access_api.get_aggregates.  Every chunk is
+# reduced to partial aggregates (on the threads that fetch the chunks), which are then merged.
+# Partial aggregates are a dictionary of (patient_id, window start in unix milliseconds) to
+# [number of rows, {column: [number of values, sum, min, max]}].
+
+REDUCTIONS = ("count", "min", "max", "mean", "sum")
+
+# Columns that are computed from other columns.
+DERIVED_COLUMNS = {
+    "magnitude": ("x", "y", "z"),
+}
+
+# Columns that are never aggregated.
+TIME_COLUMNS = ("timestamp", "UTC time")
+
+
+def aggregate_chunk(chunk_contents, patient_id, start_ms, end_ms, window_ms, columns=None):
+    """ Returns the partial aggregates of the rows of a chunk with a timestamp in [start_ms,
+    end_ms).  columns defaults to all columns, values that are not numbers are ignored. """
+    aggregates = {}
+    lines = chunk_contents.splitlines()
+    if not lines:
+        return aggregates
+    header = lines[0].split(",")
+    if columns is None:
+        columns = [name for name in header if name not in TIME_COLUMNS]
+    positions = {name: index for index, name in enumerate(header)}
+    column_indexes = [
+        (name, [positions.get(source) for source in DERIVED_COLUMNS.get(name, (name,))])
+        for name in columns
+    ]
+
+    for line in lines[1:]:
+        row = line.split(",")
+        try:
+            timestamp = int(row[0])
+        except ValueError:
+            continue
+        if not start_ms <= timestamp < end_ms:
+            continue
+        key = (patient_id, timestamp - timestamp % window_ms)
+        if key not in aggregates:
+            aggregates[key] = [0, {}]
+        group = aggregates[key]
+        group[0] += 1
+        for name, indexes in column_indexes:
+            value = column_value(row, indexes)
+            if value is None:
+                continue
+            column = group[1].get(name)
+            if column is None:
+                group[1][name] = [1, value, value, value]
+            else:
+                column[0] += 1
+                column[1] += value
+                if value < column[2]:
+                    column[2] = value
+                if value > column[3]:
+                    column[3] = value
+    return aggregates
+
+
+def column_value(row, indexes):
+    """ The float value of a column, or the magnitude of a derived column, None if not a number. """
+    try:
+        values = [float(row[index]) for index in indexes]
+    except (TypeError, IndexError, ValueError):
+        return None
+    if len(values) == 1:
+        return values[0]
+    return sqrt(sum(value * value for value in values))
+
+
+def merge_aggregates(total, partial):
+    for key, (row_count, columns) in partial.iteritems():
+        if key not in total:
+            total[key] = [row_count, columns]
+            continue
+        group = total[key]
+        group[0] += row_count
+        for name, (count, value_sum, minimum, maximum) in columns.iteritems():
+            column = group[1].get(name)
+            if column is None:
+                group[1][name] = [count, value_sum, minimum, maximum]
+            else:
+                column[0] += count
+                column[1] += value_sum
+                column[2] = min(column[2], minimum)
+                column[3] = max(column[3], maximum)
+
+
+def finish_aggregates(total, reductions=REDUCTIONS):
+    """ Returns a list, ordered by participant and window, of dictionaries of the patient_id,
+    window_start (unix milliseconds), count (of rows), and for every column a dictionary of the
+    requested reductions of its values. """
+    results = []
+    for (patient_id, window_start), (row_count, columns) in sorted(total.iteritems()):
+        result = {"patient_id": patient_id, "window_start": window_start, "count": row_count}
+        for name, (count, value_sum, minimum, maximum) in columns.iteritems():
+            values = {"count": count, "min": minimum, "max": maximum, "mean": value_sum / count, "sum": value_sum}
+            result[name] = {reduction: values[reduction] for reduction in reductions}
+        results.append(result)
+    return results
+
+
+def aggregates_to_csv(results, reductions=REDUCTIONS):
+    """ A csv of finished aggregates, with a column for every reduction of every column. """
+    columns = sorted({name for result in results for name in result
+                      if name not in ("patient_id", "window_start", "count")})
+    header = ["patient_id", "window_start", "count"]
+    header.extend("%s_%s" % (name, reduction) for name in columns for reduction in reductions)
+    lines = [",".join(header)]
+    for result in results:
+        row = [result["patient_id"], str(result["window_start"]), str(result["count"])]
+        for name in columns:
+            values = result.get(name, {})
+            row.extend(repr(values[reduction]) if reduction in values else "" for reduction in reductions)
+        lines.append(",".join(row))
+    return "\n".join(lines) + "\n"
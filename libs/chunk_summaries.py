@@ -0,0 +1,88 @@
+from math import asin, cos, radians, sin, sqrt
+
+from config.constants import ACCELEROMETER, CHUNK_TIMESLICE_QUANTUM, GPS
+
+# A summary of every chunk is saved when the chunk is saved (see
+# file_processing.batch_upload), so that analyses that only need hourly numbers don't have to
+# download the data, see data_access_api.get_summaries.  Every chunk has the number of rows and
+# the coverage (the fraction of the minutes of the hour that have rows, how much of the hour the
+# sensor was on), some data streams have values of their own:
+#   accelerometer: magnitude_mean, magnitude_variance (of the magnitude of x, y and z)
+#   gps: distance_m (travelled, in meters), radius_of_gyration_m (of the locations, in meters)
+# (The number of calls or texts of an hour is the row count of its calls or texts chunk.)
+
+EARTH_RADIUS_M = 6371009.0
+MINUTES_PER_CHUNK = CHUNK_TIMESLICE_QUANTUM // 60
+
+
+def summarize_chunk(data_type, chunk_contents):
+    """ Returns the row count, coverage and the data stream's values (a dictionary) of a chunk,
+    values that are not numbers are ignored. """
+    lines = chunk_contents.splitlines()
+    if not lines:
+        return 0, 0.0, {}
+    header = lines[0].split(",")
+    rows = [line.split(",") for line in lines[1:]]
+
+    minutes = set()
+    for row in rows:
+        try:
+            minutes.add(int(row[0]) // 60000)
+        except ValueError:
+            pass
+    coverage = min(len(minutes), MINUTES_PER_CHUNK) / float(MINUTES_PER_CHUNK)
+
+    summarize_values = DATA_STREAM_SUMMARIES.get(data_type)
+    values = summarize_values(header, rows) if summarize_values else {}
+    return len(rows), coverage, values
+
+
+def float_columns(header, rows, columns):
+    """ The values of the columns of the rows where they are all numbers, as lists of floats. """
+    indexes = [header.index(column) for column in columns if column in header]
+    if len(indexes) != len(columns):
+        return []
+    values = []
+    for row in rows:
+        try:
+            values.append([float(row[index]) for index in indexes])
+        except (IndexError, ValueError):
+            pass
+    return values
+
+
+def summarize_magnitude(header, rows):
+    magnitudes = [sqrt(x * x + y * y + z * z) for x, y, z in float_columns(header, rows, ("x", "y", "z"))]
+    if not magnitudes:
+        return {}
+    mean = sum(magnitudes) / len(magnitudes)
+    variance = sum((magnitude - mean) ** 2 for magnitude in magnitudes) / len(magnitudes)
+    return {"magnitude_mean": mean, "magnitude_variance": variance}
+
+
+def summarize_movement(header, rows):
+    locations = float_columns(header, rows, ("latitude", "longitude"))
+    if not locations:
+        return {}
+    distance = sum(haversine_distance(a, b) for a, b in zip(locations, locations[1:]))
+    center = (sum(latitude for latitude, _ in locations) / len(locations),
+              sum(longitude for _, longitude in locations) / len(locations))
+    radius_of_gyration = sqrt(
+        sum(haversine_distance(location, center) ** 2 for location in locations) / len(locations)
+    )
+    return {"distance_m": distance, "radius_of_gyration_m": radius_of_gyration}
+
+
+def haversine_distance(a, b):
+    """ The distance in meters between two (latitude, longitude) points. """
+    latitude_a, longitude_a = radians(a[0]), radians(a[1])
+    latitude_b, longitude_b = radians(b[0]), radians(b[1])
+    h = (sin((latitude_b - latitude_a) / 2) ** 2
+         + cos(latitude_a) * cos(latitude_b) * sin((longitude_b - longitude_a) / 2) ** 2)
+    return 2 * EARTH_RADIUS_M * asin(min(1.0, sqrt(h)))
+
+
+DATA_STREAM_SUMMARIES = {
+    ACCELEROMETER: summarize_magnitude,
+    GPS: summarize_movement,
+}
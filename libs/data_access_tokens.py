@@ -0,0 +1,59 @@
+from collections import namedtuple
+from threading import Lock
+from time import time
+
+from itsdangerous import BadSignature, URLSafeTimedSerializer
+
+from config.constants import DATA_ACCESS_STUDY_CACHE_SECONDS, DATA_ACCESS_TOKEN_SECONDS
+from config.settings import FLASK_SECRET_KEY
+from database.user_models import Researcher
+
+# Validating a researcher's secret key is a (deliberately slow) PBKDF2.  Instead of sending the
+# secret key with every data access request a client can exchange it for an access token once.
+# Tokens are signed with the server's secret key and expire after DATA_ACCESS_TOKEN_SECONDS.
+# A token contains the researcher's access key id, so resetting the access credentials also
+# invalidates the researcher's tokens (after at most DATA_ACCESS_STUDY_CACHE_SECONDS).
+
+# The researcher and the studies a set of credentials can access.
+StudyAccess = namedtuple("StudyAccess", ["researcher_id", "study_ids"])
+
+_serializer = URLSafeTimedSerializer(FLASK_SECRET_KEY, salt="data access token")
+_study_access_cache = {}
+_study_access_cache_lock = Lock()
+
+
+def create_access_token(researcher):
+    return _serializer.dumps({"access_key": researcher.access_key_id})
+
+
+def get_token_study_access(token):
+    """ Returns the StudyAccess of a valid access token, None if the token is invalid or expired. """
+    try:
+        token_data = _serializer.loads(token, max_age=DATA_ACCESS_TOKEN_SECONDS)
+    except BadSignature:
+        # (this includes expired tokens)
+        return None
+    return get_study_access(token_data["access_key"])
+
+
+def get_study_access(access_key_id):
+    """ Returns the StudyAccess of an access key id, None if no researcher has it.  Cached for
+    DATA_ACCESS_STUDY_CACHE_SECONDS. """
+    with _study_access_cache_lock:
+        cached = _study_access_cache.get(access_key_id)
+    if cached is not None and time() - cached[0] < DATA_ACCESS_STUDY_CACHE_SECONDS:
+        return cached[1]
+
+    try:
+        researcher_id = Researcher.objects.filter(access_key_id=access_key_id).values_list("id", flat=True).get()
+    except Researcher.DoesNotExist:
+        study_access = None
+    else:
+        study_ids = Researcher.studies.through.objects.filter(
+            researcher_id=researcher_id
+        ).values_list("study_id", flat=True)
+        study_access = StudyAccess(researcher_id, frozenset(study_ids))
+
+    with _study_access_cache_lock:
+        _study_access_cache[access_key_id] = (time(), study_access)
+    return study_access
@@ -0,0 +1,102 @@
+from calendar import timegm
+from datetime import datetime, timedelta
+
+# Which hours have data, of every data stream of every participant, is kept as a bitmap of hours
+# (see database.data_access_models.DataCoverage) that is updated when chunks are registered, so
+# coverage and gap queries don't scan the ChunkRegistry.  Bit i of a bitmap (bit i % 8 of byte
+# i // 8) is the hour first_hour + i, hours are counted from the unix epoch.  first_hour is a
+# multiple of 8 so that a bitmap can grow backwards a byte at a time.
+
+EPOCH = datetime(1970, 1, 1)
+
+# the number of set bits of each byte value
+BIT_COUNTS = [bin(byte).count("1") for byte in range(256)]
+
+
+def hour_of(time):
+    """ The hour since the unix epoch of a (naive utc or aware) datetime. """
+    return timegm(time.utctimetuple()) // 3600
+
+
+def hour_to_datetime(hour):
+    return EPOCH + timedelta(hours=hour)
+
+
+def set_hour(bitmap, first_hour, hour):
+    """ Sets the bit of an hour, growing the bitmap (a bytearray) if it doesn't have the hour.
+    Returns the bitmap, its first_hour, and whether the bit changed. """
+    if first_hour is None:
+        first_hour = hour - hour % 8
+    if hour < first_hour:
+        new_first_hour = hour - hour % 8
+        bitmap = bytearray((first_hour - new_first_hour) // 8) + bitmap
+        first_hour = new_first_hour
+    index = hour - first_hour
+    if index // 8 >= len(bitmap):
+        bitmap.extend(bytearray(index // 8 + 1 - len(bitmap)))
+    mask = 1 << (index % 8)
+    if bitmap[index // 8] & mask:
+        return bitmap, first_hour, False
+    bitmap[index // 8] |= mask
+    return bitmap, first_hour, True
+
+
+def has_hour(bitmap, first_hour, hour):
+    index = hour - first_hour
+    if index < 0 or index // 8 >= len(bitmap):
+        return False
+    return bool(bitmap[index // 8] & (1 << (index % 8)))
+
+
+def first_set_hour(bitmap, first_hour):
+    """ The first hour whose bit is set, None if there is none. """
+    for index, byte in enumerate(bitmap):
+        if byte:
+            return first_hour + index * 8 + (byte & -byte).bit_length() - 1
+    return None
+
+
+def count_hours(bitmap, first_hour, start_hour, end_hour):
+    """ The number of hours with data from start_hour up to (not including) end_hour. """
+    start = max(start_hour - first_hour, 0)
+    end = min(end_hour - first_hour, len(bitmap) * 8)
+    if start >= end:
+        return 0
+    # the partial bytes at the ends are counted bit by bit, the whole bytes with BIT_COUNTS
+    first_whole_byte = (start + 7) // 8
+    last_whole_byte = end // 8
+    if first_whole_byte >= last_whole_byte:
+        return sum(1 for hour in xrange(start_hour, end_hour) if has_hour(bitmap, first_hour, hour))
+    count = sum(BIT_COUNTS[byte] for byte in bitmap[first_whole_byte:last_whole_byte])
+    count += sum(1 for index in xrange(start, first_whole_byte * 8) if bitmap[index // 8] & (1 << (index % 8)))
+    count += sum(1 for index in xrange(last_whole_byte * 8, end) if bitmap[index // 8] & (1 << (index % 8)))
+    return count
+
+
+def missing_hour_ranges(bitmap, first_hour, start_hour, end_hour):
+    """ The ranges of hours without data, [start, end) pairs, from start_hour up to end_hour. """
+    ranges = []
+    gap_start = None
+    for hour in xrange(start_hour, end_hour):
+        if has_hour(bitmap, first_hour, hour):
+            if gap_start is not None:
+                ranges.append((gap_start, hour))
+                gap_start = None
+        elif gap_start is None:
+            gap_start = hour
+    if gap_start is not None:
+        ranges.append((gap_start, end_hour))
+    return ranges
+
+
+def daily_hour_counts(bitmaps, start_hour, days):
+    """ The number of hours of each of days days from start_hour that have data in any of the
+    bitmaps, a list of (bitmap, first_hour) pairs. """
+    counts = []
+    for day in range(days):
+        day_start = start_hour + day * 24
+        counts.append(sum(
+            1 for hour in xrange(day_start, day_start + 24)
+            if any(has_hour(bitmap, first_hour, hour) for bitmap, first_hour in bitmaps)
+        ))
+    return counts
@@ -0,0 +1,124 @@
+import json
+from datetime import datetime, timedelta
+from hashlib import sha1
+
+from django.utils import timezone
+
+from config.constants import (API_TIME_FORMAT, DATA_EXPORT_RETENTION_DAYS, DATA_EXPORT_REUSE_SECONDS,
+    DATA_EXPORT_TIMEOUT_SECONDS)
+from database.data_access_models import DataExport
+from libs.s3 import s3_delete_data_export, s3_retrieve_range, s3_upload_stream
+
+# Large data access API downloads can be built as export jobs instead of being streamed by the web
+# server: the request creates a DataExport, a celery task (queued by the cron, see
+# services.celery_data_processing) builds the archive and uploads it to S3 (encrypted with the
+# study's key like all server data) while it is being built, and the client polls the export's
+# status and then downloads it, in byte ranges if it wants to.  An identical query (same study,
+# parameters and archive format) made within DATA_EXPORT_REUSE_SECONDS gets the same export.
+# Exports still running after DATA_EXPORT_TIMEOUT_SECONDS are marked as failed (their task died),
+# and exports are deleted after DATA_EXPORT_RETENTION_DAYS.
+
+# Exports are read from S3 in pieces of this size for download responses.
+DOWNLOAD_READ_SIZE = 4 * 1024 * 1024
+
+
+def dump_query(query):
+    query = dict(query)
+    for key in ("start", "end"):
+        if key in query:
+            query[key] = query[key].strftime(API_TIME_FORMAT)
+    return json.dumps(query, sort_keys=True)
+
+
+def load_query(query_json):
+    query = json.loads(query_json)
+    for key in ("start", "end"):
+        if key in query:
+            query[key] = datetime.strptime(query[key], API_TIME_FORMAT)
+    return query
+
+
+def find_or_create_data_export(study, researcher, query, archive_format):
+    """ Returns the recent export of an identical query that has not failed, or a new export. """
+    query_json = dump_query(query)
+    query_hash = sha1("%s:%s:%s" % (study.pk, archive_format, query_json)).hexdigest()
+    recent_exports = DataExport.objects.filter(
+        study=study,
+        query_hash=query_hash,
+        created_on__gte=timezone.now() - timedelta(seconds=DATA_EXPORT_REUSE_SECONDS),
+    ).exclude(status=DataExport.FAILED).order_by("-created_on")
+    for data_export in recent_exports:
+        # (guard against hash collisions)
+        if data_export.query == query_json and data_export.archive_format == archive_format:
+            return data_export
+    return DataExport.objects.create(
+        study=study, researcher=researcher, query=query_json, query_hash=query_hash,
+        archive_format=archive_format,
+    )
+
+
+def start_data_export(data_export_id):
+    """ Marks a queued export as running, returns False if it is not queued (another task started
+    it). """
+    return bool(
+        DataExport.objects.filter(pk=data_export_id, status=DataExport.QUEUED).update(
+            status=DataExport.RUNNING, last_updated=timezone.now()
+        )
+    )
+
+
+def build_data_export(data_export):
+    """ Builds the archive of a running export and uploads it to S3. """
+    # (the archive is built by the same code as the data access API's get-data)
+    from api.data_access_api import handle_database_query, zip_generator
+    study_object_id = data_export.study.object_id
+    s3_path = "%s/exports/%s.%s" % (study_object_id, data_export.pk, data_export.archive_format)
+    try:
+        chunks = handle_database_query(data_export.study_id, load_query(data_export.query))
+        file_size = s3_upload_stream(
+            s3_path,
+            zip_generator(chunks, archive_format=data_export.archive_format),
+            study_object_id,
+            raw_path=True,
+        )
+    except Exception:
+        data_export.update(status=DataExport.FAILED, finished_on=timezone.now())
+        raise
+    data_export.update(status=DataExport.DONE, s3_path=s3_path, file_size=file_size,
+                       finished_on=timezone.now())
+
+
+def fail_stale_data_exports():
+    """ Marks the exports that have been running for longer than DATA_EXPORT_TIMEOUT_SECONDS as
+    failed so that they are not reused, returns their number. """
+    now = timezone.now()
+    return DataExport.objects.filter(
+        status=DataExport.RUNNING,
+        last_updated__lt=now - timedelta(seconds=DATA_EXPORT_TIMEOUT_SECONDS),
+    ).update(status=DataExport.FAILED, finished_on=now, last_updated=now)
+
+
+def prune_data_exports():
+    """ Deletes the exports older than DATA_EXPORT_RETENTION_DAYS, and their archives. """
+    cutoff = timezone.now() - timedelta(days=DATA_EXPORT_RETENTION_DAYS)
+    for data_export in DataExport.objects.filter(created_on__lt=cutoff):
+        if data_export.s3_path:
+            s3_delete_data_export(data_export.s3_path)
+        data_export.delete()
+
+
+def stream_data_export(data_export, start, stop):
+    """ Generator of the bytes of a finished export from start up to (not including) stop. """
+    study_object_id = data_export.study.object_id
+    for piece_start in xrange(start, stop, DOWNLOAD_READ_SIZE):
+        piece_stop = min(piece_start + DOWNLOAD_READ_SIZE, stop)
+        yield s3_retrieve_range(data_export.s3_path, study_object_id, piece_start, piece_stop, raw_path=True)
+
+
+def data_export_status(data_export):
+    return {
+        "export_id": data_export.pk,
+        "status": data_export.status,
+        "file_size": data_export.file_size,
+        "archive_format": data_export.archive_format,
+    }
@@ -0,0 +1,72 @@
+from datetime import timedelta
+from hashlib import sha1
+import json
+
+from django.utils import timezone
+from itsdangerous import BadSignature, URLSafeSerializer
+
+from config.constants import DOWNLOAD_SNAPSHOT_RETENTION_DAYS
+from config.settings import FLASK_SECRET_KEY
+from database.data_access_models import DownloadSnapshot
+
+# A resumable download sends the files of a query snapshot in a fixed order, and the client can
+# resume an interrupted download from the number of files it received.  The snapshot is the list
+# of the chunks of the files that the download sends (a DownloadSnapshot), fixed when the download
+# starts so that chunks rewritten or deleted before the download is resumed can't shift the list.
+# The snapshot token (signed with the server's secret key) holds the snapshot's id and a hash of
+# the query so the token is only used for the same query.
+
+_serializer = URLSafeSerializer(FLASK_SECRET_KEY, salt="download snapshot")
+
+# chunks are retrieved this many at a time
+SNAPSHOT_PAGE_SIZE = 500
+
+
+def create_download_snapshot(study_id, chunks, file_name, sync_cursor=None):
+    """ Creates the snapshot of a query's chunks (a values queryset), sent in the order of their
+    ids.  file_name is the function giving the name of a chunk's file in the download, only the
+    first chunk of a name is sent. """
+    chunk_ids = []
+    file_names = set()
+    for chunk in chunks.order_by("pk").iterator():
+        name = file_name(chunk)
+        if name not in file_names:
+            file_names.add(name)
+            chunk_ids.append(chunk["pk"])
+    return DownloadSnapshot.create_snapshot(study_id, chunk_ids, sync_cursor)
+
+
+def snapshot_chunks(chunks, chunk_ids):
+    """ Yields the chunks (of a values queryset) of a list of chunk ids, in the order of the list.
+    Chunks deleted since the snapshot was made are skipped. """
+    for i in xrange(0, len(chunk_ids), SNAPSHOT_PAGE_SIZE):
+        page = chunk_ids[i:i + SNAPSHOT_PAGE_SIZE]
+        page_chunks = {chunk["pk"]: chunk for chunk in chunks.filter(pk__in=page)}
+        for chunk_id in page:
+            if chunk_id in page_chunks:
+                yield page_chunks[chunk_id]
+
+
+def encode_download_snapshot(snapshot, query):
+    return _serializer.dumps({"snapshot_id": snapshot.pk, "query": query_hash(query)})
+
+
+def decode_download_snapshot(token, query, study_id):
+    """ Returns the DownloadSnapshot of a token, None if the token is invalid, is for another query
+    or study, or its snapshot has expired. """
+    try:
+        data = _serializer.loads(token)
+    except BadSignature:
+        return None
+    if data.get("query") != query_hash(query):
+        return None
+    return DownloadSnapshot.objects.filter(pk=data.get("snapshot_id"), study_id=study_id).first()
+
+
+def prune_download_snapshots():
+    cutoff = timezone.now() - timedelta(days=DOWNLOAD_SNAPSHOT_RETENTION_DAYS)
+    DownloadSnapshot.objects.filter(created_on__lt=cutoff).delete()
+
+
+def query_hash(query):
+    return sha1(json.dumps(query, sort_keys=True, default=str)).hexdigest()
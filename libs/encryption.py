@@ -1,15 +1,19 @@
-import json, traceback
+import json, sys, traceback
+from itertools import islice
+from multiprocessing.pool import ThreadPool
 from os import urandom
+from threading import Lock
 
 from Crypto.Cipher import AES
 from Crypto.PublicKey import RSA
-from flask import request
 
-from config.constants import ASYMMETRIC_KEY_LENGTH
+from config.constants import (ASYMMETRIC_KEY_LENGTH, CONCURRENT_DECRYPTION_OPS,
+    DECRYPTION_BATCH_SIZE, DECRYPTION_POOL_LINE_THRESHOLD)
 from config.settings import IS_STAGING
 from database.profiling_models import DecryptionKeyError, EncryptionErrorMetadata, LineEncryptionError
 from database.study_models import Study
 from libs.logging import log_error
+from libs.telemetry import record_telemetry
 from security import decode_base64, encode_base64, PaddingException
 
 
@@ -19,6 +23,16 @@ class InvalidIV(Exception): pass
 class InvalidData(Exception): pass
 class DefinitelyInvalidFile(Exception):pass
 
+# returned by _classify_line_decryption_error for errors that are not line decryption errors.
+UNKNOWN_LINE_ERROR = object()
+
+# large uploads are decrypted on a ThreadPool shared by the process, see get_decryption_pool.
+_decryption_pool = {"pool": None}
+_decryption_pool_lock = Lock()
+
+# study object id: encryption key, see get_study_encryption_key.
+_study_encryption_keys = {}
+
 # The private keys are stored server-side (S3), and the public key is sent to the android device.
 
 ################################################################################
@@ -57,14 +71,37 @@ def encrypt_for_server(input_string, study_object_id):
     Use this function on an entire file (as a string).
     """
 
-    encryption_key = Study.objects.get(object_id=study_object_id).encryption_key
+    encryption_key = get_study_encryption_key(study_object_id)
     iv = urandom(16)
     return iv + AES.new( encryption_key, AES.MODE_CFB, segment_size=8, IV=iv ).encrypt( input_string )
 
 
+def server_encryptor(study_object_id):
+    """
+    Returns an initialization vector and a cipher for encrypting a file in pieces, the encrypted
+    file is the iv followed by the encryption of each piece in order (CFB-8 keeps its state
+    between calls).  The file is decrypted by decrypt_server.
+    """
+    encryption_key = get_study_encryption_key(study_object_id)
+    iv = urandom(16)
+    return iv, AES.new( encryption_key, AES.MODE_CFB, segment_size=8, IV=iv )
+
+
+def get_study_encryption_key(study_object_id):
+    """ A study's encryption key never changes, it is looked up once per process.  (Files are
+    retrieved from S3 on thread pools, this keeps those threads off the database.) """
+    if study_object_id not in _study_encryption_keys:
+        _study_encryption_keys[study_object_id] = Study.objects.filter(
+            object_id=study_object_id
+        ).values_list('encryption_key', flat=True).get()
+    return _study_encryption_keys[study_object_id]
+
+
 def decrypt_server(data, study_object_id):
-    """ Decrypts config encrypted by the encrypt_for_server function."""
-    encryption_key = Study.objects.filter(object_id=study_object_id).values_list('encryption_key', flat=True).get()
+    """ Decrypts config encrypted by the encrypt_for_server function.
+    In CFB-8 a byte is decrypted with the 16 bytes of the file before it, so any byte range of an
+    encrypted file can be decrypted by passing it here with the 16 bytes preceding it. """
+    encryption_key = get_study_encryption_key(study_object_id)
     iv = data[:16]
     data = data[16:]
     return AES.new( encryption_key, AES.MODE_CFB, segment_size=8, IV=iv ).decrypt( data )
@@ -73,27 +110,33 @@ def decrypt_server(data, study_object_id):
 ########################### User/Device Decryption #############################
 
 
-def decrypt_device_file(patient_id, original_data, private_key, user):
+def decrypt_device_file(patient_id, original_data, private_key, user, file_name):
     """ Runs the line-by-line decryption of a file encrypted by a device.
-    This function is a special handler for iOS file uploads. """
+    This function is a special handler for iOS file uploads.
+
+    original_data is either a string or a file object, a file object is read a window of lines at
+    a time (see _decrypt_device_line_windows) rather than all at once.  The decrypted lines are
+    collected in a list and joined once at the end. """
     
-    def create_line_error_db_entry(error_type):
+    def create_line_error_db_entry(error_type, i, window):
         # declaring this inside decrypt device file to access its function-global variables
         # TODO @Eli consider enabling this on prod as well
+        # (the next line of the last line in a window is not available, it is left blank)
         if IS_STAGING:
-            LineEncryptionError.objects.create(
+            window_start = window[0][0]
+            record_telemetry(LineEncryptionError(
                 type=error_type,
                 base64_decryption_key=private_key.decrypt(decoded_key),
-                line=encode_base64(line),
-                prev_line=encode_base64(file_data[i - 1] if i > 0 else ''),
-                next_line=encode_base64(file_data[i + 1] if i < len(file_data) - 1 else ''),
+                line=encode_base64(window[i - window_start][1]),
+                prev_line=encode_base64(window[i - window_start - 1][1] if i > window_start else previous_line),
+                next_line=encode_base64(window[i - window_start + 1][1] if i - window_start < len(window) - 1 else ''),
                 participant=user,
-            )
+            ))
     
     def create_decryption_key_error(traceback):
         DecryptionKeyError.objects.create(
-                file_path=request.values['file_name'],
-                contents=original_data,
+                file_path=file_name,
+                contents=_read_device_file(original_data),
                 traceback=traceback,
                 participant=user,
         )
@@ -101,10 +144,12 @@ def decrypt_device_file(patient_id, original_data, private_key, user):
     bad_lines = []
     error_types = []
     error_count = 0
-    return_data = ""
-    file_data = [line for line in original_data.split('\n') if line != ""]
+    total_lines = 1
+    return_data = []
+    lines = _iterate_device_file_lines(original_data)
+    key_line = next(lines, None)
     
-    if not file_data:
+    if key_line is None:
         raise HandledError("The file had no data in it.  Return 200 to delete file from device.")
     
     # The following code is strange because of an unfortunate design design decision made quite
@@ -113,7 +158,7 @@ def decrypt_device_file(patient_id, original_data, private_key, user):
     # The second of the two except blocks likely means that the device failed to write the encryption
     # key as the first line of the file, but it may be a valid (but undecryptable) line of the  file.
     try:
-        decoded_key = decode_base64(file_data[0].encode("utf-8"))
+        decoded_key = decode_base64(key_line.encode("utf-8"))
     except (TypeError, IndexError, PaddingException) as e:
         create_decryption_key_error(traceback.format_exc())
         raise DecryptionKeyInvalidError("invalid decryption key. %s" % e.message)
@@ -124,114 +169,185 @@ def decrypt_device_file(patient_id, original_data, private_key, user):
         create_decryption_key_error(traceback.format_exc())
         raise DecryptionKeyInvalidError("invalid decryption key. %s" % e.message)
     
-    
-    for i, line in enumerate(file_data):
-        #we need to skip the first line (the decryption key), but need real index values in i
-        if i==0: continue
-        
-        if line is None:
-            #this case causes weird behavior inside decrypt_device_line, so we test for it instead.
-            error_count += 1
-            create_line_error_db_entry(LineEncryptionError.LINE_IS_NONE)
-            error_types.append(LineEncryptionError.LINE_IS_NONE)
-            bad_lines.append(line)
-            print("encountered empty line of data, ignoring.")
-            continue
+    previous_line = key_line
+    for window, window_results in _decrypt_device_line_windows(patient_id, decrypted_key, lines):
+        total_lines += len(window)
+        for i, decrypted_line, e, tb in window_results:
+            if e is None and decrypted_line is not None:
+                return_data.append(decrypted_line)
+                continue
             
-        try:
-            return_data += decrypt_device_line(patient_id, decrypted_key, line) + "\n"
-        except Exception as e:
+            line = window[i - window[0][0]][1]
             error_count += 1
             
-            error_message = "There was an error in user decryption: "
-            if isinstance(e, IndexError):
-                error_message += "Something is wrong with data padding:\n\tline: %s" % line
-                log_error(e, error_message)
-                create_line_error_db_entry(LineEncryptionError.PADDING_ERROR)
-                error_types.append(LineEncryptionError.PADDING_ERROR)
-                bad_lines.append(line)
-                continue
-
-            if isinstance(e, TypeError) and decrypted_key is None:
-                error_message += "The key was empty:\n\tline: %s" % line
-                log_error(e, error_message)
-                create_line_error_db_entry(LineEncryptionError.EMPTY_KEY)
-                error_types.append(LineEncryptionError.EMPTY_KEY)
-                bad_lines.append(line)
-                continue
-
-            ################### skip these errors ##############################
-            if "unpack" in e.message:
-                error_message += "malformed line of config, dropping it and continuing."
-                log_error(e, error_message)
-                create_line_error_db_entry(LineEncryptionError.MALFORMED_CONFIG)
-                error_types.append(LineEncryptionError.MALFORMED_CONFIG)
+            if e is None:
+                # this case causes weird behavior inside decrypt_device_line, so we test for it instead.
+                create_line_error_db_entry(LineEncryptionError.LINE_IS_NONE, i, window)
+                error_types.append(LineEncryptionError.LINE_IS_NONE)
                 bad_lines.append(line)
-                #the config is not colon separated correctly, this is a single
-                # line error, we can just drop it.
-                # implies an interrupted write operation (or read)
+                print("encountered empty line of data, ignoring.")
                 continue
-                
-            if "Input strings must be a multiple of 16 in length" in e.message:
-                error_message += "Line was of incorrect length, dropping it and continuing."
-                log_error(e, error_message)
-                create_line_error_db_entry(LineEncryptionError.INVALID_LENGTH)
-                error_types.append(LineEncryptionError.INVALID_LENGTH)
-                bad_lines.append(line)
-                continue
-                
-            if isinstance(e, InvalidData):
-                error_message += "Line contained no data, skipping: " + str(line)
-                log_error(e, error_message)
-                create_line_error_db_entry(LineEncryptionError.LINE_EMPTY)
-                error_types.append(LineEncryptionError.LINE_EMPTY)
-                bad_lines.append(line)
-                continue
-                
-            if isinstance(e, InvalidIV):
-                error_message += "Line contained no iv, skipping: " + str(line)
-                log_error(e, error_message)
-                create_line_error_db_entry(LineEncryptionError.IV_MISSING)
-                error_types.append(LineEncryptionError.IV_MISSING)
-                bad_lines.append(line)
-                continue
-                
-            ##################### flip out on these errors #####################
-            if 'AES key' in e.message:
-                error_message += "AES key has bad length."
-                create_line_error_db_entry(LineEncryptionError.AES_KEY_BAD_LENGTH)
-                error_types.append(LineEncryptionError.AES_KEY_BAD_LENGTH)
-                bad_lines.append(line)
-            elif 'IV must be' in e.message:
-                error_message += "iv has bad length."
-                create_line_error_db_entry(LineEncryptionError.IV_BAD_LENGTH)
-                error_types.append(LineEncryptionError.IV_BAD_LENGTH)
-                bad_lines.append(line)
-            elif 'Incorrect padding' in e.message:
-                error_message += "base64 padding error, config is truncated."
-                create_line_error_db_entry(LineEncryptionError.MP4_PADDING)
-                error_types.append(LineEncryptionError.MP4_PADDING)
-                bad_lines.append(line)
-                # this is only seen in mp4 files. possibilities:
-                #  upload during write operation.
-                #  broken base64 conversion in the app
-                #  some unanticipated error in the file upload
-            else:
-                raise #If none of the above errors happened, raise the error.
-            raise HandledError(error_message)
-            # if any of them did happen, raise a HandledError to cease execution.
+            
+            classification = _classify_line_decryption_error(e, line, decrypted_key)
+            if classification is UNKNOWN_LINE_ERROR:
+                # re-raise with the traceback of the decrypt_device_line call that raised it.
+                raise type(e), e, tb
+            error_type, error_message, is_fatal = classification
+            create_line_error_db_entry(error_type, i, window)
+            error_types.append(error_type)
+            bad_lines.append(line)
+            
+            if is_fatal:
+                # if any of them did happen, raise a HandledError to cease execution.
+                raise HandledError(error_message)
+            
+            # The error was a single line error, we log it and drop the line.
+            log_error(e, error_message)
+        previous_line = window[-1][1]
     
     if error_count:
-        EncryptionErrorMetadata.objects.create(
-            file_name=request.values['file_name'],
-            total_lines=len(file_data),
+        record_telemetry(EncryptionErrorMetadata(
+            file_name=file_name,
+            total_lines=total_lines,
             number_errors=error_count,
             error_lines=json.dumps(bad_lines),
             error_types=json.dumps(error_types),
             participant=user,
-        )
+        ))
+    
+    if not return_data:
+        return ""
+    # every decrypted line is newline terminated, including the last one.
+    return_data.append("")
+    return "\n".join(return_data)
+
+
+def _iterate_device_file_lines(original_data):
+    """ Generator, yields the non-empty lines of a device file, a string or a file object. """
+    if isinstance(original_data, basestring):
+        lines = original_data.split('\n')
+    else:
+        lines = (line[:-1] if line.endswith('\n') else line for line in original_data)
+    for line in lines:
+        if line != "":
+            yield line
+
+
+def _read_device_file(original_data):
+    if isinstance(original_data, basestring):
+        return original_data
+    original_data.seek(0)
+    return original_data.read()
+
+
+def _decrypt_device_line_windows(patient_id, key, lines):
+    """ Generator, reads the lines (after the decryption key) a window of CONCURRENT_DECRYPTION_OPS
+    batches of lines at a time, and yields tuples of (window, decryption results), where the
+    window is a list of (line index, line) and the results are the concatenated outputs of
+    _decrypt_device_line_batch for the batches in the window, in order.
+    Lines after the first DECRYPTION_POOL_LINE_THRESHOLD are decrypted on the process's shared
+    decryption pool. """
+    indexed_lines = enumerate(lines, 1)
+    window_size = DECRYPTION_BATCH_SIZE * CONCURRENT_DECRYPTION_OPS
+    while True:
+        window = list(islice(indexed_lines, window_size))
+        if not window:
+            return
         
-    return return_data
+        batches = [
+            (patient_id, key, window[start:start + DECRYPTION_BATCH_SIZE])
+            for start in xrange(0, len(window), DECRYPTION_BATCH_SIZE)
+        ]
+        
+        if DECRYPTION_POOL_LINE_THRESHOLD and window[-1][0] > DECRYPTION_POOL_LINE_THRESHOLD:
+            # map returns batches in order, the output file must retain line order.
+            batch_results = get_decryption_pool().map(_decrypt_device_line_batch, batches, chunksize=1)
+        else:
+            batch_results = [_decrypt_device_line_batch(batch) for batch in batches]
+        
+        yield window, [result for results in batch_results for result in results]
+
+
+def get_decryption_pool():
+    """ The ThreadPool shared by all the uploads decrypted in this process. """
+    with _decryption_pool_lock:
+        if _decryption_pool["pool"] is None:
+            _decryption_pool["pool"] = ThreadPool(CONCURRENT_DECRYPTION_OPS)
+        return _decryption_pool["pool"]
+
+
+def _decrypt_device_line_batch(batch):
+    """ Used for mapping decrypt_device_line over a batch of lines, never raises.
+    Returns a list of tuples of the form (line index, decrypted line, exception, traceback), where
+    exactly one of decrypted line and exception is None.  (Both are None when the line is None.)
+    The traceback is that of the exception, so that the caller can re-raise it. """
+    patient_id, key, indexed_lines = batch
+    results = []
+    append = results.append
+    for i, line in indexed_lines:
+        if line is None:
+            append((i, None, None, None))
+            continue
+        try:
+            append((i, decrypt_device_line(patient_id, key, line), None, None))
+        except Exception as e:
+            append((i, None, e, sys.exc_info()[2]))
+    return results
+
+
+def _classify_line_decryption_error(e, line, decrypted_key):
+    """ Determines the LineEncryptionError type of an error raised by decrypt_device_line.
+    Returns a tuple of (error type, error message, is fatal).  Fatal errors mean that the rest of
+    the file should not be decrypted.  Returns UNKNOWN_LINE_ERROR if it is not a known error, the
+    caller re-raises it. """
+    error_message = "There was an error in user decryption: "
+    if isinstance(e, IndexError):
+        error_message += "Something is wrong with data padding:\n\tline: %s" % line
+        return LineEncryptionError.PADDING_ERROR, error_message, False
+    
+    if isinstance(e, TypeError) and decrypted_key is None:
+        error_message += "The key was empty:\n\tline: %s" % line
+        return LineEncryptionError.EMPTY_KEY, error_message, False
+    
+    ################### skip these errors ##############################
+    if "unpack" in e.message:
+        # the config is not colon separated correctly, this is a single
+        # line error, we can just drop it.
+        # implies an interrupted write operation (or read)
+        error_message += "malformed line of config, dropping it and continuing."
+        return LineEncryptionError.MALFORMED_CONFIG, error_message, False
+    
+    if "Input strings must be a multiple of 16 in length" in e.message:
+        error_message += "Line was of incorrect length, dropping it and continuing."
+        return LineEncryptionError.INVALID_LENGTH, error_message, False
+    
+    if isinstance(e, InvalidData):
+        error_message += "Line contained no data, skipping: " + str(line)
+        return LineEncryptionError.LINE_EMPTY, error_message, False
+    
+    if isinstance(e, InvalidIV):
+        error_message += "Line contained no iv, skipping: " + str(line)
+        return LineEncryptionError.IV_MISSING, error_message, False
+    
+    ##################### flip out on these errors #####################
+    if 'AES key' in e.message:
+        error_message += "AES key has bad length."
+        return LineEncryptionError.AES_KEY_BAD_LENGTH, error_message, True
+    
+    if 'IV must be' in e.message:
+        error_message += "iv has bad length."
+        return LineEncryptionError.IV_BAD_LENGTH, error_message, True
+    
+    if 'Incorrect padding' in e.message:
+        # this is only seen in mp4 files. possibilities:
+        #  upload during write operation.
+        #  broken base64 conversion in the app
+        #  some unanticipated error in the file upload
+        error_message += "base64 padding error, config is truncated."
+        return LineEncryptionError.MP4_PADDING, error_message, True
+    
+    # If none of the above errors happened, the caller raises the error.
+    return UNKNOWN_LINE_ERROR
 
 
 def decrypt_device_line(patient_id, key, data):
@@ -12,12 +12,17 @@ from config import load_django
 from config.constants import (ANDROID_LOG_FILE, UPLOAD_FILE_TYPE_MAPPING, API_TIME_FORMAT,
     IDENTIFIERS,
     WIFI, CALL_LOG, CHUNK_TIMESLICE_QUANTUM, FILE_PROCESS_PAGE_SIZE, SURVEY_TIMINGS, ACCELEROMETER,
-    SURVEY_DATA_FILES, CONCURRENT_NETWORK_OPS, CHUNKS_FOLDER, CHUNKABLE_FILES,
-    DATA_PROCESSING_NO_ERROR_STRING, IOS_LOG_FILE)
-from database.data_access_models import ChunkRegistry, FileProcessLock, FileToProcess
+    SURVEY_ANSWERS, SURVEY_DATA_FILES, CONCURRENT_NETWORK_OPS, CHUNKS_FOLDER, CHUNKABLE_FILES,
+    DATA_PROCESSING_NO_ERROR_STRING, IOS_LOG_FILE, BINARY_CHUNK_ENCODING, BINARY_CHUNK_DATA_STREAMS)
+from django.utils import timezone
+from database.data_access_models import ChunkRegistry, ChunkSummary, FileProcessLock, FileToProcess
 from database.user_models import Participant
 from database.study_models import Survey
+from libs.binary_chunks import chunk_to_csv, encode_binary_chunk
 from libs.s3 import s3_retrieve, s3_upload
+from libs.survey_answers import index_survey_answers
+from libs.upload_spool import discard_spooled_uploads, retrieve_spooled_upload
+from libs.volume_rollups import roll_up_processed_rows
 
 
 class EverythingWentFine(Exception): pass
@@ -144,17 +149,7 @@ def do_process_user_file_chunks(count, error_handler, skip_count, participant):
 
             else:  # if not data['chunkable']
                 # print "2a"
-                timestamp = clean_java_timecode(data['ftp']["s3_file_path"].rsplit("/", 1)[-1][:-4])
-                # print "2a"
-                # Since we aren't binning the data by hour, just create a ChunkRegistry that
-                # points to the already existing S3 file.
-                ChunkRegistry.register_unchunked_data(
-                    data['data_type'],
-                    timestamp,
-                    data['ftp']['s3_file_path'],
-                    data['ftp']['study'].pk,
-                    data['ftp']['participant'].pk,
-                )
+                register_unchunkable_file(data)
                 # print "2b"
                 ftps_to_remove.add(data['ftp']['id'])
 
@@ -164,8 +159,10 @@ def do_process_user_file_chunks(count, error_handler, skip_count, participant):
     more_ftps_to_remove, number_bad_files = upload_binified_data(all_binified_data, error_handler, survey_id_dict)
     # print "X"
     ftps_to_remove.update(more_ftps_to_remove)
-    # Actually delete the processed FTPs from the database
-    FileToProcess.objects.filter(pk__in=ftps_to_remove).delete()
+    # Actually delete the processed FTPs from the database, and their spooled copies
+    processed_ftps = FileToProcess.objects.filter(pk__in=ftps_to_remove)
+    discard_spooled_uploads(processed_ftps.values_list("s3_file_path", flat=True))
+    processed_ftps.delete()
     # print "Y"
     # Garbage collect to free up memory
     gc.collect()
@@ -182,6 +179,8 @@ def upload_binified_data(binified_data, error_handler, survey_id_dict):
     failed_ftps = set([])
     ftps_to_retire = set([])
     upload_these = []
+    # the number of new rows of each participant's data streams, for the data volume rollups
+    new_row_counts = defaultdict(int)
     for data_bin, (data_rows_deque, ftp_deque) in binified_data.iteritems():
         # print 3
         with error_handler:
@@ -191,6 +190,7 @@ def upload_binified_data(binified_data, error_handler, survey_id_dict):
                 # print 5
                 # data_rows_deque may be a generator; here it is evaluated
                 rows = list(data_rows_deque)
+                new_row_count = len(rows)
                 updated_header = convert_unix_to_human_readable_timestamps(original_header, rows)
                 # print 6
                 chunk_path = construct_s3_chunk_path(study_id, user_id, data_type, time_bin)
@@ -216,7 +216,7 @@ def upload_binified_data(binified_data, error_handler, survey_id_dict):
                             raise ChunkFailedToExist("chunk %s does not actually point to a file, deleting DB entry, should run correctly on next index." % chunk_path)
                         raise  # Raise original error if not 404 s3 error
                     # print 10
-                    old_header, old_rows = csv_to_list(s3_file_data)
+                    old_header, old_rows = csv_to_list(chunk_to_csv(s3_file_data))
                     if old_header != updated_header:
                         # To handle the case where a file was on an hour boundary and placed in
                         # two separate chunks we need to raise an error in order to retire this file. If this
@@ -289,6 +289,7 @@ def upload_binified_data(binified_data, error_handler, survey_id_dict):
                 # If no exception was raised, the FTP has completed processing. Add it to the set of
                 # retireable (i.e. completed) FTPs.
                 ftps_to_retire.update(ftp_deque)
+                new_row_counts[(user_id, data_type)] += new_row_count
 
     pool = ThreadPool(CONCURRENT_NETWORK_OPS)
     errors = pool.map(batch_upload, upload_these, chunksize=1)
@@ -299,6 +300,8 @@ def upload_binified_data(binified_data, error_handler, survey_id_dict):
 
     pool.close()
     pool.terminate()
+    if new_row_counts:
+        roll_up_processed_rows(new_row_counts)
     # The things in ftps to retire that are not in failed ftps.
     # len(failed_ftps) will become the number of files to skip in the next iteration.
     return ftps_to_retire.difference(failed_ftps), len(failed_ftps)
@@ -616,22 +619,55 @@ def batch_retrieve_for_processing(ftp_as_object):
            'exception': None,
            "file_contents": "",
            "traceback": None}
-    if data_type in CHUNKABLE_FILES:
-        ret['chunkable'] = True
+    ret['chunkable'] = data_type in CHUNKABLE_FILES
+    # survey answers are not chunked, but their answers are indexed, see libs.survey_answers
+    if ret['chunkable'] or data_type == SURVEY_ANSWERS:
         # Try to retrieve the file contents. If any errors are raised, store them to be raised by the parent function
         try:
             print(ftp['s3_file_path'] + "\ngetting data...")
-            ret['file_contents'] = s3_retrieve(ftp['s3_file_path'], ftp["study"].object_id, raw_path=True)
+            # files uploaded to this machine may still be in the upload spool.
+            file_contents = retrieve_spooled_upload(ftp['s3_file_path'], ftp["study"].object_id)
+            if file_contents is None:
+                file_contents = s3_retrieve(ftp['s3_file_path'], ftp["study"].object_id, raw_path=True)
+            ret['file_contents'] = file_contents
         except Exception as e:
             ret['traceback'] = format_exc(e)
             ret['exception'] = e
-    else:
-        # We don't do anything with unchunkable data.
-        ret['chunkable'] = False
-        ret['file_contents'] = ""
+    # We don't do anything else with unchunkable data.
     return ret
 
 
+def register_unchunkable_file(data):
+    """ Since we aren't binning the data by hour, just create a ChunkRegistry that points to the
+    already existing S3 file.  Survey answers are indexed first: indexing is safe to repeat, and
+    a file whose indexing fails is not registered, it is retried (the FileToProcess is kept) without
+    creating a duplicate ChunkRegistry. """
+    timestamp = clean_java_timecode(data['ftp']["s3_file_path"].rsplit("/", 1)[-1][:-4])
+    if data['data_type'] == SURVEY_ANSWERS:
+        index_survey_answer_file(data, timestamp)
+    ChunkRegistry.register_unchunked_data(
+        data['data_type'],
+        timestamp,
+        data['ftp']['s3_file_path'],
+        data['ftp']['study'].pk,
+        data['ftp']['participant'].pk,
+    )
+
+
+def index_survey_answer_file(data, timestamp):
+    survey_object_id = resolve_survey_id_from_file_name(data['ftp']["s3_file_path"])
+    survey_pk = Survey.objects.filter(object_id=survey_object_id).values_list('pk', flat=True).first()
+    if survey_pk is None:
+        # (answers to a survey that has been deleted from the database)
+        return
+    index_survey_answers(
+        data['ftp']['participant'].pk,
+        survey_pk,
+        timezone.make_aware(datetime.utcfromtimestamp(timestamp), timezone.utc),
+        data['file_contents'],
+    )
+
+
 def batch_upload(upload):
     """ Used for mapping an s3_upload function. """
     ret = {'exception': None,
@@ -643,33 +679,59 @@ def batch_upload(upload):
         chunk, chunk_path, new_contents, study_object_id = upload
         del upload
         new_contents = new_contents.decode("zip")
-        s3_upload(chunk_path, new_contents, study_object_id, raw_path=True)
+        data_type = chunk.data_type if isinstance(chunk, ChunkRegistry) else chunk['data_type']
+        # the chunk hash and file size are those of the csv, whatever the chunk is stored as
+        file_contents, file_format = encode_chunk_contents(data_type, new_contents)
+        s3_upload(chunk_path, file_contents, study_object_id, raw_path=True)
+        del file_contents
         print("data uploaded!", chunk_path)
-        if isinstance(chunk, ChunkRegistry):
-            # If the contents are being appended to an existing ChunkRegistry object
-            chunk.low_memory_update_chunk_hash(new_contents)
-        else:
-            # If a new ChunkRegistry object is being created
-            # Convert the ID's used in the S3 file names into primary keys for making ChunkRegistry FKs
-            participant_pk, study_pk = Participant.objects.filter(patient_id=chunk['user_id']).values_list('pk', 'study_id').get()
-            if chunk['survey_id']:
-                survey_pk = Survey.objects.filter(object_id=chunk['survey_id']).values_list('pk', flat=True).get()
-            else:
-                survey_pk = None
-            ChunkRegistry.register_chunked_data(
-                chunk['data_type'],
-                chunk['time_bin'],
-                chunk['chunk_path'],
-                new_contents,  # unlikely to be huge
-                study_pk,
-                participant_pk,
-                survey_pk,
-            )
+        register_chunk_contents(chunk, new_contents, file_format)
     except Exception as e:
         ret['traceback'] = format_exc(e)
         ret['exception'] = e
     return ret
 
+
+def register_chunk_contents(chunk, new_contents, file_format):
+    """ Registers the (csv) contents of a chunk that has been uploaded, chunk is either an existing
+    ChunkRegistry that the contents were appended to or the dictionary of a new chunk. """
+    if isinstance(chunk, ChunkRegistry):
+        # If the contents are being appended to an existing ChunkRegistry object
+        # (the low memory hash takes a list holding the contents, it is not copied)
+        chunk.low_memory_update_chunk_hash([new_contents], file_size=len(new_contents), file_format=file_format)
+        chunk_registry = chunk
+    else:
+        # If a new ChunkRegistry object is being created
+        # Convert the ID's used in the S3 file names into primary keys for making ChunkRegistry FKs
+        participant_pk, study_pk = Participant.objects.filter(patient_id=chunk['user_id']).values_list('pk', 'study_id').get()
+        if chunk['survey_id']:
+            survey_pk = Survey.objects.filter(object_id=chunk['survey_id']).values_list('pk', flat=True).get()
+        else:
+            survey_pk = None
+        chunk_registry = ChunkRegistry.register_chunked_data(
+            chunk['data_type'],
+            chunk['time_bin'],
+            chunk['chunk_path'],
+            new_contents,  # unlikely to be huge
+            study_pk,
+            participant_pk,
+            survey_pk,
+            file_format=file_format,
+        )
+    # the summary of the whole chunk, old and new rows
+    ChunkSummary.save_chunk_summary(chunk_registry, new_contents)
+    return chunk_registry
+
+
+def encode_chunk_contents(data_type, csv_contents):
+    """ Returns the contents a chunk is stored as and their file format, the binary encoding (see
+    BINARY_CHUNK_ENCODING) if it is enabled for the data type and the csv can be encoded. """
+    if BINARY_CHUNK_ENCODING and data_type in BINARY_CHUNK_DATA_STREAMS:
+        binary_contents = encode_binary_chunk(csv_contents)
+        if binary_contents is not None:
+            return binary_contents, ChunkRegistry.BINARY_FORMAT
+    return csv_contents, ChunkRegistry.CSV_FORMAT
+
 """ Exceptions """
 class HeaderMismatchException(Exception): pass
 class ChunkFailedToExist(Exception): pass
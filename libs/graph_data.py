@@ -1,5 +1,6 @@
 from flask import json
-from libs.s3 import s3_list_files, s3_retrieve
+
+from database.data_access_models import SurveyAnswer
 
 ################################ CSV HANDLER ###################################
 def csv_to_dict(csv_string):
@@ -21,57 +22,36 @@ def csv_to_dict(csv_string):
 ############################### GRAPH DATA #####################################
 ################################################################################
 
-def grab_file_names(study_id, survey_id, user_id, number_points):
-    """ Takes a list, returns a list of those most recent files."""
-    all_files = s3_list_files("%s/%s/surveyAnswers/%s" %(str(study_id), str(user_id), str(survey_id)))
-    return sorted( all_files[ -number_points: ] )
+def get_survey_results(participant_id, survey_id, number_points=7):
+    """ Compiles the answers to the most recent number_points surveys (from the survey answers
+    index, see libs.survey_answers) for a given patient into config points for displaying on the
+    device.  The questions are those of the oldest of those surveys.
+    Result is a list of lists, inner list[0] is the title/question text, inner list[1] is a
+    list of y coordinates. """
+    answers = SurveyAnswer.objects.filter(participant_id=participant_id, survey_id=survey_id)
+    answer_times = list(
+        answers.order_by("-answered_at").values_list("answered_at", flat=True).distinct()[:number_points]
+    )
+    if not answer_times:
+        return []
 
-def compile_question_data(surveys):
-    """ creates a double nested dict of question ids containing dict with question text,
-    and an empty list. """
-    #Note: we want to keep the question text around so it can be displayed on the page.
-    if not surveys:
-        return {}
     all_questions = {}
-    for question in surveys[0]: # we only need to get the questions once
-        all_questions[ question['question id'] ] = { question['question text'] : [] }
-    return all_questions
-
-def pull_answers(surveys, all_questions):
-    """ Runs through questions and pull out answers, append them to the lists in the container
-    constructed by compile_question_data. """
-    for survey in surveys:
-        for question in survey:
-            question_id = question['question id']
-            answer = question['answer']
-            question_text = question['question text']
-            try:
-                all_questions[question_id][question_text].append( int(answer) )
-            except ValueError:
-                all_questions[question_id][question_text].append(None)
-    return all_questions
+    for answered_at, question_id, question_text, answer in answers.filter(
+            answered_at__in=answer_times).order_by("answered_at", "pk").values_list(
+            "answered_at", "question_id", "question_text", "answer"):
+        # we only need to get the questions once
+        if answered_at == answer_times[-1]:
+            all_questions.setdefault(question_id, (question_text, []))
+        if question_id not in all_questions:
+            continue
+        try:
+            all_questions[question_id][1].append( int(answer) )
+        except ValueError:
+            all_questions[question_id][1].append(None)
 
-
-def get_survey_results( study_id, user_id, survey_id, number_points=7 ):
-    """ Compiles 2 weeks (14 points) of config from s3 for a given patient into config points for
-    displaying on the device.
-    Result is a list of lists, inner list[0] is the title/question text, inner list[1] is a
-    list of y coordinates. """
-    # Get files from s3 for user answers, convert each csv_file to a list of dicts,
-    # pull the questions and corresponding answers.
-    files = grab_file_names( study_id, survey_id, user_id, number_points )
-    #note: we need to remove the prepended study id from file name strings,
-    # that string is always 24 characters + the slash.
-    surveys = [ csv_to_dict( s3_retrieve( file_name[25:], study_id ) ) for file_name in files ]
-    all_questions = compile_question_data(surveys)
-    all_answers = pull_answers(surveys, all_questions)
-    #all answers may be identical to all questions at this point.
     # turn the data into a list of lists that javascript can actually handle.
-    questions_answers = sorted( all_answers.values() ) #pulls out question text and answers. 
-    result = []
-    for question in questions_answers: #maps question answers to data points
-        for question_text, corresponding_answers in question.items():
-            result.append( [question_text, corresponding_answers] )
+    result = sorted( [question_text, corresponding_answers]
+                     for question_text, corresponding_answers in all_questions.values() )
     return jsonify_survey_results(result)
 
 
@@ -0,0 +1,37 @@
+from collections import defaultdict
+from threading import Lock
+
+# Simple in-process counters, these are per process and reset when the process restarts.  They are
+# used to report the behavior of caches and buffers (hit rates, dropped records) in log output.
+
+_counters = defaultdict(int)
+_counters_lock = Lock()
+
+
+def increment_counter(name, amount=1):
+    with _counters_lock:
+        _counters[name] += amount
+
+
+def get_counter(name):
+    with _counters_lock:
+        return _counters[name]
+
+
+def get_counters(prefix=""):
+    """ Returns a copy of all counters whose names start with prefix. """
+    with _counters_lock:
+        return {name: value for name, value in _counters.iteritems() if name.startswith(prefix)}
+
+
+def hit_rate(prefix):
+    """ Returns the ratio of prefix.hit to prefix.hit + prefix.miss, None if neither has happened. """
+    with _counters_lock:
+        hits = _counters[prefix + ".hit"]
+        total = hits + _counters[prefix + ".miss"]
+    return float(hits) / total if total else None
+
+
+def reset_counters():
+    with _counters_lock:
+        _counters.clear()
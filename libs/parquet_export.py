@@ -0,0 +1,170 @@
+from io import BytesIO
+
+from config.constants import PARQUET_FILE_MAX_BYTES
+
+# pyarrow is optional, it is only needed for Parquet downloads (output_format=parquet in get-data).
+try:
+    import pyarrow
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
+
+# Chunks of a participant's data stream are converted to Parquet, each chunk (an hour of data) is
+# a row group.  The timestamp is an int64 column, a column is float64 if every value of it in the
+# first chunk of the file is a number, otherwise it is a string column (Parquet dictionary-encodes
+# strings, readers can load them as categoricals).  The "UTC time" column is left out, it is the
+# timestamp as a string.
+# A data stream is split into several files (name.parquet, name.part2.parquet, ...) when its file
+# reaches PARQUET_FILE_MAX_BYTES, a file is held in memory until it is complete, and when a chunk
+# doesn't fit the columns of its file: a numeric column has a value that is not a number, or the
+# chunk has a new column.  (The columns of a data stream have changed between app versions.)
+# A column that was a string column stays one in the following files.
+
+DROPPED_COLUMNS = ("UTC time",)
+INT64 = "int64"
+FLOAT64 = "float64"
+STRING = "string"
+
+
+def parquet_available():
+    return pyarrow is not None
+
+
+def parse_chunk(chunk_contents):
+    """ Returns the column names and the columns (lists of strings) of a chunk. """
+    lines = chunk_contents.splitlines()
+    if not lines:
+        return [], []
+    header = lines[0].split(",")
+    keep = [index for index, name in enumerate(header) if name not in DROPPED_COLUMNS]
+    columns = [[] for _ in keep]
+    for line in lines[1:]:
+        row = line.split(",")
+        for column, index in zip(columns, keep):
+            column.append(row[index] if index < len(row) else "")
+    return [header[index] for index in keep], columns
+
+
+def column_type(name, values):
+    if name == "timestamp":
+        return INT64
+    for value in values:
+        if value:
+            try:
+                float(value)
+            except ValueError:
+                return STRING
+    return FLOAT64
+
+
+def convert_column(values, value_type):
+    """ Converts string values to the column's type, empty values are None. """
+    if value_type == STRING:
+        return values
+    convert = int if value_type == INT64 else float
+    return [convert(value) if value else None for value in values]
+
+
+def chunk_fits(names, types, chunk_names, chunk_columns):
+    """ Returns whether the columns of a chunk can be written to a file of the given columns
+    without losing values. """
+    if not set(chunk_names) <= set(names):
+        return False
+    columns_by_name = dict(zip(chunk_names, chunk_columns))
+    for name, value_type in zip(names, types):
+        if value_type != STRING and name in columns_by_name:
+            try:
+                convert_column(columns_by_name[name], value_type)
+            except ValueError:
+                return False
+    return True
+
+
+def part_file_name(file_name, part):
+    """ The name of a part of a data stream's Parquet file, the first part is the file name. """
+    if part == 1:
+        return file_name
+    return "%s.part%s.parquet" % (file_name[:-len(".parquet")], part)
+
+
+class ParquetFileBuilder(object):
+    """ Builds a Parquet file from chunks, the column types are those of the first chunk (columns
+    in string_columns are always strings).  Check that a chunk fits with fits before adding it. """
+
+    def __init__(self, string_columns=()):
+        self.output = BytesIO()
+        self.writer = None
+        self.names = None
+        self.types = None
+        self.string_columns = set(string_columns)
+
+    def fits(self, names, columns):
+        return self.writer is None or chunk_fits(self.names, self.types, names, columns)
+
+    def size(self):
+        return self.output.tell()
+
+    def add_columns(self, names, columns):
+        if self.writer is None:
+            self.names = names
+            self.types = [
+                STRING if name in self.string_columns else column_type(name, values)
+                for name, values in zip(names, columns)
+            ]
+            self.schema = pyarrow.schema([
+                pyarrow.field(name, arrow_type(value_type)) for name, value_type in zip(self.names, self.types)
+            ])
+            self.writer = pyarrow.parquet.ParquetWriter(self.output, self.schema)
+
+        # (columns missing from the chunk are empty)
+        columns_by_name = dict(zip(names, columns))
+        row_count = len(columns[0])
+        arrays = [
+            pyarrow.array(convert_column(columns_by_name.get(name, [""] * row_count), value_type),
+                          type=arrow_type(value_type))
+            for name, value_type in zip(self.names, self.types)
+        ]
+        self.writer.write_table(pyarrow.Table.from_arrays(arrays, schema=self.schema))
+
+    def finish(self):
+        """ Returns the Parquet file, or None if no chunk had rows. """
+        if self.writer is None:
+            return None
+        self.writer.close()
+        return self.output.getvalue()
+
+
+class ParquetStreamBuilder(object):
+    """ Builds the Parquet files of a data stream (see the top of this file), add the chunks in
+    time order.  add_chunk and finish return a completed file as a tuple of (file name, Parquet
+    file), or None. """
+
+    def __init__(self, file_name):
+        self.file_name = file_name
+        self.part = 1
+        self.builder = ParquetFileBuilder()
+
+    def add_chunk(self, chunk_contents):
+        names, columns = parse_chunk(chunk_contents)
+        if not names or not columns[0]:
+            return None
+        completed = None
+        if not self.builder.fits(names, columns) or self.builder.size() >= PARQUET_FILE_MAX_BYTES:
+            completed = self.finish()
+            string_columns = [
+                name for name, value_type in zip(self.builder.names, self.builder.types) if value_type == STRING
+            ]
+            self.part += 1
+            self.builder = ParquetFileBuilder(string_columns)
+        self.builder.add_columns(names, columns)
+        return completed
+
+    def finish(self):
+        parquet_file = self.builder.finish()
+        if parquet_file is None:
+            return None
+        return part_file_name(self.file_name, self.part), parquet_file
+
+
+def arrow_type(value_type):
+    return {INT64: pyarrow.int64, FLOAT64: pyarrow.float64, STRING: pyarrow.string}[value_type]()
@@ -0,0 +1,52 @@
+from datetime import datetime
+
+from config.constants import API_TIME_FORMAT
+
+# Chunks are csv files of an hour of a data stream, their first column is the unix millisecond
+# timestamp of the row.  The data access API can return only the rows of a time range, and only
+# some of the columns, of the chunks of a query, see data_access_api.get_data_rows.
+
+MILLISECOND_TIME_FORMAT = API_TIME_FORMAT + ".%f"
+EPOCH = datetime(1970, 1, 1)
+
+
+def parse_millisecond_time(time_string):
+    """ Parses API_TIME_FORMAT with optional fractional seconds into unix milliseconds, raises
+    ValueError. """
+    time_format = MILLISECOND_TIME_FORMAT if "." in time_string else API_TIME_FORMAT
+    delta = datetime.strptime(time_string, time_format) - EPOCH
+    return (delta.days * 86400 + delta.seconds) * 1000 + delta.microseconds // 1000
+
+
+def slice_chunk(chunk_contents, start_ms, end_ms, columns=None):
+    """ Returns the header (a list of column names) of a chunk and its lines with a timestamp in
+    [start_ms, end_ms), projected to the named columns if columns are provided.  A column the chunk
+    doesn't have is empty. """
+    lines = chunk_contents.splitlines()
+    if not lines:
+        return [], []
+    header = lines[0].split(",")
+    column_indexes = project_columns(header, columns) if columns else None
+    sliced_lines = []
+    for line in lines[1:]:
+        timestamp = line[:line.find(",")] if "," in line else line
+        try:
+            timestamp = int(timestamp)
+        except ValueError:
+            continue
+        if start_ms <= timestamp < end_ms:
+            if column_indexes is not None:
+                line = project_line(line, column_indexes)
+            sliced_lines.append(line)
+    return header, sliced_lines
+
+
+def project_columns(header, columns):
+    """ Returns the index in header of each of the columns, None for missing columns. """
+    positions = {name: index for index, name in enumerate(header)}
+    return [positions.get(name) for name in columns]
+
+
+def project_line(line, column_indexes):
+    row = line.split(",")
+    return ",".join(row[index] if index is not None and index < len(row) else "" for index in column_indexes)
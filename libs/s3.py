@@ -1,10 +1,13 @@
 import boto3
 
-from config.constants import DEFAULT_S3_RETRIES
+from config.constants import DEFAULT_S3_RETRIES, RAW_UPLOADS_FOLDER
 from config.settings import (S3_BUCKET, BEIWE_SERVER_AWS_ACCESS_KEY_ID,
     BEIWE_SERVER_AWS_SECRET_ACCESS_KEY, S3_REGION_NAME)
 from libs import encryption
 
+# Parts of a multipart upload must be at least 5MB, except the last one.
+S3_MULTIPART_PART_SIZE = 8 * 1024 * 1024
+
 conn = boto3.client('s3',
                     aws_access_key_id=BEIWE_SERVER_AWS_ACCESS_KEY_ID,
                     aws_secret_access_key=BEIWE_SERVER_AWS_SECRET_ACCESS_KEY,
@@ -18,6 +21,46 @@ def s3_upload(key_path, data_string, study_object_id, raw_path=False):
     conn.put_object(Body=data, Bucket=S3_BUCKET, Key=key_path, ContentType='string')
 
 
+def s3_upload_stream(key_path, data_pieces, study_object_id, raw_path=False):
+    """ Encrypts and uploads an iterable of strings as one file in a multipart upload, only about
+    a part is held in memory.  Returns the (unencrypted) size of the file. """
+    if not raw_path:
+        key_path = study_object_id + "/" + key_path
+    iv, cipher = encryption.server_encryptor(study_object_id)
+    upload_id = conn.create_multipart_upload(Bucket=S3_BUCKET, Key=key_path, ContentType='string')['UploadId']
+    parts = []
+    buffered = [iv]
+    buffered_size = len(iv)
+    file_size = 0
+    
+    def upload_part(body):
+        part_number = len(parts) + 1
+        response = conn.upload_part(
+            Body=body, Bucket=S3_BUCKET, Key=key_path, PartNumber=part_number, UploadId=upload_id
+        )
+        parts.append({"ETag": response["ETag"], "PartNumber": part_number})
+    
+    try:
+        for data in data_pieces:
+            file_size += len(data)
+            data = cipher.encrypt(data)
+            buffered.append(data)
+            buffered_size += len(data)
+            if buffered_size >= S3_MULTIPART_PART_SIZE:
+                upload_part("".join(buffered))
+                buffered = []
+                buffered_size = 0
+        if buffered or not parts:
+            upload_part("".join(buffered))
+        conn.complete_multipart_upload(
+            Bucket=S3_BUCKET, Key=key_path, UploadId=upload_id, MultipartUpload={"Parts": parts}
+        )
+    except Exception:
+        conn.abort_multipart_upload(Bucket=S3_BUCKET, Key=key_path, UploadId=upload_id)
+        raise
+    return file_size
+
+
 def s3_retrieve(key_path, study_object_id, raw_path=False, number_retries=DEFAULT_S3_RETRIES):
     """ Takes an S3 file path (key_path), and a study ID.  Takes an optional argument, raw_path,
     which defaults to false.  When set to false the path is prepended to place the file in the
@@ -28,14 +71,26 @@ def s3_retrieve(key_path, study_object_id, raw_path=False, number_retries=DEFAUL
     return encryption.decrypt_server(encrypted_data, study_object_id)
 
 
-def _do_retrieve(bucket_name, key_path, number_retries=DEFAULT_S3_RETRIES):
+def s3_retrieve_range(key_path, study_object_id, start, stop, raw_path=False, number_retries=DEFAULT_S3_RETRIES):
+    """ Like s3_retrieve, but returns only the bytes from start up to (not including) stop of the
+    decrypted file.  Only that range (and the 16 bytes before it) is retrieved from S3. """
+    if not raw_path:
+        key_path = study_object_id + "/" + key_path
+    # byte i of the file is encrypted at position 16 + i, after the iv.
+    encrypted_data = _do_retrieve(
+        S3_BUCKET, key_path, number_retries=number_retries, Range="bytes=%s-%s" % (start, stop + 15)
+    )['Body'].read()
+    return encryption.decrypt_server(encrypted_data, study_object_id)
+
+
+def _do_retrieve(bucket_name, key_path, number_retries=DEFAULT_S3_RETRIES, **kwargs):
     """ Run-logic to do a data retrieval for a file in an S3 bucket."""
     try:
-        return conn.get_object(Bucket=bucket_name, Key=key_path, ResponseContentType='string')
+        return conn.get_object(Bucket=bucket_name, Key=key_path, ResponseContentType='string', **kwargs)
     except Exception:
         if number_retries > 0:
             print("s3_retrieve failed, retrying on %s" % key_path)
-            return _do_retrieve(bucket_name, key_path, number_retries=number_retries - 1)
+            return _do_retrieve(bucket_name, key_path, number_retries=number_retries - 1, **kwargs)
         
         raise
 
@@ -72,6 +127,22 @@ def _do_list_files_generator(page_iterator):
 def s3_delete(key_path):
     raise Exception("NO DONT DELETE")
 
+
+def s3_delete_raw_upload(key_path):
+    """ Deletes the raw data of a deferred upload once it has been decrypted.  Unlike the rest of
+    the bucket, these files are only temporary, anything else is refused (see s3_delete). """
+    if not key_path.startswith(RAW_UPLOADS_FOLDER + "/"):
+        raise Exception("%s is not a raw upload, not deleting it." % key_path)
+    conn.delete_object(Bucket=S3_BUCKET, Key=key_path)
+
+
+def s3_delete_data_export(key_path):
+    """ Deletes the archive of an expired data export (study_object_id/exports/file_name), see
+    libs.data_exports.  Anything else is refused. """
+    if key_path.split("/")[1:2] != ["exports"]:
+        raise Exception("%s is not a data export, not deleting it." % key_path)
+    conn.delete_object(Bucket=S3_BUCKET, Key=key_path)
+
 ################################################################################
 ######################### Client Key Management ################################
 ################################################################################
@@ -0,0 +1,132 @@
+import tarfile
+import time
+import zlib
+from collections import namedtuple
+from zipfile import ZIP64_LIMIT, ZIP_DEFLATED, ZIP_STORED, LargeZipFile, ZipFile, ZipInfo, crc32
+
+from libs.streaming_bytes_io import StreamingBytesIO
+
+# Data downloads are streamed as an archive of the files, file by file.  Compressing a file is
+# done by encode_file, which is safe to call on the threads that fetch the files, and the encoded
+# files are written to the archive in the order the response generator receives them.
+# A zip entry is compressed independently of the rest of the zip.  A tar.gz is written as a gzip
+# member per file (a gzip stream can be a concatenation of members), so the files of a tar.gz
+# are compressed independently too.
+
+ZIP_ARCHIVE = "zip"
+DEFLATED_ZIP_ARCHIVE = "zip_deflate"
+TAR_GZ_ARCHIVE = "tar.gz"
+ARCHIVE_FORMATS = (ZIP_ARCHIVE, DEFLATED_ZIP_ARCHIVE, TAR_GZ_ARCHIVE)
+
+COMPRESSION_LEVEL = 6
+
+EncodedFile = namedtuple("EncodedFile", ["file_name", "data", "file_size", "crc"])
+
+
+def create_streaming_archive(archive_format):
+    if archive_format == ZIP_ARCHIVE:
+        return StreamingZip(compression=ZIP_STORED)
+    if archive_format == DEFLATED_ZIP_ARCHIVE:
+        return StreamingZip(compression=ZIP_DEFLATED)
+    if archive_format == TAR_GZ_ARCHIVE:
+        return StreamingTarGz()
+    raise ValueError("unknown archive format %s" % archive_format)
+
+
+def archive_file_extension(archive_format):
+    return "tar.gz" if archive_format == TAR_GZ_ARCHIVE else "zip"
+
+
+def archive_mimetype(archive_format):
+    # Oddly, it is the presence of mimetype=zip that causes the streaming response to actually stream.
+    return "application/gzip" if archive_format == TAR_GZ_ARCHIVE else "zip"
+
+
+class StreamingArchive(object):
+    """ Usage: add encoded files with add_encoded_file (or add_file), read() returns (and forgets)
+    the bytes of the archive written since the last read, close() returns the remaining bytes. """
+
+    def __init__(self):
+        self.output = StreamingBytesIO()
+
+    def encode_file(self, file_name, contents):
+        raise NotImplementedError
+
+    def add_encoded_file(self, encoded_file):
+        raise NotImplementedError
+
+    def add_file(self, file_name, contents):
+        self.add_encoded_file(self.encode_file(file_name, contents))
+
+    def read(self):
+        data = self.output.getvalue()
+        self.output.empty()
+        return data
+
+    def close(self):
+        raise NotImplementedError
+
+
+class StreamingZip(StreamingArchive):
+
+    def __init__(self, compression=ZIP_STORED):
+        super(StreamingZip, self).__init__()
+        self.compression = compression
+        self.zip_file = ZipFile(self.output, mode="w", compression=compression, allowZip64=True)
+
+    def encode_file(self, file_name, contents):
+        if self.compression == ZIP_DEFLATED:
+            compressor = zlib.compressobj(COMPRESSION_LEVEL, zlib.DEFLATED, -15)
+            data = compressor.compress(contents) + compressor.flush()
+        else:
+            data = contents
+        return EncodedFile(file_name, data, len(contents), crc32(contents) & 0xffffffff)
+
+    def add_encoded_file(self, encoded_file):
+        # This is ZipFile.writestr, with the compression (and crc) already done by encode_file.
+        zinfo = ZipInfo(filename=encoded_file.file_name, date_time=time.localtime(time.time())[:6])
+        zinfo.compress_type = self.compression
+        zinfo.external_attr = 0o600 << 16
+        zinfo.file_size = encoded_file.file_size
+        zinfo.compress_size = len(encoded_file.data)
+        zinfo.CRC = encoded_file.crc
+        zinfo.header_offset = self.output.tell()
+        self.zip_file._writecheck(zinfo)
+        self.zip_file._didModify = True
+        zip64 = zinfo.file_size > ZIP64_LIMIT or zinfo.compress_size > ZIP64_LIMIT
+        if zip64 and not self.zip_file._allowZip64:
+            raise LargeZipFile("Filesize would require ZIP64 extensions")
+        self.output.write(zinfo.FileHeader(zip64))
+        self.output.write(encoded_file.data)
+        self.zip_file.filelist.append(zinfo)
+        self.zip_file.NameToInfo[zinfo.filename] = zinfo
+
+    def close(self):
+        self.zip_file.close()
+        return self.read()
+
+
+class StreamingTarGz(StreamingArchive):
+
+    def encode_file(self, file_name, contents):
+        tar_info = tarfile.TarInfo(file_name)
+        tar_info.size = len(contents)
+        tar_info.mtime = int(time.time())
+        tar_info.mode = 0o600
+        remainder = len(contents) % tarfile.BLOCKSIZE
+        padding = tarfile.NUL * (tarfile.BLOCKSIZE - remainder) if remainder else ""
+        tar_entry = tar_info.tobuf(format=tarfile.PAX_FORMAT) + contents + padding
+        return EncodedFile(file_name, gzip_member(tar_entry), len(contents), None)
+
+    def add_encoded_file(self, encoded_file):
+        self.output.write(encoded_file.data)
+
+    def close(self):
+        # the end of a tar archive is two empty blocks.
+        self.output.write(gzip_member(tarfile.NUL * tarfile.BLOCKSIZE * 2))
+        return self.read()
+
+
+def gzip_member(data):
+    compressor = zlib.compressobj(COMPRESSION_LEVEL, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    return compressor.compress(data) + compressor.flush()
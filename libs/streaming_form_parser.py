@@ -0,0 +1,116 @@
+from tempfile import SpooledTemporaryFile
+from urllib import unquote_plus
+
+from werkzeug.datastructures import FileStorage, MultiDict
+from werkzeug.exceptions import RequestEntityTooLarge
+from werkzeug.formparser import exhaust_stream, FormDataParser
+
+from config.constants import UPLOAD_MAX_SIZE, UPLOAD_MEMORY_BUFFER_SIZE
+
+# bytes read from the request body at a time
+READ_SIZE = 64 * 1024
+
+
+class StreamingFormDataParser(FormDataParser):
+    """
+    A FormDataParser for device uploads.  The werkzeug url-encoded form parser reads the entire body
+    into memory and then decodes it, making several copies of the file contents.  This parser reads
+    the body a block at a time, the fields in STREAMED_FIELDS are decoded as they are read into a
+    temporary file (which stays in memory up to UPLOAD_MEMORY_BUFFER_SIZE) and are provided in
+    request.files instead of request.form.
+    Request bodies larger than UPLOAD_MAX_SIZE are rejected with a 413.
+    """
+    STREAMED_FIELDS = ("file",)
+
+    def parse(self, stream, mimetype, content_length, options=None):
+        if content_length is not None and content_length > UPLOAD_MAX_SIZE:
+            raise RequestEntityTooLarge()
+        return super(StreamingFormDataParser, self).parse(stream, mimetype, content_length, options)
+
+    @exhaust_stream
+    def _parse_streaming_urlencoded(self, stream, mimetype, content_length, options):
+        # (self.cls is usually an immutable MultiDict, the fields are collected in mutable ones)
+        form, files = MultiDict(), MultiDict()
+        field = _FormField(self)
+        bytes_read = 0
+
+        while True:
+            block = stream.read(READ_SIZE)
+            if not block:
+                break
+            bytes_read += len(block)
+            if bytes_read > UPLOAD_MAX_SIZE:
+                raise RequestEntityTooLarge()
+
+            pieces = block.split("&")
+            for piece in pieces[:-1]:
+                field.feed(piece)
+                field.finish(form, files)
+                field = _FormField(self)
+            field.feed(pieces[-1])
+
+        field.finish(form, files)
+        return stream, self.cls(form), self.cls(files)
+
+    parse_functions = dict(FormDataParser.parse_functions)
+    parse_functions.update({
+        'application/x-www-form-urlencoded': _parse_streaming_urlencoded,
+        'application/x-url-encoded': _parse_streaming_urlencoded,
+    })
+
+
+class _FormField(object):
+    """ A url-encoded form field that is being read, fed in pieces. """
+
+    def __init__(self, parser):
+        self.parser = parser
+        self.name = None
+        self.name_pieces = []
+        self.value_pieces = []
+        self.value_file = None
+        self.undecoded = ""
+
+    def feed(self, piece):
+        if self.name is None:
+            equals_index = piece.find("=")
+            if equals_index == -1:
+                self.name_pieces.append(piece)
+                return
+            self.name_pieces.append(piece[:equals_index])
+            self.name = self.decode("".join(self.name_pieces))
+            piece = piece[equals_index + 1:]
+            if self.name in StreamingFormDataParser.STREAMED_FIELDS:
+                self.value_file = SpooledTemporaryFile(max_size=UPLOAD_MEMORY_BUFFER_SIZE)
+
+        if self.value_file is None:
+            self.value_pieces.append(piece)
+            return
+
+        # a percent escape may be split across pieces, the incomplete end is decoded with the
+        # next piece.
+        data = self.undecoded + piece
+        escape_index = data.rfind("%", max(0, len(data) - 2))
+        if escape_index == -1:
+            self.undecoded = ""
+        else:
+            data, self.undecoded = data[:escape_index], data[escape_index:]
+        self.value_file.write(unquote_plus(data))
+
+    def finish(self, form, files):
+        if self.name is None:
+            # a field without a value, or an empty piece (e.g. a trailing "&")
+            name = self.decode("".join(self.name_pieces))
+            if name:
+                form.add(name, u"")
+            return
+
+        if self.value_file is None:
+            form.add(self.name, self.decode("".join(self.value_pieces)))
+            return
+
+        self.value_file.write(unquote_plus(self.undecoded))
+        self.value_file.seek(0)
+        files.add(self.name, FileStorage(stream=self.value_file, name=self.name))
+
+    def decode(self, value):
+        return unquote_plus(value).decode(self.parser.charset, self.parser.errors)
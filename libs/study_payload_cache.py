@@ -0,0 +1,68 @@
+import json
+from hashlib import sha1
+from threading import Lock
+
+from django.db.models import Count, Max
+
+from database.study_models import DeviceSettings, Survey
+from libs.metrics import increment_counter
+
+# Devices poll for their study's surveys, and receive its device settings at registration.  The
+# serialized payloads are cached here per process.  Every use of a cached payload is validated
+# with a cheap query for the version (last update time and number of surveys) of the data it was
+# built from, so an edit made in another server process is seen immediately.  Saves in this
+# process also drop the study's payloads, see database.signals.
+
+_cache = {}
+_cache_lock = Lock()
+
+
+def get_surveys_payload(study, requesting_os):
+    """ Returns the json list of surveys the study's devices on requesting_os receive, and a hash
+    of it to be used as an ETag. """
+    key = ("surveys", study.id, requesting_os)
+    version = Survey.objects.filter(study_id=study.id).aggregate(
+        last_updated=Max("last_updated"), count=Count("id")
+    )
+    cached = _get(key, version)
+    if cached is not None:
+        return cached
+
+    payload = json.dumps(study.get_surveys_for_study(requesting_os=requesting_os))
+    cached = (payload, sha1(payload).hexdigest())
+    _set(key, version, cached)
+    return cached
+
+
+def get_device_settings_payload(study):
+    """ Returns the study's device settings as sent to devices at registration. """
+    key = ("device_settings", study.id)
+    version = DeviceSettings.objects.filter(study_id=study.id).values_list("last_updated", flat=True).get()
+    cached = _get(key, version)
+    if cached is None:
+        cached = study.device_settings.as_native_python()
+        cached.pop('_id', None)
+        _set(key, version, cached)
+    # (the caller may modify it)
+    return dict(cached)
+
+
+def invalidate_study_payloads(study_id):
+    with _cache_lock:
+        for key in [key for key in _cache if key[1] == study_id]:
+            del _cache[key]
+
+
+def _get(key, version):
+    with _cache_lock:
+        cached = _cache.get(key)
+    if cached is not None and cached[0] == version:
+        increment_counter("study_payload_cache.hit")
+        return cached[1]
+    increment_counter("study_payload_cache.miss")
+    return None
+
+
+def _set(key, version, value):
+    with _cache_lock:
+        _cache[key] = (version, value)
@@ -0,0 +1,40 @@
+from math import isinf, isnan
+
+from database.data_access_models import SurveyAnswer
+from libs.graph_data import csv_to_dict
+
+# Survey answers files are not chunked, but their answers are indexed in the database when they
+# are processed (see file_processing.do_process_user_file_chunks), so that the participant graph
+# and data access API queries don't have to read the files.  (scripts/index_survey_answers.py
+# indexes the files processed before the index existed.)
+
+
+def index_survey_answers(participant_id, survey_id, answered_at, file_contents):
+    """ Replaces the indexed answers of a survey answers file with its answers. """
+    rows = csv_to_dict(file_contents) if file_contents.strip() else []
+    answers = [
+        SurveyAnswer(
+            participant_id=participant_id,
+            survey_id=survey_id,
+            question_id=row.get('question id', ''),
+            question_text=row.get('question text', ''),
+            answered_at=answered_at,
+            answer=row.get('answer', ''),
+            numeric_answer=numeric_answer(row.get('answer', '')),
+        )
+        for row in rows if 'question id' in row
+    ]
+    # (a file can be processed more than once)
+    SurveyAnswer.objects.filter(participant_id=participant_id, survey_id=survey_id, answered_at=answered_at).delete()
+    SurveyAnswer.objects.bulk_create(answers)
+    return len(answers)
+
+
+def numeric_answer(answer):
+    try:
+        value = float(answer)
+    except ValueError:
+        return None
+    if isnan(value) or isinf(value):
+        return None
+    return value
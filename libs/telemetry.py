@@ -0,0 +1,97 @@
+import atexit
+from collections import defaultdict
+from threading import Event, Lock, Thread
+
+from django.core.exceptions import ValidationError
+from django.db import connection
+
+from config.constants import (TELEMETRY_BUFFER_CAPACITY, TELEMETRY_FLUSH_SECONDS, TELEMETRY_FLUSH_SIZE,
+    TELEMETRY_WRITE_BEHIND)
+from libs.metrics import increment_counter
+from libs.volume_rollups import roll_up_uploads
+
+# Upload bookkeeping (UploadTracking) and decryption error records (LineEncryptionError,
+# EncryptionErrorMetadata) are not read back by the code that creates them.  When
+# TELEMETRY_WRITE_BEHIND is enabled they are buffered in memory and written in bulk by a
+# background thread instead of being saved one at a time inside the upload request.
+# Records that do not fit in the buffer are dropped and counted.  The buffer is flushed when the
+# process exits normally, records are lost if the process is killed.
+# The daily data volume rollups are updated from the UploadTracking records when they are saved,
+# see libs.volume_rollups.
+
+
+class TelemetrySink(object):
+
+    def __init__(self, capacity, flush_size, flush_seconds):
+        self.capacity = capacity
+        self.flush_size = flush_size
+        self.flush_seconds = flush_seconds
+        self.buffer = []
+        self.lock = Lock()
+        self.flush_requested = Event()
+        self.thread = None
+
+    def add(self, instance):
+        """ Buffers a model instance to be saved, never touches the database. """
+        with self.lock:
+            if len(self.buffer) >= self.capacity:
+                increment_counter("telemetry.dropped")
+                return
+            self.buffer.append(instance)
+            if len(self.buffer) >= self.flush_size:
+                self.flush_requested.set()
+            if self.thread is None:
+                self._start_thread()
+
+    def flush(self):
+        """ Saves all buffered instances, with one bulk_create per model.  Instances are validated
+        here (AbstractModel.save would have done it), invalid instances are dropped. """
+        with self.lock:
+            instances, self.buffer = self.buffer, []
+
+        instances_by_model = defaultdict(list)
+        for instance in instances:
+            try:
+                instance.full_clean()
+            except ValidationError as e:
+                print("dropping invalid %s: %s" % (instance.__class__.__name__, e))
+                increment_counter("telemetry.invalid")
+                continue
+            instances_by_model[instance.__class__].append(instance)
+
+        for model, model_instances in instances_by_model.iteritems():
+            model.objects.bulk_create(model_instances)
+            increment_counter("telemetry.written", len(model_instances))
+        roll_up_uploads([instance for model_instances in instances_by_model.itervalues() for instance in model_instances])
+
+    def _start_thread(self):
+        self.thread = Thread(target=self._run, name="telemetry_sink")
+        self.thread.daemon = True
+        self.thread.start()
+        atexit.register(self.flush)
+
+    def _run(self):
+        while True:
+            self.flush_requested.wait(self.flush_seconds)
+            self.flush_requested.clear()
+            try:
+                self.flush()
+            except Exception as e:
+                # the records are lost, the thread must continue.
+                print("telemetry flush failed: %s" % e)
+                increment_counter("telemetry.flush_error")
+            finally:
+                # this thread has its own database connection, don't hold it open between flushes.
+                connection.close()
+
+
+telemetry_sink = TelemetrySink(TELEMETRY_BUFFER_CAPACITY, TELEMETRY_FLUSH_SIZE, TELEMETRY_FLUSH_SECONDS)
+
+
+def record_telemetry(instance):
+    """ Saves an unsaved model instance, or buffers it when TELEMETRY_WRITE_BEHIND is enabled. """
+    if TELEMETRY_WRITE_BEHIND:
+        telemetry_sink.add(instance)
+    else:
+        instance.save()
+        roll_up_uploads([instance])
@@ -0,0 +1,283 @@
+from datetime import timedelta
+from hashlib import sha1
+
+from django.core.exceptions import ValidationError
+from django.db import IntegrityError
+from django.db.models import F, Q
+from django.utils import timezone
+
+from config.constants import (ALLOWED_EXTENSIONS, PENDING_UPLOAD_CLAIM_SECONDS, PENDING_UPLOAD_MAX_ATTEMPTS,
+    PENDING_UPLOAD_PAGE_SIZE, RAW_UPLOADS_FOLDER, UPLOAD_FINGERPRINT_RETENTION_DAYS)
+from database.data_access_models import DataFreshness, FileToProcess, PendingUpload
+from database.profiling_models import DecryptionKeyError, UploadFingerprint, UploadTracking
+from database.user_models import Participant
+from libs.encryption import decrypt_device_file, DecryptionKeyInvalidError, HandledError
+from libs.logging import log_error
+from libs.metrics import increment_counter
+from libs.s3 import get_client_private_key, s3_delete_raw_upload, s3_retrieve, s3_upload
+from libs.sentry import make_sentry_client
+from libs.telemetry import record_telemetry
+from libs.upload_spool import spool_upload
+from libs.volume_rollups import upload_data_type
+
+
+################################################################################
+########################## FILE NAME FUNCTIONALITY #############################
+################################################################################
+
+
+def grab_file_extension(file_name):
+    """ grabs the chunk of text after the final period. """
+    return file_name.rsplit('.', 1)[1]
+
+
+def contains_valid_extension(file_name):
+    """ Checks if string has a recognized file extension, this is not necessarily limited to 4 characters. """
+    return '.' in file_name and grab_file_extension(file_name) in ALLOWED_EXTENSIONS
+
+
+################################################################################
+############################ Upload Handling ###################################
+################################################################################
+
+# Uploaded files are either strings or, when the request body was streamed, file objects (see
+# libs.streaming_form_parser).  File objects are left at position 0 after being read.
+UPLOAD_READ_SIZE = 64 * 1024
+
+
+def read_upload(uploaded_file):
+    """ Returns the contents of an uploaded file as a string. """
+    if isinstance(uploaded_file, basestring):
+        return uploaded_file
+    contents = uploaded_file.read()
+    uploaded_file.seek(0)
+    return contents
+
+
+def upload_size(uploaded_file):
+    if isinstance(uploaded_file, basestring):
+        return len(uploaded_file)
+    uploaded_file.seek(0, 2)
+    size = uploaded_file.tell()
+    uploaded_file.seek(0)
+    return size
+
+
+
+def decrypt_and_register_upload(participant, file_name, uploaded_file, private_key, app_version=None,
+                                uploaded_on=None):
+    """ Decrypts a device upload (a string or a file object) and registers it for data processing.
+    app_version and uploaded_on are recorded in the data freshness, see register_decrypted_upload.
+
+    Returns True if the upload has been handled and the device should delete the file (a 200
+    response), this includes files that do not decrypt.  Returns False if the upload is invalid
+    and the device should try again later (a 400 response), administrators are notified.
+    Any raised error is a server error (a 500 response). """
+    patient_id = participant.patient_id
+    try:
+        uploaded_file = decrypt_device_file(patient_id, uploaded_file, private_key, participant, file_name)
+    except HandledError as e:
+        # when decrypting fails, regardless of why, we rely on the decryption code
+        # to log it correctly and return 200 OK to get the device to delete the file.
+        # We do not want emails on these types of errors, so we use log_error explicitly.
+        print("the following error was handled:")
+        log_error(e, "%s; %s; %s" % (patient_id, file_name, e.message))
+        return True
+    # This is what the decryption failure mode SHOULD be, but we are still identifying the decryption bug
+    except DecryptionKeyInvalidError:
+        tags = {
+            "participant": patient_id,
+            "operating system": "ios" if participant.os_type == Participant.IOS_API else "android",
+            "DecryptionKeyError id": str(DecryptionKeyError.objects.last().id),
+            "file_name": file_name,
+        }
+        make_sentry_client('eb', tags).captureMessage("DecryptionKeyInvalidError")
+        return True
+
+    # if uploaded data a) actually exists, B) is validly named and typed...
+    if uploaded_file and file_name and contains_valid_extension(file_name):
+        register_decrypted_upload(participant, file_name, uploaded_file, app_version, uploaded_on)
+        return True
+
+    if not uploaded_file:
+        # it appears that occasionally the app creates some spurious files
+        # with a name like "rList-org.beiwe.app.LoadingActivity"
+        error_message = "an upload has failed " + patient_id + ", " + file_name + ", "
+        error_message += "there was no/an empty file, returning 200 OK so device deletes bad file."
+        log_error(Exception("upload error"), error_message)
+        return True
+
+    report_invalid_upload(patient_id, file_name)
+    return False
+
+
+def register_decrypted_upload(participant, file_name, file_contents, app_version=None, uploaded_on=None):
+    """ Stores the decrypted contents of an upload on S3, queues it for data processing and
+    records the upload in the data freshness of its data stream (uploaded_on defaults to now).
+    This is safe to repeat for the same upload, the upload is only tracked (see UploadTracking)
+    when it is queued, so that repeats are not counted in the upload stats. """
+    s3_file_path = file_name.replace("_", "/")
+    study_object_id = participant.study.object_id
+    s3_upload(s3_file_path, file_contents, study_object_id)
+    spool_upload(study_object_id + "/" + s3_file_path, file_contents, study_object_id)
+    newly_queued = FileToProcess.append_file_for_processing(s3_file_path, study_object_id, participant=participant)
+    record_upload_freshness(participant, file_name, app_version, uploaded_on)
+    if not newly_queued:
+        return
+    record_telemetry(UploadTracking(
+        file_path=s3_file_path,
+        file_size=len(file_contents),
+        timestamp=timezone.now(),
+        participant=participant,
+    ))
+
+
+def record_upload_freshness(participant, file_name, app_version=None, uploaded_on=None):
+    """ Records the upload time (and the app version) of an upload's data stream, see
+    DataFreshness.  Files that are not of a data stream are ignored. """
+    data_type = upload_data_type(file_name.replace("_", "/"))
+    if data_type is not None:
+        DataFreshness.record_upload(participant, data_type, app_version, uploaded_on)
+
+
+def report_invalid_upload(patient_id, file_name):
+    """ Logs an upload with a missing or invalid file name and notifies Sentry. """
+    error_message = "an upload has failed " + patient_id + ", " + file_name + ", "
+    if not file_name:
+        error_message += "there was no provided file name, this is an app error."
+    elif not contains_valid_extension(file_name):
+        error_message += "contains an invalid extension, it was interpretted as "
+        error_message += grab_file_extension(file_name) if "." in file_name else "(no extension)"
+    else:
+        error_message += "AN UNKNOWN ERROR OCCURRED."
+
+    print("upload error " + error_message)
+    tags = {"upload_error": "upload error", "user_id": patient_id}
+    sentry_client = make_sentry_client('eb', tags)
+    sentry_client.captureMessage(error_message)
+
+
+################################################################################
+########################### Upload Fingerprints ################################
+################################################################################
+
+
+def upload_fingerprint(patient_id, file_name, uploaded_file):
+    """ The fingerprint of an upload, see UploadFingerprint. """
+    digest = sha1(patient_id)
+    digest.update("\0" + file_name + "\0")
+    if isinstance(uploaded_file, basestring):
+        digest.update(uploaded_file)
+    else:
+        for block in iter(lambda: uploaded_file.read(UPLOAD_READ_SIZE), ""):
+            digest.update(block)
+        uploaded_file.seek(0)
+    return digest.hexdigest()
+
+
+def is_duplicate_upload(fingerprint):
+    """ Returns True if an upload with this fingerprint has already been handled, and counts it. """
+    if UploadFingerprint.objects.filter(fingerprint=fingerprint).update(duplicate_count=F("duplicate_count") + 1):
+        increment_counter("upload.duplicate")
+        return True
+    increment_counter("upload.unique")
+    return False
+
+
+def record_upload_fingerprint(participant, fingerprint):
+    """ Marks an upload as handled, concurrent identical uploads may both have been handled. """
+    try:
+        UploadFingerprint.objects.create(fingerprint=fingerprint, participant=participant)
+    except (IntegrityError, ValidationError):
+        # (full_clean catches the unique constraint before the database does)
+        pass
+
+
+def prune_upload_fingerprints():
+    """ Devices retry uploads within days, older fingerprints are not needed. """
+    cutoff = timezone.now() - timedelta(days=UPLOAD_FINGERPRINT_RETENTION_DAYS)
+    UploadFingerprint.objects.filter(created_on__lt=cutoff).delete()
+
+
+################################################################################
+############################ Deferred Uploads ##################################
+################################################################################
+
+
+def defer_upload(participant, file_name, uploaded_file, app_version=None):
+    """ Stores the raw, still device-encrypted, upload on S3 for later decryption and creates its
+    PendingUpload.  A device re-sending a file that is already pending simply overwrites the
+    stored (identical) data. """
+    study_object_id = participant.study.object_id
+    s3_file_path = "%s/%s/%s/%s" % (RAW_UPLOADS_FOLDER, study_object_id, participant.patient_id, file_name)
+    s3_upload(s3_file_path, uploaded_file, study_object_id, raw_path=True)
+    PendingUpload.add_pending_upload(participant, file_name, s3_file_path, app_version)
+
+
+def process_pending_uploads(participant, error_handler):
+    """ Decrypts and registers up to PENDING_UPLOAD_PAGE_SIZE of a participant's deferred uploads,
+    oldest first.  Returns the number of uploads that errored.
+
+    A PendingUpload (and its raw data on S3) is only deleted after it has been fully handled,
+    uploads that error are retried on the next run (at-least-once), register_decrypted_upload is
+    safe to repeat.  Uploads that have errored PENDING_UPLOAD_MAX_ATTEMPTS times are reported and
+    no longer retried.  Uploads claimed by another (overlapping) task are skipped.  Any errors are
+    raised on the passed in error handler. """
+    private_key = None
+    number_errors = 0
+    study_object_id = participant.study.object_id
+    pending_uploads = participant.pending_uploads.filter(attempts__lt=PENDING_UPLOAD_MAX_ATTEMPTS)
+
+    for pending_upload in pending_uploads.order_by("attempts", "pk")[:PENDING_UPLOAD_PAGE_SIZE]:
+        if not claim_pending_upload(pending_upload):
+            continue
+        with error_handler:
+            try:
+                if private_key is None:
+                    # the RSA key is the same for every file, only retrieve it once.
+                    private_key = get_client_private_key(participant.patient_id, study_object_id)
+                uploaded_file = s3_retrieve(pending_upload.s3_file_path, study_object_id, raw_path=True)
+                handled = decrypt_and_register_upload(
+                    participant, pending_upload.file_name, uploaded_file, private_key,
+                    app_version=pending_upload.app_version, uploaded_on=pending_upload.created_on,
+                )
+            except Exception:
+                number_errors += 1
+                pending_upload.attempts += 1
+                pending_upload.claimed_on = None
+                pending_upload.save()
+                if pending_upload.attempts >= PENDING_UPLOAD_MAX_ATTEMPTS:
+                    report_failed_pending_upload(pending_upload)
+                raise
+
+            if not handled:
+                # Invalid uploads were rejected by the synchronous endpoint, there is no device
+                # waiting to try again.  It has been reported, drop it.
+                print("dropping invalid deferred upload %s" % pending_upload.s3_file_path)
+            pending_upload.delete()
+            s3_delete_raw_upload(pending_upload.s3_file_path)
+
+    return number_errors
+
+
+def claim_pending_upload(pending_upload):
+    """ Marks a pending upload as being decrypted by this task, returns False if another task
+    has claimed it (and its claim has not expired). """
+    now = timezone.now()
+    stale_claim = now - timedelta(seconds=PENDING_UPLOAD_CLAIM_SECONDS)
+    pending_upload.claimed_on = now
+    return bool(
+        PendingUpload.objects.filter(pk=pending_upload.pk)
+        .filter(Q(claimed_on__isnull=True) | Q(claimed_on__lt=stale_claim))
+        .update(claimed_on=now)
+    )
+
+
+def report_failed_pending_upload(pending_upload):
+    """ Notifies Sentry of a deferred upload that will no longer be retried. """
+    error_message = "deferred upload %s failed %s times, it will not be retried." % (
+        pending_upload.s3_file_path, pending_upload.attempts
+    )
+    print(error_message)
+    tags = {"upload_error": "deferred upload failed", "user_id": pending_upload.participant.patient_id}
+    make_sentry_client('data', tags).captureMessage(error_message)
@@ -0,0 +1,154 @@
+import os
+from hashlib import sha1
+from os.path import join
+from tempfile import mkstemp
+from threading import Lock
+from time import time
+
+from config.constants import UPLOAD_SPOOL_DIRECTORY, UPLOAD_SPOOL_MAX_AGE_SECONDS, UPLOAD_SPOOL_MAX_BYTES
+from libs import encryption
+from libs.metrics import get_counters, hit_rate, increment_counter
+
+# The upload spool is a size-bounded local copy of recently uploaded files.  When data processing
+# runs on the same machine that received the upload, it reads the file from the spool instead of
+# downloading it from S3.  S3 remains the source of truth, anything that goes wrong in the spool
+# is a cache miss.
+#
+# Files are stored encrypted with the study key (the same as on S3), and are written to a
+# temporary file and renamed into place so that a partial file is never read.  Temporary files
+# left behind by a crash are removed by the cleanup.
+
+SPOOL_FILE_SUFFIX = ".spool"
+TEMP_FILE_SUFFIX = ".tmp"
+# temporary files older than this were left behind by a crashed process.
+STALE_TEMP_FILE_SECONDS = 60*60
+
+_bytes_since_cleanup = None
+_cleanup_lock = Lock()
+
+
+def upload_spool_enabled():
+    return bool(UPLOAD_SPOOL_DIRECTORY)
+
+
+def _spool_file_path(s3_file_path):
+    return join(UPLOAD_SPOOL_DIRECTORY, sha1(s3_file_path).hexdigest() + SPOOL_FILE_SUFFIX)
+
+
+def spool_upload(s3_file_path, file_contents, study_object_id):
+    """ Writes a file to the spool, s3_file_path is the full (raw) S3 path of the file.
+    Never raises, a file that fails to spool will be retrieved from S3. """
+    if not upload_spool_enabled():
+        return
+
+    try:
+        data = encryption.encrypt_for_server(file_contents, study_object_id)
+        _make_room(len(data))
+        file_descriptor, temp_path = mkstemp(suffix=TEMP_FILE_SUFFIX, dir=UPLOAD_SPOOL_DIRECTORY)
+        try:
+            with os.fdopen(file_descriptor, "wb") as f:
+                f.write(data)
+            # rename is atomic, a spool file is either complete or absent.
+            os.rename(temp_path, _spool_file_path(s3_file_path))
+        except Exception:
+            _remove(temp_path)
+            raise
+    except Exception as e:
+        # (not only disk errors, e.g. the study's key can fail to load)
+        print("could not spool %s: %s" % (s3_file_path, e))
+        increment_counter("upload_spool.write_error")
+        return
+
+    increment_counter("upload_spool.write")
+
+
+def retrieve_spooled_upload(s3_file_path, study_object_id):
+    """ Returns the decrypted contents of a spooled file, or None if the file is not spooled. """
+    if not upload_spool_enabled():
+        return None
+
+    try:
+        with open(_spool_file_path(s3_file_path), "rb") as f:
+            data = f.read()
+    except (IOError, OSError):
+        increment_counter("upload_spool.miss")
+        return None
+
+    increment_counter("upload_spool.hit")
+    return encryption.decrypt_server(data, study_object_id)
+
+
+def discard_spooled_uploads(s3_file_paths):
+    """ Removes files that have been processed from the spool. """
+    if not upload_spool_enabled():
+        return
+    for s3_file_path in s3_file_paths:
+        _remove(_spool_file_path(s3_file_path))
+
+
+def upload_spool_stats():
+    """ Returns a string summarizing the spool counters of this process, for log output. """
+    rate = hit_rate("upload_spool")
+    counters = get_counters("upload_spool.")
+    return "upload spool hit rate: %s, %s" % (
+        "n/a" if rate is None else "%.1f%%" % (rate * 100),
+        ", ".join("%s: %s" % item for item in sorted(counters.items())),
+    )
+
+
+def cleanup_upload_spool():
+    """ Removes temporary files left behind by crashed processes and expired spool files, then
+    evicts the oldest spool files until the spool is within UPLOAD_SPOOL_MAX_BYTES. """
+    now = time()
+    spool_files = []
+    total_size = 0
+
+    for file_name in os.listdir(UPLOAD_SPOOL_DIRECTORY):
+        path = join(UPLOAD_SPOOL_DIRECTORY, file_name)
+        try:
+            stat = os.stat(path)
+        except OSError:
+            # removed by another process
+            continue
+
+        age = now - stat.st_mtime
+        if file_name.endswith(TEMP_FILE_SUFFIX):
+            if age > STALE_TEMP_FILE_SECONDS:
+                _remove(path)
+        elif file_name.endswith(SPOOL_FILE_SUFFIX):
+            if age > UPLOAD_SPOOL_MAX_AGE_SECONDS:
+                _remove(path)
+                increment_counter("upload_spool.expired")
+            else:
+                spool_files.append((stat.st_mtime, stat.st_size, path))
+                total_size += stat.st_size
+
+    spool_files.sort()
+    for _, size, path in spool_files:
+        if total_size <= UPLOAD_SPOOL_MAX_BYTES:
+            break
+        _remove(path)
+        total_size -= size
+        increment_counter("upload_spool.evicted")
+
+
+def _make_room(number_bytes):
+    """ Runs the cleanup the first time this process spools a file (this clears up after a crash)
+    and then every time about a tenth of the spool size has been written. """
+    global _bytes_since_cleanup
+    with _cleanup_lock:
+        if _bytes_since_cleanup is not None:
+            _bytes_since_cleanup += number_bytes
+            if _bytes_since_cleanup < UPLOAD_SPOOL_MAX_BYTES / 10:
+                return
+        elif not os.path.isdir(UPLOAD_SPOOL_DIRECTORY):
+            os.makedirs(UPLOAD_SPOOL_DIRECTORY, 0o700)
+        _bytes_since_cleanup = number_bytes
+        cleanup_upload_spool()
+
+
+def _remove(path):
+    try:
+        os.remove(path)
+    except OSError:
+        pass
@@ -0,0 +1,88 @@
+from django.core.exceptions import ValidationError
+from django.db import IntegrityError
+from django.db.models import DateTimeField, F, Value
+from django.db.models.functions import Coalesce, Greatest, Least
+from django.utils import timezone
+
+from config.constants import UPLOAD_FILE_TYPE_MAPPING
+from database.profiling_models import DataVolumeRollup, UploadTracking
+from database.user_models import Participant
+
+# Daily totals of the data of every participant's data streams (DataVolumeRollup) are kept up to
+# date as uploads are recorded (with the UploadTracking records, see libs.telemetry) and as rows
+# are chunked (see file_processing.upload_binified_data), so that stats don't scan the upload
+# and chunk tables.
+
+
+def add_to_rollup(study_id, participant_id, data_type, day, files=0, bytes=0, rows=0, first_seen=None,
+                  last_seen=None):
+    """ Adds to the rollup of a participant's data stream on a day, creating it if needed. """
+    rollup = DataVolumeRollup.objects.filter(participant_id=participant_id, data_type=data_type, day=day)
+    changes = {
+        "files": F("files") + files,
+        "bytes": F("bytes") + bytes,
+        "rows": F("rows") + rows,
+        "last_updated": timezone.now(),
+    }
+    if first_seen is not None:
+        first_seen_value = Value(first_seen, output_field=DateTimeField())
+        changes["first_seen"] = Least(Coalesce(F("first_seen"), first_seen_value), first_seen_value)
+    if last_seen is not None:
+        last_seen_value = Value(last_seen, output_field=DateTimeField())
+        changes["last_seen"] = Greatest(Coalesce(F("last_seen"), last_seen_value), last_seen_value)
+    if rollup.update(**changes):
+        return
+    try:
+        DataVolumeRollup.objects.create(
+            study_id=study_id, participant_id=participant_id, data_type=data_type, day=day,
+            files=files, bytes=bytes, rows=rows, first_seen=first_seen, last_seen=last_seen,
+        )
+    except (IntegrityError, ValidationError):
+        # (created by a concurrent update, full_clean catches the unique constraint)
+        rollup.update(**changes)
+
+
+def upload_data_type(file_path):
+    """ The data type of an uploaded file from its path, None if it is not a known data type. """
+    # (ios log uploads are named ios_log, their path is participant/ios/log...)
+    path_extraction = file_path.split("/", 2)[1] if file_path.count("/") >= 2 else ""
+    if path_extraction == "ios":
+        path_extraction = "ios_log"
+    return UPLOAD_FILE_TYPE_MAPPING.get(path_extraction)
+
+
+def roll_up_uploads(instances):
+    """ Adds the UploadTracking instances of a list of telemetry records to the rollups, one update
+    per participant, data stream and day. """
+    totals = {}
+    for instance in instances:
+        if not isinstance(instance, UploadTracking):
+            continue
+        data_type = upload_data_type(instance.file_path)
+        if data_type is None:
+            continue
+        key = (instance.participant.study_id, instance.participant_id, data_type,
+               instance.timestamp.astimezone(timezone.utc).date())
+        files, size, first_seen, last_seen = totals.get(key, (0, 0, instance.timestamp, instance.timestamp))
+        totals[key] = (files + 1, size + instance.file_size,
+                       min(first_seen, instance.timestamp), max(last_seen, instance.timestamp))
+
+    for (study_id, participant_id, data_type, day), (files, size, first_seen, last_seen) in totals.iteritems():
+        add_to_rollup(study_id, participant_id, data_type, day, files=files, bytes=size,
+                      first_seen=first_seen, last_seen=last_seen)
+
+
+def roll_up_processed_rows(row_counts):
+    """ Adds chunked rows, a dictionary of (patient_id, data type) to numbers of rows, to the
+    rollups of the current day. """
+    participants = {
+        patient_id: (participant_pk, study_pk) for patient_id, participant_pk, study_pk in
+        Participant.objects.filter(patient_id__in={patient_id for patient_id, _ in row_counts}).values_list(
+            "patient_id", "pk", "study_id"
+        )
+    }
+    day = timezone.now().astimezone(timezone.utc).date()
+    for (patient_id, data_type), rows in row_counts.iteritems():
+        participant_pk, study_pk = participants[patient_id]
+        add_to_rollup(study_pk, participant_pk, data_type, day, rows=rows)
+
@@ -1,5 +1,8 @@
 import json
+from collections import defaultdict
+from datetime import datetime, timedelta
 
+from django.db.models import Sum
 from flask import Blueprint, flash, Markup, redirect, render_template, request, \
     session, abort
 
@@ -7,13 +10,19 @@ from libs import admin_authentication
 from libs.admin_authentication import authenticate_admin_login,\
     authenticate_admin_study_access, get_admins_allowed_studies, get_admins_allowed_studies_as_query_set,\
     admin_is_system_admin
+from libs.data_coverage import daily_hour_counts, hour_of
 from libs.security import check_password_requirements
 
+from database.data_access_models import DataCoverage, DataFreshness
+from database.profiling_models import DataVolumeRollup
 from database.study_models import Study, StudyField
 from database.user_models import Researcher, Participant, ParticipantFieldValue
 
 admin_pages = Blueprint('admin_pages', __name__)
 
+# the number of days of the data coverage heatmap of the view_study page
+COVERAGE_HEATMAP_DAYS = 14
+
 # TODO: Document.
 
 
@@ -46,8 +55,15 @@ def view_study(study_id=None):
     participants = study.participants.all()
 
     study_fields = list(study.fields.all().values_list('field_name', flat=True))
+    coverage_days, daily_coverage = get_data_coverage_heatmap(study)
+    uploaded_bytes = get_uploaded_bytes(study)
+    stream_uploads = get_last_uploads(study)
     for p in participants:
         p.values_dict = {tag.field.field_name: tag.value for tag in p.field_values.all()}
+        p.daily_coverage = daily_coverage.get(p.pk, [0] * COVERAGE_HEATMAP_DAYS)
+        p.uploaded_megabytes = uploaded_bytes.get(p.pk, 0) / 1024. / 1024.
+        p.stream_uploads = stream_uploads.get(p.pk, [])
+        p.last_upload = max(last_upload for _, last_upload in p.stream_uploads) if p.stream_uploads else None
 
     return render_template(
         'view_study.html',
@@ -59,6 +75,46 @@ def view_study(study_id=None):
         allowed_studies=get_admins_allowed_studies(),
         system_admin=admin_is_system_admin(),
         study_fields=study_fields,
+        coverage_days=coverage_days,
+    )
+
+
+def get_data_coverage_heatmap(study):
+    """ Returns the last COVERAGE_HEATMAP_DAYS days (utc) and a dictionary of participant pks to
+    the number of hours of each of those days that have any data, from the data coverage index. """
+    first_day = datetime.utcnow().date() - timedelta(days=COVERAGE_HEATMAP_DAYS - 1)
+    start_hour = hour_of(datetime(first_day.year, first_day.month, first_day.day))
+    bitmaps = defaultdict(list)
+    for participant_pk, first_hour, bitmap in DataCoverage.objects.filter(participant__study=study).values_list(
+            "participant_id", "first_hour", "bitmap"):
+        bitmaps[participant_pk].append((bytearray(bitmap), first_hour))
+    coverage_days = [(first_day + timedelta(days=day)).strftime("%m/%d") for day in range(COVERAGE_HEATMAP_DAYS)]
+    daily_coverage = {
+        participant_pk: daily_hour_counts(participant_bitmaps, start_hour, COVERAGE_HEATMAP_DAYS)
+        for participant_pk, participant_bitmaps in bitmaps.iteritems()
+    }
+    return coverage_days, daily_coverage
+
+
+def get_last_uploads(study):
+    """ Returns a dictionary of participant pks to a list of (data stream, last upload time) pairs,
+    from the data freshness table. """
+    stream_uploads = defaultdict(list)
+    for participant_pk, data_type, last_upload in DataFreshness.objects.filter(
+            study=study, last_upload__isnull=False).order_by("data_type").values_list(
+            "participant_id", "data_type", "last_upload"):
+        stream_uploads[participant_pk].append((data_type, last_upload))
+    return stream_uploads
+
+
+def get_uploaded_bytes(study):
+    """ Returns a dictionary of participant pks to the bytes they uploaded in the days of the data
+    coverage heatmap, from the data volume rollups. """
+    first_day = datetime.utcnow().date() - timedelta(days=COVERAGE_HEATMAP_DAYS - 1)
+    return dict(
+        DataVolumeRollup.objects.filter(study=study, day__gte=first_day).values("participant_id").annotate(
+            total_bytes=Sum("bytes")
+        ).values_list("participant_id", "total_bytes")
     )
 
 
@@ -17,11 +17,10 @@ def fetch_graph():
     patient_id = request.values['patient_id']
     participant = Participant.objects.get(patient_id=patient_id)
     # See docs in config manipulations for details
-    study_object_id = participant.study.object_id
-    survey_object_id_set = participant.study.surveys.values_list('object_id', flat=True)
+    survey_id_set = participant.study.surveys.values_list('pk', flat=True)
     data = []
-    for survey_id in survey_object_id_set:
-        data.append(get_survey_results(study_object_id, patient_id, survey_id, 7))
+    for survey_id in survey_id_set:
+        data.append(get_survey_results(participant.pk, survey_id, 7))
     return render_template("phone_graphs.html", data=data)
 
 
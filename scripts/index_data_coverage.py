@@ -0,0 +1,42 @@
+# modify python path so that this script can be targeted directly but still import everything.
+import imp as _imp
+from os.path import abspath as _abspath
+_current_folder_init = _abspath(__file__).rsplit('/', 1)[0]+ "/__init__.py"
+_imp.load_source("__init__", _current_folder_init)
+
+# Builds the data coverage index (see libs.data_coverage) from the ChunkRegistry, for the chunks
+# registered before the index existed.  The index of every participant and data stream is
+# replaced, this can be rerun.
+from config import load_django
+from database.data_access_models import ChunkRegistry, DataCoverage
+from libs.data_coverage import hour_of, set_hour
+
+chunks = ChunkRegistry.objects.order_by("participant_id", "data_type").values_list(
+    "participant_id", "data_type", "time_bin"
+)
+
+
+def save_coverage(participant_pk, data_type, bitmap, first_hour):
+    DataCoverage.objects.update_or_create(
+        participant_id=participant_pk, data_type=data_type,
+        defaults={"first_hour": first_hour, "bitmap": bytes(bitmap)},
+    )
+
+
+current = None
+bitmap, first_hour = bytearray(), None
+indexed = 0
+for participant_pk, data_type, time_bin in chunks.iterator():
+    if (participant_pk, data_type) != current:
+        if current is not None:
+            save_coverage(current[0], current[1], bitmap, first_hour)
+            indexed += 1
+        current = (participant_pk, data_type)
+        bitmap, first_hour = bytearray(), None
+    bitmap, first_hour, _ = set_hour(bitmap, first_hour, hour_of(time_bin))
+
+if current is not None:
+    save_coverage(current[0], current[1], bitmap, first_hour)
+    indexed += 1
+
+print "indexed %s participant data streams" % indexed
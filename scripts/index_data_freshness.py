@@ -0,0 +1,43 @@
+# modify python path so that this script can be targeted directly but still import everything.
+import imp as _imp
+from os.path import abspath as _abspath
+_current_folder_init = _abspath(__file__).rsplit('/', 1)[0]+ "/__init__.py"
+_imp.load_source("__init__", _current_folder_init)
+
+# Builds the data freshness table (see DataFreshness) from the ChunkRegistry and the
+# UploadTracking records, for the data that was registered before the table existed.  This
+# aggregates over both tables once, it can be rerun (app versions are not backfilled, they were
+# not recorded).
+from config import load_django
+from django.db.models import Max
+from database.data_access_models import ChunkRegistry, DataFreshness
+from database.profiling_models import UploadTracking
+from database.user_models import Participant
+from libs.volume_rollups import upload_data_type
+
+study_pks = dict(Participant.objects.values_list("pk", "study_id"))
+last_time_bins = ChunkRegistry.objects.values("participant_id", "data_type").annotate(
+    last_time_bin=Max("time_bin")
+).values_list("participant_id", "data_type", "last_time_bin")
+
+indexed = 0
+for participant_pk, data_type, last_time_bin in last_time_bins.iterator():
+    DataFreshness.record_chunk(study_pks[participant_pk], participant_pk, data_type, last_time_bin)
+    indexed += 1
+print "indexed the chunks of %s participant data streams" % indexed
+
+# (upload paths are grouped by data stream here, UploadTracking has no data stream column)
+last_uploads = {}
+for participant_pk, file_path, timestamp in UploadTracking.objects.values_list(
+        "participant_id", "file_path", "timestamp").iterator():
+    key = (participant_pk, upload_data_type(file_path))
+    if key[1] is not None and (key not in last_uploads or timestamp > last_uploads[key]):
+        last_uploads[key] = timestamp
+
+for (participant_pk, data_type), last_upload in last_uploads.iteritems():
+    freshness = DataFreshness.objects.filter(participant_id=participant_pk, data_type=data_type)
+    if not freshness.exclude(last_upload__gte=last_upload).update(last_upload=last_upload):
+        if not freshness.exists():
+            DataFreshness.objects.create(study_id=study_pks[participant_pk], participant_id=participant_pk,
+                                         data_type=data_type, last_upload=last_upload)
+print "indexed the uploads of %s participant data streams" % len(last_uploads)
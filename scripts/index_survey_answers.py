@@ -0,0 +1,32 @@
+# modify python path so that this script can be targeted directly but still import everything.
+import imp as _imp
+from os.path import abspath as _abspath
+_current_folder_init = _abspath(__file__).rsplit('/', 1)[0]+ "/__init__.py"
+_imp.load_source("__init__", _current_folder_init)
+
+# Indexes the survey answers files that were processed before the survey answers index existed,
+# see libs.survey_answers.  Files that are already indexed are indexed again, this can be rerun.
+from config import load_django
+from config.constants import SURVEY_ANSWERS
+from database.data_access_models import ChunkRegistry
+from database.study_models import Survey
+from libs.s3 import s3_retrieve
+from libs.survey_answers import index_survey_answers
+
+survey_pks = dict(Survey.objects.values_list("object_id", "pk"))
+chunks = ChunkRegistry.objects.filter(data_type=SURVEY_ANSWERS).values_list(
+    "chunk_path", "time_bin", "participant_id", "study__object_id"
+)
+
+indexed_files = 0
+for chunk_path, time_bin, participant_pk, study_object_id in chunks.iterator():
+    # survey answers files are in study/participant/surveyAnswers/survey/timestamp.csv
+    survey_pk = survey_pks.get(chunk_path.rsplit("/", 2)[1])
+    if survey_pk is None:
+        continue
+    index_survey_answers(participant_pk, survey_pk, time_bin, s3_retrieve(chunk_path, study_object_id, raw_path=True))
+    indexed_files += 1
+    if indexed_files % 1000 == 0:
+        print "indexed %s files" % indexed_files
+
+print "indexed %s files" % indexed_files
@@ -0,0 +1,31 @@
+# modify python path so that this script can be targeted directly but still import everything.
+import imp as _imp
+from os.path import abspath as _abspath
+_current_folder_init = _abspath(__file__).rsplit('/', 1)[0]+ "/__init__.py"
+_imp.load_source("__init__", _current_folder_init)
+
+# Builds the files and bytes of the data volume rollups (see libs.volume_rollups) from the
+# UploadTracking records of the uploads recorded before the rollups existed.  Run it once, before
+# new uploads are rolled up, the rollups are added to rather than replaced.  (Processed rows are
+# not backfilled, the rows of existing chunks were not recorded by day.)
+from config import load_django
+from database.profiling_models import DataVolumeRollup, UploadTracking
+from libs.volume_rollups import roll_up_uploads
+
+BATCH_SIZE = 10000
+
+if DataVolumeRollup.objects.filter(files__gt=0).exists():
+    print "there are already upload rollups, not rolling up the upload tracking again"
+    exit(1)
+
+uploads = UploadTracking.objects.select_related("participant").order_by("pk")
+batch = []
+for i, upload in enumerate(uploads.iterator()):
+    batch.append(upload)
+    if len(batch) == BATCH_SIZE:
+        roll_up_uploads(batch)
+        batch = []
+        print "rolled up %s uploads..." % (i + 1)
+roll_up_uploads(batch)
+
+print "rolled up %s uploads" % uploads.count()
@@ -46,10 +46,14 @@ except IOError:
 from time import sleep
 from datetime import datetime, timedelta
 
-from config.constants import FILE_PROCESS_PAGE_SIZE, CELERY_EXPIRY_MINUTES, CELERY_ERROR_REPORT_TIMEOUT_SECONDS
-from database.data_access_models import FileProcessLock
+from config.constants import (FILE_PROCESS_PAGE_SIZE, CELERY_EXPIRY_MINUTES, CELERY_ERROR_REPORT_TIMEOUT_SECONDS,
+    PENDING_UPLOAD_MAX_ATTEMPTS)
+from database.data_access_models import DataExport, FileProcessLock
 from database.user_models import Participant
+from libs.data_exports import build_data_export, fail_stale_data_exports, start_data_export
 from libs.file_processing import ProcessingOverlapError, do_process_user_file_chunks
+from libs.upload_processing import process_pending_uploads
+from libs.upload_spool import upload_spool_enabled, upload_spool_stats
 from libs.logging import email_system_administrators
 from libs.sentry import make_error_sentry
 
@@ -209,6 +213,118 @@ def celery_process_file_chunks(participant_id):
                 break
             else:
                 continue
-                
+    
+    if upload_spool_enabled():
+        log.append(upload_spool_stats())
+    
     with make_error_sentry('data', tags=tags):
-        error_sentry.raise_errors()
\ No newline at end of file
+        error_sentry.raise_errors()
+
+################################################################################
+########################### Deferred Uploads ###################################
+################################################################################
+
+
+@celery_app.task
+def queue_pending_uploads(participant_id):
+    return celery_process_pending_uploads(participant_id)
+
+queue_pending_uploads.max_retries = 0
+
+
+def create_upload_processing_tasks():
+    """ Queues a celery task for every participant with deferred uploads. Unlike file processing
+    this does not lock, tasks that overlap skip the uploads claimed by the other task (see
+    libs.upload_processing.claim_pending_upload). """
+    with make_error_sentry('data'):
+        expiry = datetime.now() + timedelta(minutes=CELERY_EXPIRY_MINUTES)
+        participant_set = Participant.objects.filter(
+            pending_uploads__attempts__lt=PENDING_UPLOAD_MAX_ATTEMPTS
+        ).distinct().values_list("id", flat=True)
+        for participant_id in participant_set:
+            for i in xrange(10):
+                try:
+                    queue_pending_uploads.apply_async(
+                        args=[participant_id],
+                        max_retries=0,
+                        expires=expiry,
+                        task_track_started=True,
+                        task_publish_retry=False,
+                        retry=False
+                    )
+                    break
+                except OperationalError:
+                    # see safe_queue_user
+                    if i >= 3:
+                        raise
+        print("queued deferred upload processing for %s participants." % len(participant_set))
+
+
+def celery_process_pending_uploads(participant_id):
+    """ Decrypts and registers all deferred uploads of a participant, uploads that error are left
+    for the next run. This runs as a Celery task. """
+    participant = Participant.objects.get(id=participant_id)
+    tags = {'user_id': participant.patient_id}
+    error_sentry = make_error_sentry('data', tags=tags)
+    number_errors = 0
+    
+    while True:
+        starting_length = participant.pending_uploads.count()
+        print("%s decrypting uploads for %s, %s remaining" % (datetime.now(), participant.patient_id, starting_length))
+        number_errors = process_pending_uploads(participant, error_sentry)
+        # stop when a page made no progress (every upload in it errored, or there are none left).
+        if participant.pending_uploads.count() >= starting_length or number_errors:
+            break
+    
+    with make_error_sentry('data', tags=tags):
+        error_sentry.raise_errors()
+
+################################################################################
+############################## Data Exports ####################################
+################################################################################
+
+
+@celery_app.task
+def queue_data_export(data_export_id):
+    return celery_build_data_export(data_export_id)
+
+queue_data_export.max_retries = 0
+
+
+def create_data_export_tasks():
+    """ Queues a celery task for every queued data export.  An export that is still queued on the
+    next run is queued again, only one of its tasks builds it.  Exports whose task died while
+    building them are marked as failed. """
+    with make_error_sentry('data'):
+        number_stale = fail_stale_data_exports()
+        if number_stale:
+            print("marked %s stale data exports as failed." % number_stale)
+        expiry = datetime.now() + timedelta(minutes=CELERY_EXPIRY_MINUTES)
+        data_export_ids = list(DataExport.objects.filter(status=DataExport.QUEUED).values_list("id", flat=True))
+        for data_export_id in data_export_ids:
+            for i in xrange(10):
+                try:
+                    queue_data_export.apply_async(
+                        args=[data_export_id],
+                        max_retries=0,
+                        expires=expiry,
+                        task_track_started=True,
+                        task_publish_retry=False,
+                        retry=False
+                    )
+                    break
+                except OperationalError:
+                    # see safe_queue_user
+                    if i >= 3:
+                        raise
+        print("queued %s data exports." % len(data_export_ids))
+
+
+def celery_build_data_export(data_export_id):
+    """ Builds a queued data export. This runs as a Celery task. """
+    if not start_data_export(data_export_id):
+        return
+    data_export = DataExport.objects.get(id=data_export_id)
+    with make_error_sentry('data', tags={'data_export_id': data_export_id}):
+        print("%s building data export %s" % (datetime.now(), data_export_id))
+        build_data_export(data_export)
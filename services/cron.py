@@ -7,7 +7,11 @@ _imp.load_source("__init__", _current_folder_init)
 # start actual cron-related code here
 from sys import argv
 from cronutils import run_tasks
-from services.celery_data_processing import create_file_processing_tasks
+from services.celery_data_processing import (create_data_export_tasks, create_file_processing_tasks,
+    create_upload_processing_tasks)
+from libs.data_exports import prune_data_exports
+from libs.download_snapshots import prune_download_snapshots
+from libs.upload_processing import prune_upload_fingerprints
 from pipeline import index
 
 FIVE_MINUTES = "five_minutes"
@@ -29,10 +33,10 @@ VALID_ARGS = [FIVE_MINUTES, HOURLY, FOUR_HOURLY, DAILY, WEEKLY, MONTHLY]
 # 48 4 1 * * : monthly; cd $PROJECT_PATH; chronic python cron.py monthly
 
 TASKS = {
-    FIVE_MINUTES: [create_file_processing_tasks],
+    FIVE_MINUTES: [create_file_processing_tasks, create_upload_processing_tasks, create_data_export_tasks],
     HOURLY: [index.hourly],
     FOUR_HOURLY: [],
-    DAILY: [index.daily],
+    DAILY: [index.daily, prune_upload_fingerprints, prune_download_snapshots, prune_data_exports],
     WEEKLY: [index.weekly],
     MONTHLY: [index.monthly],
 }